@@ -6,10 +6,12 @@ app_name = 'custom_admin'
 urlpatterns = [
     # Dashboard
     path('', views.admin_dashboard, name='dashboard'),
+    path('dashboard/refresh/', views.dashboard_refresh, name='dashboard_refresh'),
     
     # Products
     path('products/', views.product_list, name='product_list'),
     path('products/create/', views.product_create, name='product_create'),
+    path('products/import/', views.product_import, name='product_import'),
     path('products/<slug:product_slug>/', views.product_detail, name='product_detail'),
     path('products/<slug:product_slug>/delete/', views.product_delete, name='product_delete'),
     
@@ -25,6 +27,7 @@ urlpatterns = [
     
     # Orders
     path('orders/', views.order_list, name='order_list'),
+    path('orders/export/', views.order_export, name='order_export'),
     path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
     path('orders/<int:order_id>/invoice/', views.order_invoice, name='order_invoice'),
     
@@ -58,4 +61,5 @@ urlpatterns = [
     path('delivery-options/<int:pk>/delete/', views.deliveryoption_delete, name='deliveryoption_delete'),
     # AJAX endpoints
     path('ajax/order-status/', views.quick_status_update, name='quick_status_update'),
+    path('ajax/products/bulk-update/', views.product_bulk_update, name='product_bulk_update'),
 ]
@@ -5,14 +5,27 @@ from django.contrib.auth import logout, authenticate, login
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.db.models import Q, Sum, Count
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
+from django.db import transaction
 from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
+import io
 import json
 
-from store.models import Product, Category, Order, OrderItem, HeroBanner, SiteSettings, UserVisit, OnlineUser, OrderStatusHistory, DeliveryOption, ProductImage
+from store.models import Product, Category, Order, OrderItem, HeroBanner, SiteSettings, OnlineUser, OrderStatusHistory, DeliveryOption, ProductImage, TrafficDaily
+from store.catalog_import import ProductImporter
+from store.inventory import set_stock
+from store.category_tree import CategoryTree
+from store.order_search import search_orders
+from store.phone import normalize_phone
+from store.dashboard import get_snapshot, monthly_sales, rebuild as rebuild_dashboard
+from store.visit_rollups import get_rollups, summarize
+from store.bulk import PRODUCT_FLAGS, parse_positions, bulk_set_order, bulk_set_flag, bulk_toggle, bulk_set_stock
+from store.catalog_cache import bump_catalog_version
+
+from .exports import ORDER_LINE_HEADERS, order_line_rows, stream_csv, stream_xlsx
 
 # Check if user is staff
 def is_staff(user):
@@ -86,60 +99,41 @@ def deliveryoption_delete(request, pk):
 def admin_dashboard(request):
     """Main dashboard view with overview statistics"""
     
-    # Basic statistics
-    total_products = Product.objects.count()
-    total_orders = Order.objects.count()
-    total_categories = Category.objects.count()
-    
-    # Revenue calculations
-    total_revenue = Order.objects.aggregate(
-        total=Sum('total_amount')
-    )['total'] or 0
-    
-    # Visit statistics
-    today = timezone.now().date()
-    today_visits = UserVisit.objects.filter(date=today).count()
-    current_online = OnlineUser.objects.count()
+    # All figures come from the precomputed snapshot (see store.dashboard)
+    snapshot = get_snapshot()
     
     # Recent orders
     recent_orders = Order.objects.order_by('-created_at')[:5]
     
-    # Top selling products
-    top_products = Product.objects.annotate(
-        total_sold=Sum('orderitem__quantity')
-    ).order_by('-total_sold')[:5]
-    
-    # Low stock alerts
-    low_stock_products = Product.objects.filter(stock_quantity__lt=10)
-    
-    # Monthly sales data for chart
-    monthly_sales = []
-    for i in range(12):
-        month_start = timezone.now().replace(day=1) - timedelta(days=30*i)
-        month_end = month_start + timedelta(days=31)
-        month_revenue = Order.objects.filter(
-            created_at__range=[month_start, month_end]
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        monthly_sales.append({
-            'month': month_start.strftime('%b %Y'),
-            'revenue': float(month_revenue)
-        })
+    # Visit statistics
+    today = timezone.localdate()
+    today_visits = snapshot.today_visits if snapshot.visits_date == today else 0
     
     context = {
-        'total_products': total_products,
-        'total_orders': total_orders,
-        'total_categories': total_categories,
-        'total_revenue': total_revenue,
+        'total_products': snapshot.total_products,
+        'total_orders': snapshot.total_orders,
+        'total_categories': snapshot.total_categories,
+        'total_revenue': snapshot.total_revenue,
         'today_visits': today_visits,
-        'current_online': current_online,
+        'current_online': snapshot.current_online,
         'recent_orders': recent_orders,
-        'top_products': top_products,
-        'low_stock_products': low_stock_products,
-        'monthly_sales': json.dumps(monthly_sales[::-1]),  # Reverse for chronological order
+        'top_products': snapshot.top_products,
+        'low_stock_products': snapshot.low_stock_products,
+        'monthly_sales': json.dumps(monthly_sales(snapshot)),
+        'snapshot_updated_at': snapshot.updated_at,
+        'snapshot_rebuilt_at': snapshot.rebuilt_at,
     }
     
     return render(request, 'custom_admin/dashboard.html', context)
 
+@admin_required
+@require_http_methods(["POST"])
+def dashboard_refresh(request):
+    """Recompute the dashboard snapshot now"""
+    rebuild_dashboard()
+    messages.success(request, 'Dashboard figures recalculated.')
+    return redirect('custom_admin:dashboard')
+
 @admin_required
 def product_list(request):
     """List all products with search and filtering"""
@@ -222,6 +216,7 @@ def product_detail(request, product_slug):
             else:
                 product.original_price = None
                 
+            old_stock = product.stock_quantity
             product.stock_quantity = int(request.POST.get('stock', product.stock_quantity))
             product.category_id = request.POST.get('category', product.category_id)
             
@@ -234,6 +229,9 @@ def product_detail(request, product_slug):
                 product.image = request.FILES['image']
             
             product.save()
+            if product.inventory_sharded and product.stock_quantity != old_stock:
+                # Spread the new total over the stock shards
+                set_stock(product, product.stock_quantity)
             messages.success(request, f'Product "{product.name}" updated successfully!')
             
         elif action == 'add_images':
@@ -317,6 +315,40 @@ def product_create(request):
     return render(request, 'custom_admin/product_create.html', context)
 
 
+@admin_required
+def product_import(request):
+    """Bulk import products from an uploaded CSV or JSONL catalog file"""
+    
+    from django.conf import settings as django_settings
+    image_dir = getattr(django_settings, 'PRODUCT_IMPORT_IMAGE_DIR', None)
+    report = None
+    
+    if request.method == 'POST':
+        upload = request.FILES.get('catalog')
+        if not upload:
+            messages.error(request, 'Please choose a CSV or JSONL file to import.')
+        else:
+            file_format = 'jsonl' if upload.name.endswith(('.jsonl', '.ndjson')) else 'csv'
+            key = 'sku' if request.POST.get('key') == 'sku' else 'slug'
+            importer = ProductImporter(
+                key=key,
+                image_dir=image_dir if request.POST.get('attach_images') else None,
+                create_categories='create_categories' in request.POST,
+            )
+            report = importer.run(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''), file_format)
+            if report.errors:
+                messages.warning(request, f'Import finished with {len(report.errors)} rejected rows.')
+            else:
+                messages.success(request, f'Imported {report.imported} products successfully!')
+    
+    context = {
+        'report': report,
+        'errors': report.errors[:100] if report else [],
+        'image_dir': image_dir,
+    }
+    return render(request, 'custom_admin/product_import.html', context)
+
+
 @admin_required
 def product_image_delete(request, image_id):
     """Delete a product image"""
@@ -336,12 +368,10 @@ def product_image_reorder(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            image_orders = data.get('image_orders', [])
-            
-            for item in image_orders:
-                image_id = item.get('id')
-                new_order = item.get('order')
-                ProductImage.objects.filter(id=image_id).update(order=new_order)
+            image_orders = parse_positions(data.get('image_orders', []))
+            bulk_set_order(ProductImage.objects.all(), image_orders)
+            # A queryset update sends no signals; let cached storefront pages revalidate
+            bump_catalog_version()
             
             return JsonResponse({'success': True, 'message': 'Images reordered successfully!'})
         except Exception as e:
@@ -360,21 +390,18 @@ def product_delete(request, product_slug):
     messages.success(request, f'Product "{product_name}" deleted successfully!')
     return redirect('custom_admin:product_list')
 
-@admin_required
-def order_list(request):
-    """List all orders with filtering and search"""
-    
-    orders = Order.objects.prefetch_related('items__product').all()
+def filter_orders(request, orders):
+    """Apply the order list search, status and date filters from the query string"""
     
     # Search functionality
     search_query = request.GET.get('search', '')
     if search_query:
-        orders = orders.filter(
-            Q(id__icontains=search_query) |
-            Q(customer_name__icontains=search_query) |
-            Q(customer_email__icontains=search_query) |
-            Q(customer_phone__icontains=search_query)
-        )
+        orders = search_orders(orders, search_query)
+    
+    # Customer history: every order from one phone number
+    phone_filter = request.GET.get('phone', '')
+    if phone_filter:
+        orders = orders.filter(phone_normalized=normalize_phone(phone_filter))
     
     # Status filter
     status_filter = request.GET.get('status', '')
@@ -392,6 +419,19 @@ def order_list(request):
         month_ago = timezone.now() - timedelta(days=30)
         orders = orders.filter(created_at__gte=month_ago)
     
+    return orders, {
+        'search_query': search_query,
+        'phone_filter': phone_filter,
+        'status_filter': status_filter,
+        'date_filter': date_filter,
+    }
+
+@admin_required
+def order_list(request):
+    """List all orders with filtering and search"""
+    
+    orders, filters = filter_orders(request, Order.objects.prefetch_related('items__product').all())
+    
     # Sorting
     sort_by = request.GET.get('sort', '-created_at')
     orders = orders.order_by(sort_by)
@@ -412,15 +452,37 @@ def order_list(request):
     
     context = {
         'page_obj': page_obj,
-        'search_query': search_query,
-        'status_filter': status_filter,
-        'date_filter': date_filter,
         'sort_by': sort_by,
         'status_choices': status_choices,
+        'export_query': request.GET.urlencode(),
+        **filters,
     }
     
     return render(request, 'custom_admin/order_list.html', context)
 
+@admin_required
+def order_export(request):
+    """Stream the filtered orders as CSV or XLSX, one row per order line"""
+    
+    orders, _ = filter_orders(request, Order.objects.all())
+    export_format = request.GET.get('format', 'csv')
+    filename = f"orders-{timezone.now().strftime('%Y%m%d-%H%M%S')}"
+    rows = order_line_rows(orders)
+    
+    if export_format == 'xlsx':
+        response = StreamingHttpResponse(
+            stream_xlsx(ORDER_LINE_HEADERS, rows),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}.xlsx"'
+    else:
+        response = StreamingHttpResponse(
+            stream_csv(ORDER_LINE_HEADERS, rows),
+            content_type='text/csv; charset=utf-8'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
 @admin_required
 def order_detail(request, order_id):
     """View and manage order details"""
@@ -627,12 +689,9 @@ def banner_reorder(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            banner_orders = data.get('banner_orders', [])
-            
-            for item in banner_orders:
-                banner_id = item.get('id')
-                new_order = item.get('order')
-                HeroBanner.objects.filter(id=banner_id).update(order=new_order)
+            banner_orders = parse_positions(data.get('banner_orders', []))
+            bulk_set_order(HeroBanner.objects.all(), banner_orders)
+            bump_catalog_version()
             
             return JsonResponse({'success': True, 'message': 'Banners reordered successfully!'})
         except Exception as e:
@@ -708,15 +767,21 @@ def analytics_view(request):
             })
             current_date += timedelta(days=1)
     
-    # User visit statistics
+    # User visit statistics, all read from the daily rollups
     today = timezone.now().date()
+    yesterday = today - timedelta(days=1)
+    month_start = today.replace(day=1)
+    week_start = today - timedelta(days=6)
+    rollups = get_rollups(min(month_start, week_start), today)
+    
+    def visits_on(day):
+        return rollups[day].visits if day in rollups else 0
     
     # Today's visits
-    today_visits = UserVisit.objects.filter(date=today).count()
+    today_visits = visits_on(today)
     
     # Yesterday's visits for comparison
-    yesterday = today - timedelta(days=1)
-    yesterday_visits = UserVisit.objects.filter(date=yesterday).count()
+    yesterday_visits = visits_on(yesterday)
     
     # Calculate percentage change
     visit_change = today_visits - yesterday_visits
@@ -728,19 +793,36 @@ def analytics_view(request):
     # Current online users (active in last 5 minutes)
     current_online = OnlineUser.objects.count()
     
-    # Total visits this month
-    month_start = today.replace(day=1)
-    month_visits = UserVisit.objects.filter(date__gte=month_start).count()
+    # Visits this month, with unique visitors estimated from the merged sketches
+    month_summary = summarize(rollup for day, rollup in rollups.items() if day >= month_start)
+    month_visits = month_summary['visits']
     
     # Daily visits for the past 7 days
     daily_visits = []
     for i in range(6, -1, -1):
         check_date = today - timedelta(days=i)
-        visits_count = UserVisit.objects.filter(date=check_date).count()
         daily_visits.append({
             'date': check_date.strftime('%Y-%m-%d'),
-            'visits': visits_count
+            'visits': visits_on(check_date)
         })
+    week_summary = summarize(rollup for day, rollup in rollups.items() if day >= week_start)
+    
+    # Requests by traffic class over the same 7 days
+    traffic = dict(
+        TrafficDaily.objects.filter(date__gte=week_start)
+        .values_list('traffic_class')
+        .annotate(total=Sum('requests'))
+        .order_by()
+    )
+    # Rate-limited requests were already counted under their own class
+    traffic_total = sum(count for traffic_class, count in traffic.items() if traffic_class != 'rate_limited')
+    week_traffic = {
+        'human': traffic.get('human', 0),
+        'bot': traffic.get('bot', 0),
+        'health_check': traffic.get('health_check', 0),
+        'rate_limited': traffic.get('rate_limited', 0),
+        'bot_percent': (traffic_total - traffic.get('human', 0)) * 100 / traffic_total if traffic_total else 0,
+    }
     
     context = {
         'total_orders': total_orders,
@@ -758,6 +840,9 @@ def analytics_view(request):
         'visit_change_percent': visit_change_percent,
         'current_online': current_online,
         'month_visits': month_visits,
+        'month_unique_visitors': month_summary['unique_visitors'],
+        'week_summary': week_summary,
+        'week_traffic': week_traffic,
         'daily_visits': json.dumps(daily_visits),
     }
     
@@ -854,31 +939,51 @@ def settings_view(request):
     return render(request, 'custom_admin/settings.html', context)
 
 
+# featured_products actions: (field, value), where None flips the current value
+FEATURED_ACTIONS = {
+    'toggle_featured': ('is_featured', None),
+    'toggle_bestseller': ('is_best_seller', None),
+    'set_featured': ('is_featured', True),
+    'unset_featured': ('is_featured', False),
+    'set_bestseller': ('is_best_seller', True),
+    'unset_bestseller': ('is_best_seller', False),
+}
+
+
 @admin_required
 def featured_products(request):
     """Manage featured products and best sellers"""
     
     if request.method == 'POST':
         action = request.POST.get('action')
-        product_id = request.POST.get('product_id')
+        # Row buttons post one product_id; the bulk bar posts the checked product_ids
+        product_ids = request.POST.getlist('product_ids') or request.POST.getlist('product_id')
+        products = Product.objects.filter(id__in=[pk for pk in product_ids if pk.isdigit()])
         
         try:
-            product = Product.objects.get(id=product_id)
-            
-            if action == 'toggle_featured':
-                product.is_featured = not product.is_featured
-                product.save()
-                status = 'featured' if product.is_featured else 'not featured'
-                messages.success(request, f'"{product.name}" is now {status}.')
+            if action not in FEATURED_ACTIONS:
+                messages.error(request, 'Unknown action.')
+            elif not product_ids:
+                messages.error(request, 'Select at least one product.')
+            else:
+                field, value = FEATURED_ACTIONS[action]
+                if value is None:
+                    updated = bulk_toggle(products, field)
+                else:
+                    updated = bulk_set_flag(products, field, value)
                 
-            elif action == 'toggle_bestseller':
-                product.is_best_seller = not product.is_best_seller
-                product.save()
-                status = 'a best seller' if product.is_best_seller else 'not a best seller'
-                messages.success(request, f'"{product.name}" is now {status}.')
+                if not updated:
+                    messages.error(request, 'Product not found.')
+                elif value is None and updated == 1:
+                    product = products.get()
+                    if field == 'is_featured':
+                        status = 'featured' if product.is_featured else 'not featured'
+                    else:
+                        status = 'a best seller' if product.is_best_seller else 'not a best seller'
+                    messages.success(request, f'"{product.name}" is now {status}.')
+                else:
+                    messages.success(request, f'Updated {updated} product(s).')
                 
-        except Product.DoesNotExist:
-            messages.error(request, 'Product not found.')
         except Exception as e:
             messages.error(request, f'Error updating product: {str(e)}')
         
@@ -906,6 +1011,42 @@ def featured_products(request):
     return render(request, 'custom_admin/featured_products.html', context)
 
 # AJAX Views
+@admin_required
+@require_http_methods(["POST"])
+def product_bulk_update(request):
+    """
+    Apply a batch of product changes via AJAX.
+
+    Accepts JSON like {"ids": [1, 2], "is_featured": true} to set flags on
+    many products, {"ids": [1, 2], "toggle": "is_best_seller"} to flip one,
+    and {"stock": [{"id": 1, "stock_quantity": 5}, ...]} to edit stock.
+    """
+    try:
+        data = json.loads(request.body)
+        products = Product.objects.filter(id__in=[int(pk) for pk in data.get('ids', [])])
+        updated = 0
+        
+        with transaction.atomic():
+            for field in PRODUCT_FLAGS:
+                if field in data:
+                    updated = max(updated, bulk_set_flag(products, field, bool(data[field])))
+            if data.get('toggle'):
+                updated = max(updated, bulk_toggle(products, data['toggle']))
+            if data.get('stock'):
+                updated = max(updated, bulk_set_stock(parse_positions(data['stock'], key='stock_quantity')))
+        
+        return JsonResponse({
+            'success': True,
+            'updated': updated,
+            'message': f'Updated {updated} product(s).'
+        })
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({
+            'success': False,
+            'message': str(e)
+        }, status=400)
+
+
 @admin_required
 @require_http_methods(["POST"])
 def quick_status_update(request):
@@ -1026,8 +1167,9 @@ def admin_profile(request):
 def category_list(request):
     """List all categories with hierarchical structure and search functionality"""
     
-    # Get root categories first
-    categories = Category.objects.filter(parent=None).prefetch_related('children').order_by('name')
+    # One query for the whole hierarchy, with product counts
+    tree = CategoryTree.load(with_counts=True)
+    categories = tree.roots
     
     # Search functionality
     search_query = request.GET.get('search', '')
@@ -1040,16 +1182,7 @@ def category_list(request):
     # If searching, show all matching categories (not just root)
     if not search_query:
         # For non-search view, build hierarchical structure
-        def build_category_tree(categories):
-            tree = []
-            for category in categories:
-                tree.append({
-                    'category': category,
-                    'children': build_category_tree(category.children.order_by('name'))
-                })
-            return tree
-        
-        category_tree = build_category_tree(categories)
+        category_tree = tree.nested()
     else:
         category_tree = None
     
@@ -1057,13 +1190,14 @@ def category_list(request):
     paginator = Paginator(categories, 20)
     page_number = request.GET.get('page')
     categories_page = paginator.get_page(page_number)
+    tree.decorate(categories_page)
     
     context = {
         'categories': categories_page,
         'category_tree': category_tree,
         'search_query': search_query,
-        'total_categories': Category.objects.count(),
-        'root_categories_count': Category.objects.filter(parent=None).count(),
+        'total_categories': len(tree),
+        'root_categories_count': len(tree.roots),
     }
     
     return render(request, 'custom_admin/category_list.html', context)
@@ -1085,7 +1219,8 @@ def category_detail(request, category_slug):
             try:
                 parent_category = Category.objects.get(id=parent_id)
                 # Prevent circular reference
-                if not parent_category.is_child_of(category) and parent_category != category:
+                tree = CategoryTree.load()
+                if not tree.is_descendant(parent_category.pk, category.pk) and parent_category != category:
                     category.parent = parent_category
                 else:
                     messages.error(request, 'Cannot set parent: This would create a circular reference!')
@@ -1108,17 +1243,16 @@ def category_detail(request, category_slug):
             messages.error(request, f'Error updating category: {str(e)}')
     
     # Get products in this category and subcategories
+    tree = CategoryTree.load(with_counts=True)
+    node = tree.get(category.pk)
     products = category.products.all()[:10]
-    product_count = category.products.count()
+    product_count = node.product_count
     
     # Get subcategory products count
-    subcategory_product_count = 0
-    for child in category.get_all_children():
-        subcategory_product_count += child.products.count()
+    subcategory_product_count = sum(tree.get(pk).product_count for pk in tree.descendant_ids(category.pk))
     
     # Get possible parent categories (exclude self and its children)
-    excluded_ids = [category.id] + [child.id for child in category.get_all_children()]
-    possible_parents = Category.objects.exclude(id__in=excluded_ids).order_by('name')
+    possible_parents = sorted(tree.walk(exclude=category.pk), key=lambda parent: parent.name)
     
     context = {
         'category': category,
@@ -1126,9 +1260,9 @@ def category_detail(request, category_slug):
         'product_count': product_count,
         'subcategory_product_count': subcategory_product_count,
         'possible_parents': possible_parents,
-        'children': category.children.all(),
-        'full_path': category.full_path,
-        'level': category.get_level(),
+        'children': tree.children_of(category.pk),
+        'full_path': node.path,
+        'level': node.level,
     }
     
     return render(request, 'custom_admin/category_detail.html', context)
@@ -1155,8 +1289,8 @@ def category_create(request):
         except Exception as e:
             messages.error(request, f'Error creating category: {str(e)}')
     
-    # Get all categories for parent selection
-    categories = Category.objects.all().order_by('name')
+    # Get all categories for parent selection, children listed under their parent
+    categories = list(CategoryTree.load().walk())
     
     context = {
         'categories': categories,
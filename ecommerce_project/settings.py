@@ -41,18 +41,23 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'store',
     'custom_admin',
 ]
 
 MIDDLEWARE = [
+    'store.conditional.CachePolicyMiddleware',
+    'store.traffic.TrafficClassificationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'store.cart.CartMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'store.ratelimit.RateLimitMiddleware',
     'store.middleware.UserTrackingMiddleware',
 ]
 
@@ -70,6 +75,7 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'store.context_processors.cart_count',
                 'store.context_processors.site_settings',
+                'store.context_processors.deferred_csrf',
             ],
         },
     },
@@ -92,6 +98,24 @@ DATABASES = {
     }
 }
 
+# Cache. Checkout admission buckets, rate limits, coupon and catalog versions,
+# idempotency keys and the price campaign lock are kept here, so with more than
+# one worker process it must be shared: set CACHE_BACKEND to 'redis' or
+# 'memcached' and CACHE_LOCATION to the server (e.g. redis://127.0.0.1:6379/1
+# or 127.0.0.1:11211). The default local-memory cache is per process and only
+# fit for development.
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[os.getenv('CACHE_BACKEND', 'locmem')],
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -142,3 +166,112 @@ MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Inventory
+# Number of counter rows used for products flagged with inventory_sharded
+INVENTORY_SHARD_COUNT = int(os.getenv('INVENTORY_SHARD_COUNT', '8'))
+
+# Garbage collection of sessions and carts (see store.maintenance)
+CART_RETENTION_DAYS = int(os.getenv('CART_RETENTION_DAYS', '30'))
+GC_BATCH_SIZE = int(os.getenv('GC_BATCH_SIZE', '1000'))
+# How often a request may trigger a small cleanup pass (0 disables it; use cron instead)
+GC_INTERVAL_SECONDS = int(os.getenv('GC_INTERVAL_SECONDS', '3600'))
+GC_REQUEST_MAX_BATCHES = 2
+
+# Visit tracking: how often a visitor's OnlineUser row is refreshed
+ONLINE_USER_REFRESH_SECONDS = 60
+
+# Cart storage (see store.cart): 'cookie', 'cache' or 'db'
+CART_BACKEND = os.getenv('CART_BACKEND', 'cookie')
+# Cookie carts with more distinct products than this move to the database
+CART_COOKIE_MAX_LINES = 20
+# How often cache-backed carts are written back to CartItem rows
+CART_CACHE_PERSIST_SECONDS = 300
+
+# Server-side folder the custom admin product import may copy images from
+PRODUCT_IMPORT_IMAGE_DIR = os.getenv('PRODUCT_IMPORT_IMAGE_DIR') or None
+
+# Reverse proxies in front of Django that append to X-Forwarded-For (see
+# store.ratelimit.get_client_ip). 0 uses REMOTE_ADDR and ignores the header,
+# which any client can set.
+TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', '0'))
+
+# "My orders" lookups allowed per client IP per window (seconds)
+ORDER_HISTORY_RATE_LIMIT = int(os.getenv('ORDER_HISTORY_RATE_LIMIT', '10'))
+ORDER_HISTORY_RATE_WINDOW = int(os.getenv('ORDER_HISTORY_RATE_WINDOW', '900'))
+
+# Admin dashboard snapshot (see store.dashboard): recomputed from scratch by
+# the `rebuild_dashboard` command (run it from cron). Queued order, product
+# and category changes are merged when the dashboard is opened (or by
+# `rebuild_dashboard --pending`); today's visits and online users are
+# re-counted at most once per DASHBOARD_COUNTS_SECONDS
+DASHBOARD_COUNTS_SECONDS = int(os.getenv('DASHBOARD_COUNTS_SECONDS', '60'))
+
+# Visit analytics (see store.visit_rollups): raw UserVisit rows are kept this
+# many days; today's rollup is recomputed when older than VISIT_ROLLUP_MAX_AGE
+VISIT_RETENTION_DAYS = int(os.getenv('VISIT_RETENTION_DAYS', '90'))
+VISIT_ROLLUP_MAX_AGE = 300
+
+# Page and product view counters (see store.popularity): flushed from memory
+# this often. Trending scores are recomputed by the `update_popularity`
+# command (run it from cron, e.g. hourly) from the last POPULARITY_WINDOW_DAYS
+# of views plus weighted units sold
+VIEW_COUNTER_FLUSH_SECONDS = int(os.getenv('VIEW_COUNTER_FLUSH_SECONDS', '60'))
+POPULARITY_WINDOW_DAYS = 30
+POPULARITY_HALF_LIFE_DAYS = 7
+POPULARITY_SALES_WEIGHT = 20
+
+# Co-purchase recommendations (see store.recommendations): products kept per
+# product, and where the build_recommendations command keeps its counts
+RECOMMENDATION_TOP_K = 12
+RECOMMENDATION_STATE_FILE = os.getenv('RECOMMENDATION_STATE_FILE', str(BASE_DIR / 'recommendations.npz'))
+
+# Traffic classification (see store.traffic): paths answered with a bare
+# 200 for load balancers, and IPs/networks always treated as people or bots
+HEALTH_CHECK_PATHS = ['/healthz']
+TRAFFIC_HUMAN_IPS = [value for value in os.getenv('TRAFFIC_HUMAN_IPS', '').split(',') if value]
+TRAFFIC_BOT_IPS = [value for value in os.getenv('TRAFFIC_BOT_IPS', '').split(',') if value]
+
+# Cached category menu and carousel HTML (see store.navigation); category
+# changes show at once in the worker that made them, elsewhere within this
+NAV_FRAGMENT_TIMEOUT = int(os.getenv('NAV_FRAGMENT_TIMEOUT', '300'))
+
+# Facet counts on product listings (see store.facets) are cached per listing and selection for this long
+FACET_CACHE_SECONDS = int(os.getenv('FACET_CACHE_SECONDS', '60'))
+
+# How often a request may check for price campaigns to start or end (see store.pricing); 0 leaves it to cron
+PRICE_CAMPAIGN_CHECK_SECONDS = int(os.getenv('PRICE_CAMPAIGN_CHECK_SECONDS', '60'))
+
+# Longest a worker keeps its compiled coupon rules (see store.coupons); coupon edits apply at once in the
+# worker that made them
+COUPON_RULES_SECONDS = int(os.getenv('COUPON_RULES_SECONDS', '300'))
+
+# How long a placed order's checkout key is answered from the cache (see store.idempotency); the database keeps it
+CHECKOUT_IDEMPOTENCY_SECONDS = int(os.getenv('CHECKOUT_IDEMPOTENCY_SECONDS', str(24 * 60 * 60)))
+
+# Flash-sale admission control for checkout (see store.admission): shoppers let in per second, how
+# many may get in at once before that rate applies, and how long an admission ticket lasts. This is a
+# rate, not a cap on shoppers checking out at the same time. A rate of 0 turns the gate off.
+CHECKOUT_ADMISSION_RATE = float(os.getenv('CHECKOUT_ADMISSION_RATE', '0'))
+CHECKOUT_ADMISSION_BURST = int(os.getenv('CHECKOUT_ADMISSION_BURST', '50'))
+CHECKOUT_TICKET_SECONDS = int(os.getenv('CHECKOUT_TICKET_SECONDS', str(15 * 60)))
+
+# Token buckets per URL name (see store.ratelimit.RateLimitMiddleware): tokens per second and burst for each
+# visitor (visitor_id cookie); each client IP gets RATE_LIMIT_IP_FACTOR times that. "param" limits only requests carrying it.
+RATE_LIMITS = {
+    'products': {'rate': 1, 'burst': 20, 'param': 'search'},
+    'track_order': {'rate': 0.2, 'burst': 10},
+    'order_tracking_details': {'rate': 0.2, 'burst': 10},
+    'add_to_cart': {'rate': 2, 'burst': 30},
+    'buy_now': {'rate': 1, 'burst': 10},
+    'update_cart': {'rate': 2, 'burst': 30},
+    'remove_from_cart': {'rate': 2, 'burst': 30},
+}
+RATE_LIMIT_IP_FACTOR = int(os.getenv('RATE_LIMIT_IP_FACTOR', '4'))
+
+# Conditional GET for storefront pages (see store.conditional): RELEASE identifies the deploy (e.g. the git SHA;
+# unset, all workers share a value seeded in the cache), validators roll over every CONDITIONAL_VERSION_SECONDS,
+# and anonymous pages may be kept by a CDN or reverse proxy for PAGE_CACHE_SECONDS
+RELEASE = os.getenv('RELEASE', '')
+CONDITIONAL_VERSION_SECONDS = int(os.getenv('CONDITIONAL_VERSION_SECONDS', '300'))
+PAGE_CACHE_SECONDS = int(os.getenv('PAGE_CACHE_SECONDS', '60'))
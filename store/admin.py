@@ -1,7 +1,16 @@
 from django.contrib import admin
+from django.urls import reverse
 from django.utils.html import format_html
+from django.utils.http import urlencode
 from django import forms
-from .models import Category, Product, HeroBanner, CartItem, Order, OrderItem, DeliveryOption, ProductImage
+from django.db import transaction
+from django.db.models import Count, Sum
+from .models import Category, Product, HeroBanner, CartItem, Order, OrderItem, DeliveryOption, ProductImage, InventoryShard, PriceCampaign, Coupon
+from .inventory import rebalance, set_stock
+from .bulk import bulk_set_flag, bulk_set_stock
+from .category_tree import CategoryTree
+from .order_search import search_orders
+from .pricing import cancel_campaign
 
 class CategoryForm(forms.ModelForm):
     class Meta:
@@ -10,16 +19,11 @@ class CategoryForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Create a better hierarchy display for parent selection
+        # Create a better hierarchy display for parent selection; the current
+        # category and its descendants are left out to prevent circular references
+        self.tree = CategoryTree.load()
         choices = [('', '--- Root Category (No Parent) ---')]
-        
-        # Get all root categories and build the tree
-        for category in Category.objects.filter(parent=None).order_by('name'):
-            # Skip current category to prevent self-reference
-            if self.instance and self.instance.pk == category.pk:
-                continue
-            choices.append((category.pk, category.name))
-            self._add_children(category, choices, level=1)
+        choices += self.tree.indented_choices(exclude=self.instance.pk)
         
         self.fields['parent'].choices = choices
         self.fields['parent'].widget.attrs.update({
@@ -27,27 +31,6 @@ class CategoryForm(forms.ModelForm):
             'style': 'font-family: monospace; min-height: 200px;'
         })
     
-    def _add_children(self, category, choices, level=0):
-        """Recursively add children with proper indentation"""
-        indent = '├' + '─' * level + ' '
-        for child in category.children.all().order_by('name'):
-            # Skip current category and its descendants to prevent circular reference
-            if self.instance and (self.instance.pk == child.pk or self._is_descendant(child)):
-                continue
-            choices.append((child.pk, f'{indent}{child.name}'))
-            self._add_children(child, choices, level + 1)
-    
-    def _is_descendant(self, category):
-        """Check if category is a descendant of current instance"""
-        if not self.instance or not self.instance.pk:
-            return False
-        parent = category.parent
-        while parent:
-            if parent.pk == self.instance.pk:
-                return True
-            parent = parent.parent
-        return False
-    
     def clean_parent(self):
         """Validate parent selection to prevent circular references"""
         parent = self.cleaned_data.get('parent')
@@ -57,26 +40,23 @@ class CategoryForm(forms.ModelForm):
                 raise forms.ValidationError("A category cannot be its own parent.")
             
             # Check if trying to set a descendant as parent
-            if self._is_descendant_of_instance(parent):
+            if self.tree.is_descendant(parent.pk, self.instance.pk):
                 raise forms.ValidationError("Cannot set a descendant category as parent.")
         
         return parent
+
+class ParentCategoryFilter(admin.RelatedFieldListFilter):
+    """Parent filter whose choices come from one tree query instead of str() per category"""
     
-    def _is_descendant_of_instance(self, category):
-        """Check if category is a descendant of current instance"""
-        current = category.parent
-        while current:
-            if current.pk == self.instance.pk:
-                return True
-            current = current.parent
-        return False
+    def field_choices(self, field, request, model_admin):
+        return CategoryTree.load().indented_choices(marker='', fill='— ')
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     form = CategoryForm
     list_display = ['indented_name', 'slug', 'get_level', 'products_count', 'created_at']
     search_fields = ['name', 'slug']
-    list_filter = ['created_at', 'parent']
+    list_filter = ['created_at', ('parent', ParentCategoryFilter)]
     prepopulated_fields = {'slug': ('name',)}
     ordering = ['parent__name', 'name']
     
@@ -85,33 +65,120 @@ class CategoryAdmin(admin.ModelAdmin):
             'all': ('admin/css/custom_admin.css',)
         }
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(product_count=Count('products'))
+    
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        # Levels for the whole page come from one tree query
+        CategoryTree.load().decorate(changelist.result_list)
+        return changelist
+    
     def indented_name(self, obj):
         """Display category name with indentation based on level"""
-        level = obj.get_level()
+        level = self.get_level(obj)
         indent = '—' * level + ' ' if level > 0 else ''
-        level_class = f'level-{level}'
-        return format_html(f'<span class="{level_class}">{indent}{obj.name}</span>')
+        return format_html('<span class="level-{}">{}{}</span>', level, indent, obj.name)
     indented_name.short_description = 'Category Name'
     
     def get_level(self, obj):
         """Display the hierarchy level"""
-        return obj.get_level()
+        level = getattr(obj, 'level', None)
+        return obj.get_level() if level is None else level
     get_level.short_description = 'Level'
     
     def products_count(self, obj):
         """Display number of products in this category"""
-        return obj.products.count()
+        return obj.product_count
     products_count.short_description = 'Products'
+    products_count.admin_order_field = 'product_count'
+
+class InventoryShardInline(admin.TabularInline):
+    model = InventoryShard
+    fields = ['shard', 'quantity']
+    readonly_fields = ['shard', 'quantity']
+    extra = 0
+    can_delete = False
+    
+    def has_add_permission(self, request, obj=None):
+        return False
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'category', 'display_price', 'stock_quantity', 'is_best_seller', 'is_featured', 'is_in_stock']
-    list_filter = ['category', 'is_best_seller', 'is_featured', 'created_at']
+    list_display = ['name', 'slug', 'category', 'display_price', 'stock_quantity', 'is_best_seller', 'is_featured', 'popularity_score', 'is_in_stock']
+    list_filter = ['category', 'is_best_seller', 'is_featured', 'inventory_sharded', 'created_at']
     search_fields = ['name', 'slug', 'description']
     list_editable = ['stock_quantity', 'is_best_seller', 'is_featured']
     list_per_page = 20
-    fields = ['name', 'slug', 'description', 'category', 'image', 'youtube_url', 'original_price', 'price', 'stock_quantity', 'is_best_seller', 'is_featured']
+    fields = ['name', 'slug', 'description', 'category', 'image', 'youtube_url', 'original_price', 'price', 'stock_quantity', 'inventory_sharded', 'is_best_seller', 'is_featured']
     prepopulated_fields = {'slug': ('name',)}
+    inlines = [InventoryShardInline]
+    actions = [
+        'mark_featured', 'unmark_featured', 'mark_best_seller', 'unmark_best_seller', 'rebalance_inventory'
+    ]
+    
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'POST' or '_save' not in request.POST:
+            return super().changelist_view(request, extra_context)
+        # list_editable rows are queued by save_model and written in a few set-based statements
+        request._list_edits = {}
+        with transaction.atomic():
+            response = super().changelist_view(request, extra_context)
+            self.save_list_edits(request._list_edits)
+        return response
+    
+    def save_list_edits(self, edits):
+        """Write queued changelist edits: one UPDATE per flag value plus one for stock"""
+        for field in ('is_featured', 'is_best_seller'):
+            for value in (True, False):
+                ids = [pk for pk, changes in edits.items() if changes.get(field) is value]
+                if ids:
+                    bulk_set_flag(Product.objects.filter(pk__in=ids), field, value)
+        bulk_set_stock({
+            pk: changes['stock_quantity'] for pk, changes in edits.items() if 'stock_quantity' in changes
+        })
+    
+    def save_model(self, request, obj, form, change):
+        list_edits = getattr(request, '_list_edits', None)
+        if change and list_edits is not None and form.prefix:
+            list_edits[obj.pk] = {field: form.cleaned_data[field] for field in form.changed_data}
+            return
+        sharding_changed = 'inventory_sharded' in form.changed_data
+        if change and sharding_changed and not obj.inventory_sharded and 'stock_quantity' not in form.changed_data:
+            # Sharding switched off: fold the shards back into the product row
+            obj.stock_quantity = InventoryShard.objects.filter(product=obj).aggregate(
+                total=Sum('quantity')
+            )['total'] or 0
+        super().save_model(request, obj, form, change)
+        if sharding_changed or (obj.inventory_sharded and 'stock_quantity' in form.changed_data):
+            set_stock(obj, obj.stock_quantity)
+    
+    def set_flag(self, request, queryset, field, value, label):
+        updated = bulk_set_flag(queryset, field, value)
+        self.message_user(request, f'{updated} product(s) {label}.')
+    
+    @admin.action(description='Mark selected products as featured')
+    def mark_featured(self, request, queryset):
+        self.set_flag(request, queryset, 'is_featured', True, 'marked as featured')
+    
+    @admin.action(description='Remove selected products from featured')
+    def unmark_featured(self, request, queryset):
+        self.set_flag(request, queryset, 'is_featured', False, 'removed from featured')
+    
+    @admin.action(description='Mark selected products as best sellers')
+    def mark_best_seller(self, request, queryset):
+        self.set_flag(request, queryset, 'is_best_seller', True, 'marked as best sellers')
+    
+    @admin.action(description='Remove selected products from best sellers')
+    def unmark_best_seller(self, request, queryset):
+        self.set_flag(request, queryset, 'is_best_seller', False, 'removed from best sellers')
+    
+    @admin.action(description='Rebalance sharded inventory')
+    def rebalance_inventory(self, request, queryset):
+        products = queryset.filter(inventory_sharded=True)
+        for product in products:
+            rebalance(product)
+        self.message_user(request, f'Rebalanced inventory for {len(products)} product(s).')
     
     def display_price(self, obj):
         if obj.has_discount:
@@ -124,6 +191,55 @@ class ProductAdmin(admin.ModelAdmin):
         return f'৳{obj.price}'
     display_price.short_description = 'Price'
 
+@admin.register(Coupon)
+class CouponAdmin(admin.ModelAdmin):
+    list_display = ['code', 'kind', 'value', 'times_used', 'usage_limit', 'per_phone_limit', 'starts_at', 'ends_at', 'is_active']
+    list_filter = ['kind', 'is_active', 'created_at']
+    search_fields = ['code', 'description']
+    list_editable = ['is_active']
+    filter_horizontal = ['categories']
+    readonly_fields = ['times_used']
+
+@admin.register(PriceCampaign)
+class PriceCampaignAdmin(admin.ModelAdmin):
+    list_display = ['name', 'percent_off', 'starts_at', 'ends_at', 'status', 'product_count']
+    list_filter = ['status', 'starts_at']
+    search_fields = ['name']
+    filter_horizontal = ['products', 'categories']
+    readonly_fields = ['status', 'applied_at', 'reverted_at']
+    actions = ['cancel_campaigns']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(product_count=Count('overrides'))
+    
+    def product_count(self, obj):
+        return obj.product_count
+    product_count.short_description = 'Products repriced'
+    
+    def has_change_permission(self, request, obj=None):
+        # Prices are applied when the campaign starts; edit a scheduled one or cancel it
+        if obj is not None and obj.status != 'scheduled':
+            return False
+        return super().has_change_permission(request, obj)
+    
+    # Deleting a running campaign would cascade away its overrides and leave the
+    # campaign prices in place for good, so campaigns are cancelled first
+    def delete_model(self, request, obj):
+        cancel_campaign(obj.pk)
+        super().delete_model(request, obj)
+    
+    def delete_queryset(self, request, queryset):
+        for pk in queryset.filter(status__in=['scheduled', 'active']).values_list('pk', flat=True):
+            cancel_campaign(pk)
+        super().delete_queryset(request, queryset)
+    
+    @admin.action(description='Cancel selected campaigns (restores prices)')
+    def cancel_campaigns(self, request, queryset):
+        campaigns = list(queryset.filter(status__in=['scheduled', 'active']).values_list('pk', flat=True))
+        for pk in campaigns:
+            cancel_campaign(pk)
+        self.message_user(request, f'Cancelled {len(campaigns)} campaign(s).')
+
 @admin.register(HeroBanner)
 class HeroBannerAdmin(admin.ModelAdmin):
     list_display = ['title', 'is_active', 'order', 'created_at']
@@ -152,13 +268,34 @@ class OrderItemInline(admin.TabularInline):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['order_id', 'customer_name', 'customer_phone', 'total_amount', 'status', 'created_at']
+    list_display = ['order_id', 'customer_name', 'customer_history', 'total_amount', 'status', 'created_at']
     list_filter = ['status', 'payment_method', 'created_at']
     search_fields = ['order_id', 'customer_name', 'customer_phone']
     list_editable = ['status']
     readonly_fields = ['order_id', 'created_at', 'updated_at']
     inlines = [OrderItemInline]
     
+    def customer_history(self, obj):
+        """Phone number linking to every order placed from it"""
+        if not obj.phone_normalized:
+            return obj.customer_phone
+        url = reverse('admin:store_order_changelist') + '?' + urlencode({'phone_normalized': obj.phone_normalized})
+        return format_html('<a href="{}" title="All orders from this phone">{}</a>', url, obj.customer_phone)
+    customer_history.short_description = 'Phone'
+    customer_history.admin_order_field = 'customer_phone'
+    
+    def lookup_allowed(self, lookup, value, request=None):
+        # ?phone_normalized=... is the customer history filter used by customer_history
+        if lookup == 'phone_normalized':
+            return True
+        return super().lookup_allowed(lookup, value, request)
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Route the search to the one index that fits the query's shape
+        if not search_term.strip():
+            return queryset, False
+        return search_orders(queryset, search_term), False
+    
     fieldsets = (
         ('Order Information', {
             'fields': ('order_id', 'status', 'payment_method', 'subtotal', 'delivery_option', 'delivery_fee', 'total_amount')
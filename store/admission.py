@@ -0,0 +1,90 @@
+"""
+Admission control for checkout during flash sales.
+
+With ``CHECKOUT_ADMISSION_RATE`` set, reaching checkout takes a token from
+a shared token bucket (``store.ratelimit.take_token``): this limits the
+rate at which shoppers are let in, not how many are checking out at once.
+A burst of up to ``CHECKOUT_ADMISSION_BURST`` shoppers gets in straight
+away, then ``CHECKOUT_ADMISSION_RATE`` more per second. An admitted browser
+gets a signed ticket cookie valid for ``CHECKOUT_TICKET_SECONDS`` and
+passes straight through until it expires. Everyone else is sent to a
+waiting room, a static page rendered without context processors or
+queries, which polls ``waiting_room_status`` until a token is free.
+
+The cookie outlives the ticket by another ``CHECKOUT_TICKET_SECONDS``. A
+form posted in that grace period still goes through, so a shopper whose
+ticket ran out while filling in the checkout form does not lose it.
+
+Only checkout is gated; browsing and the cart are never held up. A rate of
+0 (the default) turns the gate off.
+"""
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.utils.http import url_has_allowed_host_and_scheme, urlencode
+
+from .ratelimit import take_token
+
+TICKET_COOKIE_NAME = 'checkout_ticket'
+TICKET_COOKIE_SALT = 'store.admission.ticket'
+BUCKET_KEY = 'checkout_admission'
+
+
+def enabled():
+    return getattr(settings, 'CHECKOUT_ADMISSION_RATE', 0) > 0
+
+
+def ticket_seconds():
+    return getattr(settings, 'CHECKOUT_TICKET_SECONDS', 15 * 60)
+
+
+def has_ticket(request, grace=False):
+    """True if the browser holds an unexpired ticket, or one within its grace period"""
+    max_age = ticket_seconds() * (2 if grace else 1)
+    ticket = request.get_signed_cookie(TICKET_COOKIE_NAME, default=None, salt=TICKET_COOKIE_SALT, max_age=max_age)
+    return ticket is not None
+
+
+def admit(now=None):
+    """(admitted, seconds to wait) for one more shopper"""
+    return take_token(
+        BUCKET_KEY,
+        getattr(settings, 'CHECKOUT_ADMISSION_RATE', 0),
+        getattr(settings, 'CHECKOUT_ADMISSION_BURST', 50),
+        now,
+    )
+
+
+def grant_ticket(response):
+    response.set_signed_cookie(
+        TICKET_COOKIE_NAME,
+        uuid.uuid4().hex,
+        salt=TICKET_COOKIE_SALT,
+        max_age=ticket_seconds() * 2,
+        httponly=True,
+        samesite='Lax',
+    )
+    return response
+
+
+def safe_next(request, url):
+    """url if it points back at this site, else the checkout page"""
+    if url and url_has_allowed_host_and_scheme(url, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+        return url
+    return reverse('checkout')
+
+
+def admission_required(view):
+    """Send shoppers without a ticket to the waiting room unless a token is free"""
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if not enabled() or has_ticket(request, grace=request.method == 'POST'):
+            return view(request, *args, **kwargs)
+        admitted, _ = admit()
+        if admitted:
+            return grant_ticket(view(request, *args, **kwargs))
+        return redirect(f"{reverse('waiting_room')}?{urlencode({'next': request.get_full_path()})}")
+    return wrapped
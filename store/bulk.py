@@ -0,0 +1,101 @@
+"""
+Set-based updates for admin bulk edits.
+
+Each helper turns a batch of per-row changes into a fixed number of
+statements - one ``UPDATE ... SET col = CASE id WHEN ... END`` or
+``UPDATE ... WHERE id IN (...)`` - so reordering or toggling 5 rows costs
+the same as 500. Like ``QuerySet.update()`` they don't call ``save()`` and
+don't send model signals; the product helpers refresh the product cards
+(store.product_cards) themselves.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .dashboard import record_stock_change
+from .inventory import set_stock
+from .product_cards import refresh_cards
+from .models import Product
+
+# Product fields the bulk endpoints are allowed to flip
+PRODUCT_FLAGS = ('is_featured', 'is_best_seller')
+
+
+def parse_positions(items, key='order'):
+    """
+    Turn a [{'id': .., 'order': ..}, ...] payload into a {pk: value} mapping.
+
+    Raises ValueError for ids or values that are not whole numbers.
+    """
+    positions = {}
+    for item in items:
+        value = int(item[key])
+        if value < 0:
+            raise ValueError(f'{key} cannot be negative')
+        positions[int(item['id'])] = value
+    return positions
+
+
+def _case(field, values):
+    return Case(
+        *[When(pk=pk, then=Value(value)) for pk, value in values.items()],
+        default=F(field),
+        output_field=IntegerField(),
+    )
+
+
+def bulk_set_order(queryset, positions, field='order'):
+    """Write {pk: position} in one UPDATE and return the number of rows changed"""
+    if not positions:
+        return 0
+    return queryset.filter(pk__in=list(positions)).update(**{field: _case(field, positions)})
+
+
+def bulk_set_flag(queryset, field, value):
+    """Set a boolean product flag on every row of queryset in one UPDATE"""
+    if field not in PRODUCT_FLAGS:
+        raise ValueError(f'Unknown product flag "{field}"')
+    ids = list(queryset.values_list('pk', flat=True))
+    updated = Product.objects.filter(pk__in=ids).update(**{field: value, 'updated_at': timezone.now()})
+    refresh_cards(ids)
+    return updated
+
+
+def bulk_toggle(queryset, field):
+    """Flip a boolean product flag on every row of queryset in one UPDATE"""
+    if field not in PRODUCT_FLAGS:
+        raise ValueError(f'Unknown product flag "{field}"')
+    ids = list(queryset.values_list('pk', flat=True))
+    updated = Product.objects.filter(pk__in=ids).update(**{field: ~F(field), 'updated_at': timezone.now()})
+    refresh_cards(ids)
+    return updated
+
+
+def bulk_set_stock(quantities):
+    """
+    Write {product pk: stock} and return the number of products changed.
+
+    Normal products are updated in one CASE statement. Sharded products have
+    their stock spread over shard rows, which ``set_stock`` does per product.
+    """
+    if not quantities:
+        return 0
+    if any(quantity < 0 for quantity in quantities.values()):
+        raise ValueError('Stock cannot be negative')
+
+    with transaction.atomic():
+        sharded = list(Product.objects.filter(pk__in=list(quantities), inventory_sharded=True))
+        sharded_ids = {product.pk for product in sharded}
+        plain = {pk: quantity for pk, quantity in quantities.items() if pk not in sharded_ids}
+        updated = 0
+        if plain:
+            updated = Product.objects.filter(pk__in=list(plain)).update(
+                stock_quantity=_case('stock_quantity', plain),
+                updated_at=timezone.now(),
+            )
+        for product in sharded:
+            set_stock(product, quantities[product.pk])
+        # Queryset updates send no signals; update the read models directly
+        record_stock_change(quantities)
+        refresh_cards(quantities)
+        return updated + len(sharded)
@@ -0,0 +1,353 @@
+"""
+Shopping cart storage.
+
+All cart reads and writes go through ``get_cart(request)``, which returns a
+cart object for the backend selected by ``settings.CART_BACKEND``:
+
+* ``cookie`` - small carts live in a compact signed cookie, so the badge
+  count and cart mutations never touch the database. Carts that grow past
+  ``CART_COOKIE_MAX_LINES`` move to the database store.
+* ``cache`` - carts live in the cache keyed by session, and are written
+  back to ``CartItem`` every ``CART_CACHE_PERSIST_SECONDS``.
+* ``db`` - carts live in ``CartItem`` rows (the durable store).
+
+Lines are keyed by product id, so ``CartLine.id`` is the product id in
+every backend. ``CartMiddleware`` writes pending cookie changes to the
+response.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .models import CartItem, Product
+
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_SALT = 'store.cart'
+# Cookie value for carts that have moved to the database store
+CART_COOKIE_IN_DB = 'db'
+
+
+class CartLine:
+    """A product and quantity in a cart, shaped like a CartItem for templates"""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def id(self):
+        return self.product.id
+
+    @property
+    def product_id(self):
+        return self.product.id
+
+    @property
+    def total_price(self):
+        return self.product.price * self.quantity
+
+
+class BaseCart:
+    """Cart kept as an ordered {product_id: quantity} mapping"""
+
+    def __init__(self, request):
+        self.request = request
+        self._lines = None
+
+    # Storage hooks
+
+    def load(self):
+        """Return the stored {product_id: quantity} mapping"""
+        raise NotImplementedError
+
+    def save(self, lines):
+        """Store the {product_id: quantity} mapping"""
+        raise NotImplementedError
+
+    def finalize(self, response):
+        """Write pending changes to the response (for client-side stores)"""
+
+    def persist(self):
+        """Make sure the cart is in the durable CartItem store"""
+
+    # Reading
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = self.load()
+        return self._lines
+
+    def count(self):
+        """Total number of units in the cart"""
+        return sum(self.lines.values())
+
+    def product_ids(self):
+        return list(self.lines)
+
+    def get_quantity(self, product_id):
+        return self.lines.get(product_id, 0)
+
+    def is_empty(self):
+        return not self.lines
+
+    def items(self):
+        """Cart lines with their products, loaded in one query"""
+        if not self.lines:
+            return []
+        products = Product.objects.select_related('category').in_bulk(list(self.lines))
+        return [
+            CartLine(products[product_id], quantity)
+            for product_id, quantity in self.lines.items()
+            if product_id in products
+        ]
+
+    def total(self):
+        return sum(line.total_price for line in self.items())
+
+    # Mutations
+
+    def add(self, product, quantity=1):
+        lines = dict(self.lines)
+        lines[product.id] = lines.get(product.id, 0) + quantity
+        self._store(lines)
+
+    def set_quantity(self, product_id, quantity):
+        lines = dict(self.lines)
+        if quantity > 0:
+            lines[product_id] = quantity
+        else:
+            lines.pop(product_id, None)
+        self._store(lines)
+
+    def remove(self, product_id):
+        self.set_quantity(product_id, 0)
+
+    def clear(self):
+        self._store({})
+
+    def _store(self, lines):
+        self._lines = lines
+        self.save(lines)
+
+    def ensure_session(self):
+        """Carts that need a key get a session on their first mutation"""
+        if not self.request.session.session_key:
+            self.request.session.create()
+        return self.request.session.session_key
+
+
+class DatabaseCart(BaseCart):
+    """Cart stored as CartItem rows keyed by session"""
+
+    def queryset(self):
+        session_key = self.request.session.session_key
+        if not session_key:
+            return CartItem.objects.none()
+        return CartItem.objects.filter(session_key=session_key)
+
+    def load(self):
+        return dict(self.queryset().order_by('created_at').values_list('product_id', 'quantity'))
+
+    def count(self):
+        if self._lines is not None:
+            return sum(self._lines.values())
+        return self.queryset().aggregate(total=Sum('quantity'))['total'] or 0
+
+    def items(self):
+        return [
+            CartLine(item.product, item.quantity)
+            for item in self.queryset().select_related('product__category').order_by('created_at')
+        ]
+
+    def add(self, product, quantity=1):
+        cart_item, created = CartItem.objects.get_or_create(
+            session_key=self.ensure_session(),
+            product=product,
+            defaults={'quantity': quantity}
+        )
+        if not created:
+            cart_item.quantity += quantity
+            cart_item.save()
+        self._lines = None
+
+    def set_quantity(self, product_id, quantity):
+        if quantity > 0:
+            CartItem.objects.update_or_create(
+                session_key=self.ensure_session(),
+                product_id=product_id,
+                defaults={'quantity': quantity}
+            )
+        else:
+            self.queryset().filter(product_id=product_id).delete()
+        self._lines = None
+
+    def clear(self):
+        self.queryset().delete()
+        self._lines = {}
+
+    def save(self, lines):
+        session_key = self.ensure_session()
+        self.queryset().exclude(product_id__in=list(lines)).delete()
+        if lines:
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(session_key=session_key, product_id=product_id, quantity=quantity)
+                    for product_id, quantity in lines.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['session_key', 'product'],
+                update_fields=['quantity', 'updated_at'],
+            )
+
+
+class CookieCart(BaseCart):
+    """Small carts in a signed cookie; large ones spill over to CartItem rows"""
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.database = DatabaseCart(request)
+        self.in_database = False
+        self.changed = False
+
+    def load(self):
+        value = self.request.get_signed_cookie(CART_COOKIE_NAME, default='', salt=CART_COOKIE_SALT)
+        if value == CART_COOKIE_IN_DB:
+            self.in_database = True
+            return self.database.load()
+        return self.decode(value)
+
+    def save(self, lines):
+        self.changed = True
+        if len(lines) > getattr(settings, 'CART_COOKIE_MAX_LINES', 20):
+            self.in_database = True
+        elif self.in_database and not lines:
+            # Emptied large cart: go back to the cookie store
+            self.database.clear()
+            self.in_database = False
+        if self.in_database:
+            self.database.save(lines)
+
+    def persist(self):
+        # The cookie stays the cart being edited; CartItem rows get a copy
+        if self.lines and not self.in_database:
+            self.database.save(self.lines)
+
+    def clear(self):
+        self._lines = {}
+        self.changed = True
+        self.in_database = False
+        if self.request.session.session_key:
+            # Spilled-over lines, or the copy persist() made at checkout
+            self.database.clear()
+
+    def finalize(self, response):
+        if not self.changed:
+            return
+        if self.in_database:
+            value = CART_COOKIE_IN_DB
+        elif self.lines:
+            value = self.encode(self.lines)
+        else:
+            response.delete_cookie(CART_COOKIE_NAME)
+            return
+        response.set_signed_cookie(
+            CART_COOKIE_NAME,
+            value,
+            salt=CART_COOKIE_SALT,
+            max_age=getattr(settings, 'CART_COOKIE_AGE', 60 * 60 * 24 * 30),
+            httponly=True,
+            samesite='Lax',
+        )
+
+    @staticmethod
+    def encode(lines):
+        return ','.join(f'{product_id}:{quantity}' for product_id, quantity in lines.items())
+
+    @staticmethod
+    def decode(value):
+        lines = {}
+        for part in value.split(','):
+            try:
+                product_id, quantity = part.split(':')
+                product_id, quantity = int(product_id), int(quantity)
+            except ValueError:
+                continue
+            if quantity > 0:
+                lines[product_id] = quantity
+        return lines
+
+
+class CacheCart(BaseCart):
+    """Carts in the cache, written back to CartItem rows periodically"""
+
+    def cache_key(self):
+        return f'cart:{self.request.session.session_key}'
+
+    def load(self):
+        if not self.request.session.session_key:
+            return {}
+        data = cache.get(self.cache_key())
+        if data is None:
+            # Cache miss or eviction: fall back to the durable copy
+            lines = DatabaseCart(self.request).load()
+            cache.set(self.cache_key(), {'lines': lines, 'persisted_at': time.time()}, self.timeout())
+            return lines
+        return data['lines']
+
+    def save(self, lines):
+        self.ensure_session()
+        data = cache.get(self.cache_key()) or {'persisted_at': 0}
+        interval = getattr(settings, 'CART_CACHE_PERSIST_SECONDS', 300)
+        if time.time() - data['persisted_at'] >= interval:
+            DatabaseCart(self.request).save(lines)
+            data['persisted_at'] = time.time()
+        data['lines'] = lines
+        cache.set(self.cache_key(), data, self.timeout())
+
+    def persist(self):
+        if self.request.session.session_key:
+            DatabaseCart(self.request).save(self.lines)
+            cache.set(self.cache_key(), {'lines': self.lines, 'persisted_at': time.time()}, self.timeout())
+
+    def clear(self):
+        self._lines = {}
+        if self.request.session.session_key:
+            DatabaseCart(self.request).clear()
+            cache.delete(self.cache_key())
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, 'CART_CACHE_TIMEOUT', 60 * 60 * 24 * 7)
+
+
+CART_BACKENDS = {
+    'cookie': CookieCart,
+    'cache': CacheCart,
+    'db': DatabaseCart,
+}
+
+
+def get_cart(request):
+    """Return the cart for this request, creating it once per request"""
+    cart = getattr(request, '_cart', None)
+    if cart is None:
+        backend = CART_BACKENDS[getattr(settings, 'CART_BACKEND', 'cookie')]
+        cart = request._cart = backend(request)
+    return cart
+
+
+class CartMiddleware:
+    """Write pending cart changes (e.g. the cart cookie) to the response"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        cart = getattr(request, '_cart', None)
+        if cart is not None:
+            cart.finalize(response)
+        return response
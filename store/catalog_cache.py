@@ -0,0 +1,22 @@
+"""
+Catalog cache version.
+
+Data derived from the catalog is cached under the current catalog version:
+the facet counts in ``store.facets`` and the page validators in
+``store.conditional``. Rewriting product cards (``store.product_cards``),
+reordering by popularity, a price campaign starting or ending
+(``store.pricing``) and banner or site-settings changes bump it once
+instead of deleting keys, and the old entries simply expire.
+"""
+from .versions import bump_version, get_version
+
+CATALOG_VERSION_KEY = 'store:catalog:version'
+
+
+def catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """Invalidate every cache entry keyed on the catalog version"""
+    bump_version(CATALOG_VERSION_KEY)
@@ -0,0 +1,289 @@
+"""
+Bulk catalog import from CSV or JSONL files.
+
+Rows are read as a stream, validated, and upserted in batches with
+``bulk_create(update_conflicts=True)`` keyed on ``sku`` or ``slug``, so a
+batch costs one INSERT no matter how many products it holds. Category paths
+such as ``Electronics > Mobile`` are resolved through an in-memory lookup
+built with a single query. Images are copied from a local directory into
+media storage by a thread pool while the next batches are being imported.
+
+Used by the ``import_products`` command and the custom admin import page.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import DataError, IntegrityError, transaction
+from django.utils.text import slugify
+
+from .inventory import set_stock
+from .models import Category, Product
+from .product_cards import refresh_cards
+
+CATEGORY_SEPARATOR = '>'
+
+# Fields written on every upsert (besides the matching key)
+UPSERT_FIELDS = [
+    'name', 'description', 'price', 'original_price', 'category', 'stock_quantity',
+    'is_best_seller', 'is_featured', 'youtube_url', 'updated_at',
+]
+
+
+class RowError(Exception):
+    """Raised for a row that cannot be imported"""
+
+
+class ImportReport:
+    """Counters and error rows collected during an import"""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.images = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0
+
+    def add_error(self, line, message, row):
+        self.errors.append({'line': line, 'error': message, 'row': row})
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0
+
+    def summary(self):
+        return (
+            f'{self.imported} of {self.rows} rows imported in {self.elapsed:.1f}s '
+            f'({self.rows_per_second:.0f} rows/sec), {self.images} images attached, '
+            f'{len(self.errors)} error rows'
+        )
+
+
+class CategoryResolver:
+    """Resolve 'Parent > Child' paths to category ids, creating missing categories"""
+
+    def __init__(self, create_missing=True):
+        self.create_missing = create_missing
+        self.by_parent_and_name = {
+            (parent_id, name.lower()): pk
+            for pk, parent_id, name in Category.objects.values_list('pk', 'parent_id', 'name')
+        }
+        self.paths = {}
+
+    def resolve(self, path):
+        path = path.strip()
+        if path in self.paths:
+            return self.paths[path]
+
+        parent_id = None
+        for name in [part.strip() for part in path.split(CATEGORY_SEPARATOR) if part.strip()]:
+            key = (parent_id, name.lower())
+            if key not in self.by_parent_and_name:
+                if not self.create_missing:
+                    raise RowError(f'Unknown category "{path}"')
+                category = Category.objects.create(name=name, parent_id=parent_id)
+                self.by_parent_and_name[key] = category.pk
+            parent_id = self.by_parent_and_name[key]
+
+        if parent_id is None:
+            raise RowError('Category is required')
+        self.paths[path] = parent_id
+        return parent_id
+
+
+def read_rows(fileobj, file_format):
+    """Yield (line number, row dict) pairs from a text stream"""
+    if file_format == 'jsonl':
+        for line_number, line in enumerate(fileobj, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, e
+    else:
+        reader = csv.DictReader(fileobj)
+        for line_number, row in enumerate(reader, start=2):
+            yield line_number, row
+
+
+def _decimal(value, field, required=False):
+    if value in (None, ''):
+        if required:
+            raise RowError(f'{field} is required')
+        return None
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise RowError(f'{field} must be a number')
+    if number < 0:
+        raise RowError(f'{field} cannot be negative')
+    return number.quantize(Decimal('0.01'))
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+class ProductImporter:
+    """Stream a catalog file into the Product table in batched upserts"""
+
+    def __init__(self, key='slug', batch_size=1000, image_dir=None, image_workers=8, create_categories=True):
+        if key not in ('slug', 'sku'):
+            raise ValueError('key must be "slug" or "sku"')
+        self.key = key
+        self.batch_size = batch_size
+        self.image_dir = image_dir
+        self.image_workers = image_workers
+        self.categories = CategoryResolver(create_missing=create_categories)
+
+    def run(self, fileobj, file_format='csv'):
+        report = ImportReport()
+        batch = {}
+        image_jobs = []
+
+        with ThreadPoolExecutor(max_workers=self.image_workers) as pool:
+            for line_number, row in read_rows(fileobj, file_format):
+                report.rows += 1
+                try:
+                    if isinstance(row, Exception):
+                        raise RowError(f'Invalid JSON: {row}')
+                    product, image_name = self.build_product(row)
+                except RowError as e:
+                    report.add_error(line_number, str(e), row if isinstance(row, dict) else {})
+                    continue
+
+                # Last row wins when a file repeats a key within one batch
+                batch[getattr(product, self.key)] = (product, image_name)
+                if len(batch) >= self.batch_size:
+                    image_jobs.extend(self.flush(batch, report, pool))
+                    batch = {}
+
+            if batch:
+                image_jobs.extend(self.flush(batch, report, pool))
+
+            self.attach_images(image_jobs, report)
+
+        report.finish()
+        return report
+
+    def build_product(self, row):
+        """Validate a row and turn it into an unsaved Product"""
+        name = str(row.get('name') or '').strip()
+        if not name:
+            raise RowError('name is required')
+
+        sku = str(row.get('sku') or '').strip() or None
+        if self.key == 'sku' and not sku:
+            raise RowError('sku is required when importing by sku')
+
+        slug = slugify(str(row.get('slug') or '')) or slugify(name)
+        if self.key == 'sku' and not row.get('slug'):
+            # Keep slugs unique for products that only differ by SKU
+            slug = f'{slugify(name)}-{slugify(sku)}'
+        if not slug:
+            raise RowError('could not build a slug from the name')
+
+        try:
+            stock_quantity = int(row.get('stock_quantity') or 0)
+        except (TypeError, ValueError):
+            raise RowError('stock_quantity must be a whole number')
+        if stock_quantity < 0:
+            raise RowError('stock_quantity cannot be negative')
+
+        product = Product(
+            name=name[:200],
+            slug=slug[:220],
+            sku=sku,
+            description=row.get('description') or '',
+            price=_decimal(row.get('price'), 'price', required=True),
+            original_price=_decimal(row.get('original_price'), 'original_price'),
+            category_id=self.categories.resolve(str(row.get('category') or '')),
+            stock_quantity=stock_quantity,
+            is_best_seller=_boolean(row.get('is_best_seller')),
+            is_featured=_boolean(row.get('is_featured')),
+            youtube_url=str(row.get('youtube_url') or '').strip() or None,
+            image='',
+        )
+        return product, str(row.get('image') or '').strip()
+
+    def upsert(self, products):
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=[self.key],
+            update_fields=UPSERT_FIELDS,
+        )
+
+    def flush(self, batch, report, pool):
+        """Upsert one batch and queue its image copies"""
+        products = [product for product, _ in batch.values()]
+        try:
+            with transaction.atomic():
+                self.upsert(products)
+            report.imported += len(products)
+        except (IntegrityError, DataError):
+            # Some row clashes with another product (e.g. a taken slug) or doesn't
+            # fit its column (e.g. a price too large): retry one by one so only
+            # the offending rows are rejected
+            for key, (product, _) in list(batch.items()):
+                try:
+                    with transaction.atomic():
+                        self.upsert([product])
+                    report.imported += 1
+                except (IntegrityError, DataError) as e:
+                    report.add_error(None, f'{self.key} "{key}": {e}', {'name': product.name, self.key: key})
+                    del batch[key]
+
+        # bulk_create doesn't return ids for updated rows on every backend
+        ids = dict(
+            Product.objects.filter(**{f'{self.key}__in': list(batch)}).values_list(self.key, 'pk')
+        )
+        # Sharded products keep their stock in shard rows, which the upsert didn't touch
+        for product in Product.objects.filter(pk__in=list(ids.values()), inventory_sharded=True):
+            set_stock(product, batch[getattr(product, self.key)][0].stock_quantity)
+        # The upsert sent no signals; bring the listing cards up to date
+        refresh_cards(ids.values())
+
+        if not self.image_dir:
+            return []
+        wanted = {key: image for key, (_, image) in batch.items() if image}
+        if not wanted:
+            return []
+        return [
+            pool.submit(self.copy_image, ids[key], image)
+            for key, image in wanted.items()
+            if key in ids
+        ]
+
+    def copy_image(self, product_id, image_name):
+        """Copy one image into media storage and return (product id, stored name)"""
+        path = os.path.join(self.image_dir, os.path.basename(image_name))
+        with open(path, 'rb') as handle:
+            stored = default_storage.save(f'products/{os.path.basename(image_name)}', File(handle))
+        return product_id, stored
+
+    def attach_images(self, jobs, report):
+        """Point products at their copied images in batched updates"""
+        updates = []
+        for job in jobs:
+            try:
+                product_id, stored = job.result()
+            except OSError as e:
+                report.add_error(None, f'Image could not be copied: {e}', {})
+                continue
+            updates.append(Product(pk=product_id, image=stored))
+        Product.objects.bulk_update(updates, ['image'], batch_size=self.batch_size)
+        refresh_cards(product.pk for product in updates)
+        report.images += len(updates)
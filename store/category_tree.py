@@ -0,0 +1,110 @@
+"""
+The category hierarchy loaded in a single query.
+
+``Category.get_level()``, ``full_path`` and ``get_all_children()`` follow
+``parent`` links one query at a time, which is fine for one category but
+turns listing pages into thousands of queries. ``CategoryTree`` fetches
+every category once (optionally with its product count) and answers
+level, path, descendant and choice-list questions from memory.
+"""
+from django.db.models import Count
+
+from .models import Category
+
+
+class CategoryTree:
+    """All categories indexed by id and by parent"""
+
+    def __init__(self, categories):
+        self.by_id = {}
+        self.children = {}
+        for category in categories:
+            self.by_id[category.pk] = category
+            self.children.setdefault(category.parent_id, []).append(category)
+
+        # Walk down from the roots so every node gets its level and path
+        stack = [(root, 0, '') for root in reversed(self.roots)]
+        while stack:
+            category, level, prefix = stack.pop()
+            category.level = level
+            category.path = f'{prefix} > {category.name}' if prefix else category.name
+            category.children_count = len(self.children.get(category.pk, []))
+            for child in self.children.get(category.pk, []):
+                # Saves a query per node for templates that show category.parent
+                child.parent = category
+            stack.extend(
+                (child, level + 1, category.path) for child in reversed(self.children.get(category.pk, []))
+            )
+
+    @classmethod
+    def load(cls, with_counts=False):
+        """Build the tree from one query, annotating product_count if asked"""
+        categories = Category.objects.order_by('name')
+        if with_counts:
+            categories = categories.annotate(product_count=Count('products'))
+        return cls(categories)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    @property
+    def roots(self):
+        return self.children.get(None, [])
+
+    def get(self, pk):
+        return self.by_id.get(pk)
+
+    def children_of(self, pk):
+        return self.children.get(pk, [])
+
+    def walk(self, parent_id=None, exclude=None):
+        """Yield categories depth-first, name-sorted, skipping the subtree of exclude"""
+        stack = list(reversed(self.children_of(parent_id)))
+        while stack:
+            category = stack.pop()
+            if category.pk == exclude:
+                continue
+            yield category
+            stack.extend(reversed(self.children_of(category.pk)))
+
+    def descendant_ids(self, pk):
+        return [category.pk for category in self.walk(pk)]
+
+    def is_descendant(self, pk, ancestor_pk):
+        """True if the category pk sits somewhere below ancestor_pk"""
+        category = self.get(pk)
+        while category is not None and category.parent_id is not None:
+            if category.parent_id == ancestor_pk:
+                return True
+            category = self.get(category.parent_id)
+        return False
+
+    def nested(self, categories=None):
+        """[{'category': .., 'children': [...]}] structure used by tree templates"""
+        if categories is None:
+            categories = self.roots
+        return [
+            {'category': category, 'children': self.nested(self.children_of(category.pk))}
+            for category in categories
+        ]
+
+    def indented_choices(self, exclude=None, marker='├', fill='─'):
+        """(pk, label) choices with children indented under their parent"""
+        choices = []
+        for category in self.walk(exclude=exclude):
+            if category.level:
+                choices.append((category.pk, f'{marker}{fill * category.level} {category.name}'))
+            else:
+                choices.append((category.pk, category.name))
+        return choices
+
+    def decorate(self, categories):
+        """Copy level, path and counts onto category instances loaded elsewhere"""
+        for category in categories:
+            node = self.get(category.pk)
+            if node is None:
+                continue
+            for attribute in ('level', 'path', 'children_count', 'product_count'):
+                if hasattr(node, attribute):
+                    setattr(category, attribute, getattr(node, attribute))
+        return categories
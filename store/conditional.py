@@ -0,0 +1,138 @@
+"""
+HTTP conditional requests for storefront pages.
+
+``conditional_page`` gives anonymous GETs (no cart, session or pending
+messages, so nothing per-visitor on the page) an ``ETag`` built from cheap
+version numbers and answers ``304 Not Modified`` when the browser's copy
+still matches. The view, its queries and the context processors never run.
+
+The validator combines:
+
+* ``RELEASE``, which changes with each deploy (templates). Unset, every
+  worker uses a value seeded once in the shared cache, so the validators
+  of all workers agree and template changes show within
+  ``CONDITIONAL_VERSION_SECONDS``;
+* the catalog version (store.catalog_cache), bumped whenever product cards,
+  prices, banners or site settings change;
+* the category-tree version (store.navigation);
+* anything the page adds, such as the product's ``updated_at``.
+
+With a per-process cache, other workers only see a bump once their own
+version rolls over, so every validator also expires after
+``CONDITIONAL_VERSION_SECONDS``.
+
+Anonymous responses are marked ``public`` with ``s-maxage=PAGE_CACHE_SECONDS``
+for a CDN or reverse proxy, unless they set a cookie (a first visit gets its
+visitor cookie). ``CachePolicyMiddleware``, the outermost middleware, makes
+that call after every ``Set-Cookie`` is on the response. Browsers always
+revalidate (``max-age=0``).
+
+A CSRF token in a shared page would be someone else's, and rendering one
+sets the ``csrftoken`` cookie on every response. Anonymous pages therefore
+render ``DEFERRED_CSRF_TOKEN`` instead (see the ``deferred_csrf`` context
+processor), and a script in ``base.html`` swaps in the browser's own token
+from the ``csrf_token`` view.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .cart import CART_COOKIE_NAME
+from .catalog_cache import catalog_version
+from .navigation import tree_version
+from .versions import get_version
+
+RELEASE_KEY = 'store:conditional:release'
+DEFERRED_CSRF_TOKEN = 'deferred'
+
+
+def anonymous(request):
+    """True when the page can't hold anything specific to this visitor"""
+    cookies = request.COOKIES
+    return not (
+        CART_COOKIE_NAME in cookies
+        or settings.SESSION_COOKIE_NAME in cookies
+        or CookieStorage.cookie_name in cookies
+    )
+
+
+def release():
+    """RELEASE, else a release id shared by every worker through the cache"""
+    return getattr(settings, 'RELEASE', '') or get_version(RELEASE_KEY)
+
+
+def site_version():
+    window = getattr(settings, 'CONDITIONAL_VERSION_SECONDS', 300)
+    return f'{release()}:{catalog_version()}:{tree_version()}:{int(time.time() // window)}'
+
+
+def conditional_page(etag_func=None, last_modified_func=None, not_modified=None):
+    """
+    Decorate a GET view to answer anonymous revalidations with 304.
+
+    etag_func(request, *args, **kwargs) returns the page's own validator part,
+    or None to skip conditional handling (e.g. the object doesn't exist).
+    last_modified_func has Django's condition() signature. not_modified(request,
+    *args, **kwargs) runs instead of the view when a 304 is sent, for side
+    effects such as counting the view.
+    """
+    def etag(request, *args, **kwargs):
+        parts = [site_version()]
+        if etag_func is not None:
+            part = etag_func(request, *args, **kwargs)
+            if part is None:
+                return None
+            parts.append(part)
+        return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified_func)(view)
+
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not anonymous(request):
+                return view(request, *args, **kwargs)
+            request.csrf_deferred = True
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code == 304:
+                if not_modified is not None:
+                    not_modified(request, *args, **kwargs)
+            elif response.status_code != 200:
+                return response
+            # Cache-Control is decided by CachePolicyMiddleware, once every cookie is on the response
+            response.anonymous_page = True
+            return response
+        return wrapped
+    return decorator
+
+
+class CachePolicyMiddleware:
+    """
+    Set Cache-Control on anonymous pages from conditional_page.
+
+    Listed first in MIDDLEWARE so it sees the response last, after the CSRF,
+    visitor and cart middleware have added their cookies: a response that
+    sets any cookie is private, everything else may be shared.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not getattr(response, 'anonymous_page', False):
+            return response
+        if response.cookies:
+            patch_cache_control(response, private=True, max_age=0)
+        else:
+            patch_cache_control(
+                response, public=True, max_age=0,
+                s_maxage=getattr(settings, 'PAGE_CACHE_SECONDS', 60),
+            )
+        patch_vary_headers(response, ('Cookie',))
+        return response
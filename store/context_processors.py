@@ -5,32 +5,26 @@ def site_settings(request):
         'site_name': site_settings.site_name,
         'site_tagline': site_settings.site_tagline,
     }
-from .models import CartItem, Category, SiteSettings
+from .cart import get_cart
+from .conditional import DEFERRED_CSRF_TOKEN
+from .models import Category, SiteSettings
 
 def cart_count(request):
-    """Add cart count and hierarchical categories to all templates"""
-    if not request.session.session_key:
-        request.session.create()
+    """Add cart count, categories and branding to all templates"""
+    # The badge count comes straight from the cart store (no query for
+    # cookie carts); the total is a callable so it's only priced if used
+    if getattr(request, 'is_bot', False):
+        # Crawlers never have a cart; don't load or create one. Branding comes
+        # from the site_settings processor and the menu from its cached fragment
+        return {'cart_count': 0, 'cart_total': 0}
     
-    cart_items = CartItem.objects.filter(session_key=request.session.session_key)
-    total_items = sum(item.quantity for item in cart_items)
-    total_price = sum(item.total_price for item in cart_items)
+    cart = get_cart(request)
+    total_items = cart.count()
+    total_price = cart.total
     
-    # Add hierarchical categories for navigation
+    # The navigation menu itself is a cached fragment (see store.navigation)
     categories = Category.objects.all()
-    root_categories = Category.get_root_categories().prefetch_related('children__children')
-    
-    # Build hierarchical category structure for menu
-    def build_category_menu(categories):
-        menu_items = []
-        for category in categories:
-            menu_items.append({
-                'category': category,
-                'children': build_category_menu(category.children.all()) if category.children.exists() else []
-            })
-        return menu_items
-    
-    category_menu = build_category_menu(root_categories)
+    root_categories = Category.get_root_categories()
     
     # Add site settings for branding
     site_settings = SiteSettings.get_current()
@@ -40,8 +34,14 @@ def cart_count(request):
         'cart_total': total_price,
         'categories': categories,
         'root_categories': root_categories,
-        'category_menu': category_menu,
         'site_settings': site_settings,
         'site_name': site_settings.site_name,
         'site_tagline': site_settings.site_tagline,
     }
+
+
+def deferred_csrf(request):
+    """Placeholder CSRF token on shared-cacheable pages; base.html fetches the real one (see store.conditional)"""
+    if getattr(request, 'csrf_deferred', False):
+        return {'csrf_token': DEFERRED_CSRF_TOKEN, 'csrf_deferred': True}
+    return {}
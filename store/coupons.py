@@ -0,0 +1,162 @@
+"""
+Coupon codes at checkout.
+
+Codes are validated against rules compiled into process memory: a dict from
+code to ``CouponRule``, with the category scope already expanded to every
+subcategory id. Checking a code is a dict lookup plus arithmetic on the cart,
+without touching the coupon tables. The rules are recompiled when the coupon
+version in the cache changes (saving or deleting a coupon bumps it, see
+``store.signals``) and at least every ``COUPON_RULES_SECONDS``, which also
+picks up categories that moved.
+
+Usage caps are enforced when the order is placed. ``redeem()`` takes a use
+with a conditional ``UPDATE ... SET times_used = times_used + 1 WHERE
+times_used < usage_limit``, so parallel checkouts can never push a coupon
+past its cap. The row lock that UPDATE holds until commit also serializes
+the per-phone check for that coupon. Call it as the last write of the
+checkout transaction to keep that lock short.
+"""
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .category_tree import CategoryTree
+from .models import Coupon, CouponRedemption
+from .versions import bump_version, get_version
+
+RULES_VERSION_KEY = 'store:coupons:version'
+CENT = Decimal('0.01')
+
+_lock = threading.Lock()
+_compiled = (None, 0.0, {})  # (version, monotonic expiry, {code: CouponRule})
+
+
+class CouponError(Exception):
+    """Raised when a coupon can't be used for this cart"""
+
+
+def normalize_code(code):
+    return (code or '').strip().upper()
+
+
+class CouponRule:
+    """A coupon as checkout needs it, detached from the database"""
+
+    def __init__(self, coupon, tree):
+        self.pk = coupon.pk
+        self.code = coupon.code
+        self.kind = coupon.kind
+        self.value = coupon.value
+        self.max_discount = coupon.max_discount
+        self.min_subtotal = coupon.min_subtotal
+        self.starts_at = coupon.starts_at
+        self.ends_at = coupon.ends_at
+        self.per_phone_limit = coupon.per_phone_limit
+        # A cap reached before compiling is refused here; caps reached since are caught by redeem()
+        self.exhausted = coupon.usage_limit is not None and coupon.times_used >= coupon.usage_limit
+        self.category_ids = None
+        scope = [category.pk for category in coupon.categories.all()]
+        if scope:
+            category_ids = set(scope)
+            for pk in scope:
+                category_ids.update(tree.descendant_ids(pk))
+            self.category_ids = frozenset(category_ids)
+
+    def applies_to(self, product):
+        return self.category_ids is None or product.category_id in self.category_ids
+
+    def discount(self, cart_items, delivery_fee, now=None):
+        """Amount taken off this cart; raises CouponError when the coupon can't be used"""
+        now = now or timezone.now()
+        if self.starts_at and now < self.starts_at:
+            raise CouponError('This coupon is not active yet.')
+        if self.ends_at and now >= self.ends_at:
+            raise CouponError('This coupon has expired.')
+        if self.exhausted:
+            raise CouponError('This coupon has been fully redeemed.')
+
+        eligible = sum(
+            (item.total_price for item in cart_items if self.applies_to(item.product)), Decimal('0')
+        )
+        if not eligible:
+            raise CouponError("This coupon doesn't apply to the products in your cart.")
+        if eligible < self.min_subtotal:
+            raise CouponError(f'This coupon needs at least ৳{self.min_subtotal} of eligible products.')
+
+        if self.kind == 'free_delivery':
+            return Decimal(delivery_fee)
+        if self.kind == 'percent':
+            amount = (eligible * self.value / 100).quantize(CENT)
+            if self.max_discount is not None:
+                amount = min(amount, self.max_discount)
+        else:
+            amount = self.value
+        return min(amount, eligible)
+
+
+def rules_version():
+    return get_version(RULES_VERSION_KEY)
+
+
+def bump_rules_version():
+    """Make every worker recompile its coupon rules"""
+    bump_version(RULES_VERSION_KEY)
+
+
+def _compile():
+    tree = CategoryTree.load()
+    coupons = Coupon.objects.filter(is_active=True).filter(
+        Q(ends_at__isnull=True) | Q(ends_at__gt=timezone.now())
+    ).prefetch_related('categories')
+    return {coupon.code: CouponRule(coupon, tree) for coupon in coupons}
+
+
+def rules():
+    """{code: CouponRule} for every active coupon, compiled on first use and when stale"""
+    global _compiled
+    version = rules_version()
+    compiled_version, expires, compiled = _compiled
+    if compiled_version == version and time.monotonic() < expires:
+        return compiled
+    with _lock:
+        if _compiled[0] != version or time.monotonic() >= _compiled[1]:
+            ttl = getattr(settings, 'COUPON_RULES_SECONDS', 300)
+            _compiled = (version, time.monotonic() + ttl, _compile())
+        return _compiled[2]
+
+
+def validate(code, cart_items, delivery_fee, now=None):
+    """(rule, discount amount) for a code entered at checkout; raises CouponError"""
+    rule = rules().get(normalize_code(code))
+    if rule is None:
+        raise CouponError('This coupon code is not valid.')
+    return rule, rule.discount(cart_items, delivery_fee, now)
+
+
+def redeem(rule, order, discount_amount):
+    """
+    Record one use of the coupon by order. Must run inside the checkout
+    transaction; raises CouponError (rolling the order back) when the coupon
+    has run out or this phone number has used it up.
+    """
+    taken = Coupon.objects.filter(pk=rule.pk, is_active=True).filter(
+        Q(usage_limit__isnull=True) | Q(times_used__lt=F('usage_limit'))
+    ).update(times_used=F('times_used') + 1)
+    if not taken:
+        raise CouponError('This coupon has been fully redeemed.')
+
+    if rule.per_phone_limit is not None:
+        used = CouponRedemption.objects.filter(coupon_id=rule.pk, phone_normalized=order.phone_normalized).count()
+        if used >= rule.per_phone_limit:
+            raise CouponError('You have already used this coupon the maximum number of times.')
+
+    return CouponRedemption.objects.create(
+        coupon_id=rule.pk,
+        order=order,
+        phone_normalized=order.phone_normalized,
+        discount_amount=discount_amount,
+    )
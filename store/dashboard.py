@@ -0,0 +1,289 @@
+"""
+Materialized figures for the custom admin dashboard.
+
+``DashboardSnapshot`` is a single row holding every number the dashboard
+shows. ``rebuild()`` recomputes it from scratch: the ``rebuild_dashboard`` command
+(run it from cron to correct drift), the dashboard's refresh button, and the
+very first time the dashboard is opened. Opening the dashboard never
+rebuilds an existing snapshot.
+
+In between, nothing on the storefront touches the snapshot row. The signal
+handlers in ``store.signals`` append a ``DashboardDelta`` row for each
+placed or deleted order, each product change and each category added or
+removed: a plain INSERT that takes no shared lock and commits (or rolls
+back) with the change itself. ``merge_pending()`` folds the queued deltas
+into the snapshot in batches, under one row lock. It runs when the
+dashboard is opened with deltas queued and from
+``rebuild_dashboard --pending``. Today's visits and online users change
+with every visitor, so each merge re-counts them instead, and the dashboard
+merges at least once every ``DASHBOARD_COUNTS_SECONDS``. With nothing queued and fresh counts,
+``get_snapshot()`` returns the row as it is.
+
+Events that bypass signals (bulk updates, queryset deletes) are caught up
+by the next rebuild.
+"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import Category, DashboardDelta, DashboardSnapshot, OnlineUser, Order, OrderItem, Product, UserVisit
+
+SNAPSHOT_PK = 1
+TOP_PRODUCTS = 5
+LOW_STOCK_THRESHOLD = 10
+LOW_STOCK_LIMIT = 50
+MONTHS = 12
+MERGE_BATCH = 1000
+
+
+def _month_key(value):
+    return value.strftime('%Y-%m')
+
+
+def _first_month(today):
+    """First day of the oldest month shown on the sales chart"""
+    year, month = today.year, today.month - (MONTHS - 1)
+    while month < 1:
+        year, month = year - 1, month + 12
+    return date(year, month, 1)
+
+
+def _product_entry(product, total_sold=None):
+    return {
+        'id': product.pk,
+        'name': product.name,
+        'slug': product.slug,
+        'price': str(product.price),
+        'stock_quantity': product.stock_quantity,
+        'image_url': product.image.url if product.image else '',
+        'category': product.category.name,
+        'total_sold': total_sold if total_sold is not None else getattr(product, 'total_sold', 0),
+    }
+
+
+def _products(ids=None):
+    products = Product.objects.select_related('category').only(
+        'name', 'slug', 'price', 'stock_quantity', 'image', 'category__name'
+    )
+    if ids is not None:
+        products = products.filter(pk__in=ids)
+    return products
+
+
+def rebuild():
+    """Recompute the whole snapshot and return it"""
+    with transaction.atomic():
+        DashboardSnapshot.objects.select_for_update().filter(pk=SNAPSHOT_PK).first()
+        # Deltas already queued are part of what is about to be counted
+        queued = DashboardDelta.objects.aggregate(last=Max('pk'))['last']
+        snapshot = _rebuild()
+        if queued is not None:
+            DashboardDelta.objects.filter(pk__lte=queued).delete()
+    return snapshot
+
+
+def _rebuild():
+    now = timezone.now()
+    today = timezone.localdate()
+
+    orders = Order.objects.aggregate(count=Count('pk'), revenue=Sum('total_amount'))
+    month_start = timezone.make_aware(datetime.combine(_first_month(today), time.min))
+    monthly = (
+        Order.objects.filter(created_at__gte=month_start)
+        .annotate(month=TruncMonth('created_at'))
+        .values('month')
+        .annotate(revenue=Sum('total_amount'))
+        .order_by()
+    )
+    top = (
+        _products()
+        .annotate(total_sold=Sum('orderitem__quantity'))
+        .filter(total_sold__gt=0)
+        .order_by('-total_sold')[:TOP_PRODUCTS]
+    )
+    low_stock = _products().filter(stock_quantity__lt=LOW_STOCK_THRESHOLD).order_by('stock_quantity', 'name')
+
+    snapshot = DashboardSnapshot(
+        pk=SNAPSHOT_PK,
+        total_orders=orders['count'],
+        total_revenue=orders['revenue'] or 0,
+        monthly_revenue={
+            _month_key(timezone.localtime(row['month'])): str(row['revenue']) for row in monthly
+        },
+        top_products=[_product_entry(product) for product in top],
+        low_stock_products=[_product_entry(product, 0) for product in low_stock[:LOW_STOCK_LIMIT]],
+        rebuilt_at=now,
+        updated_at=now,
+        **_counts(today),
+    )
+    snapshot.save()
+    return snapshot
+
+
+def get_snapshot():
+    """The current snapshot with pending deltas merged, built first if there is none yet"""
+    snapshot = DashboardSnapshot.objects.filter(pk=SNAPSHOT_PK).first()
+    if snapshot is None or snapshot.rebuilt_at is None:
+        return rebuild()
+    max_age = getattr(settings, 'DASHBOARD_COUNTS_SECONDS', 60)
+    if timezone.now() - snapshot.updated_at <= timedelta(seconds=max_age) and not DashboardDelta.objects.exists():
+        return snapshot
+    return merge_pending() or snapshot
+
+
+def monthly_sales(snapshot):
+    """Chart data for the last 12 calendar months, oldest first"""
+    month = _first_month(timezone.localdate())
+    sales = []
+    for _ in range(MONTHS):
+        sales.append({
+            'month': month.strftime('%b %Y'),
+            'revenue': float(snapshot.monthly_revenue.get(_month_key(month), 0)),
+        })
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return sales
+
+
+# Incremental updates
+
+def _visitor_counts(today):
+    return {
+        'visits_date': today,
+        'today_visits': UserVisit.objects.filter(date=today).count(),
+        'current_online': OnlineUser.objects.count(),
+    }
+
+
+def _counts(today):
+    return {
+        'total_products': Product.objects.count(),
+        'total_categories': Category.objects.count(),
+        **_visitor_counts(today),
+    }
+
+
+def _refresh_products(snapshot, ids):
+    """Re-read stock for some products and fix their top-seller and low-stock entries"""
+    products = {product.pk: product for product in _products(ids)}
+    # Entries for products that no longer exist are dropped
+    snapshot.top_products = [
+        entry for entry in snapshot.top_products if entry['id'] in products or entry['id'] not in ids
+    ]
+    for entry in snapshot.top_products:
+        if entry['id'] in products:
+            entry['stock_quantity'] = products[entry['id']].stock_quantity
+
+    low_stock = [entry for entry in snapshot.low_stock_products if entry['id'] not in ids]
+    low_stock += [
+        _product_entry(product, 0) for product in products.values()
+        if product.stock_quantity < LOW_STOCK_THRESHOLD
+    ]
+    low_stock.sort(key=lambda entry: (entry['stock_quantity'], entry['name']))
+    snapshot.low_stock_products = low_stock[:LOW_STOCK_LIMIT]
+
+
+def _merge_sales(snapshot, order_ids):
+    """Add the items of newly placed orders to the top-seller list"""
+    sold = dict(
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values('product_id').annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+    top = {entry['id']: entry for entry in snapshot.top_products}
+    for product_id, quantity in sold.items():
+        if product_id in top:
+            top[product_id]['total_sold'] += quantity
+    newcomers = [product_id for product_id in sold if product_id not in top]
+    if newcomers:
+        # Products outside the list need their all-time total to be ranked
+        totals = dict(
+            OrderItem.objects.filter(product_id__in=newcomers)
+            .values('product_id').annotate(total=Sum('quantity'))
+            .values_list('product_id', 'total')
+        )
+        for product in _products(newcomers):
+            top[product.pk] = _product_entry(product, totals.get(product.pk, 0))
+    snapshot.top_products = sorted(top.values(), key=lambda entry: -entry['total_sold'])[:TOP_PRODUCTS]
+    return set(sold)
+
+
+def _merge(snapshot, deltas):
+    product_ids, order_ids = set(), []
+    for delta in deltas:
+        snapshot.total_orders = max(snapshot.total_orders + delta.orders, 0)
+        snapshot.total_products = max(snapshot.total_products + delta.products, 0)
+        snapshot.total_categories = max(snapshot.total_categories + delta.categories, 0)
+        snapshot.total_revenue += delta.revenue
+        if delta.month:
+            total = Decimal(snapshot.monthly_revenue.get(delta.month, '0')) + delta.revenue
+            snapshot.monthly_revenue[delta.month] = str(total)
+        if delta.order_id is not None:
+            order_ids.append(delta.order_id)
+        product_ids.update(delta.product_ids)
+    if order_ids:
+        product_ids |= _merge_sales(snapshot, order_ids)
+    if product_ids:
+        _refresh_products(snapshot, product_ids)
+
+
+def merge_pending():
+    """
+    Fold every queued delta into the snapshot, re-count today's visits and
+    online users, and return it. Returns None when there is no snapshot yet
+    (the first rebuild counts everything) or another worker is already
+    merging.
+    """
+    with transaction.atomic():
+        snapshot = DashboardSnapshot.objects.select_for_update(skip_locked=True).filter(pk=SNAPSHOT_PK).first()
+        if snapshot is None or snapshot.rebuilt_at is None:
+            return None
+        while True:
+            deltas = list(DashboardDelta.objects.order_by('pk')[:MERGE_BATCH])
+            if not deltas:
+                break
+            _merge(snapshot, deltas)
+            DashboardDelta.objects.filter(pk__in=[delta.pk for delta in deltas]).delete()
+        for field, value in _visitor_counts(timezone.localdate()).items():
+            setattr(snapshot, field, value)
+        snapshot.updated_at = timezone.now()
+        snapshot.save()
+    return snapshot
+
+
+def record_order(order):
+    """Queue a newly placed order; it commits or rolls back with the order"""
+    DashboardDelta.objects.create(
+        orders=1,
+        revenue=order.total_amount,
+        month=_month_key(timezone.localtime(order.created_at)),
+        order_id=order.pk,
+    )
+
+
+def forget_order(total_amount, created_at):
+    """Queue the removal of a deleted order (top sellers wait for the next rebuild)"""
+    DashboardDelta.objects.create(
+        orders=-1,
+        revenue=-total_amount,
+        month=_month_key(timezone.localtime(created_at)),
+    )
+
+
+def record_stock_change(product_ids, products=0):
+    """
+    Queue products whose stock may have changed, for the top-seller and
+    low-stock lists; products is how many were added (or, negative, removed)
+    """
+    product_ids = sorted(set(product_ids))
+    if product_ids or products:
+        DashboardDelta.objects.create(product_ids=product_ids, products=products)
+
+
+def record_categories(categories):
+    """Queue categories added (or, negative, removed)"""
+    DashboardDelta.objects.create(categories=categories)
@@ -0,0 +1,153 @@
+"""
+Facet filters and counts for product listings.
+
+A listing can be narrowed by subcategory, price band, discount band and the
+on-sale / best-seller / featured flags. Each option shows how many products
+it would leave. The counts are disjunctive: a group's counts apply every
+*other* group's selection, so picking a price band still shows what the
+other bands hold.
+
+All counts come from a single aggregate over the listing's ``ProductCard``
+rows, with one ``COUNT(*) FILTER (WHERE ...)`` per option, instead of one
+COUNT query per option. The result is cached for ``FACET_CACHE_SECONDS``
+per listing and selection, under the catalog version (store.catalog_cache).
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .catalog_cache import catalog_version
+
+# (value, label, minimum, maximum) - minimum inclusive, maximum exclusive
+PRICE_BANDS = [
+    ('0-500', 'Under ৳500', None, 500),
+    ('500-1000', '৳500 - ৳1,000', 500, 1000),
+    ('1000-5000', '৳1,000 - ৳5,000', 1000, 5000),
+    ('5000-', '৳5,000 and above', 5000, None),
+]
+# (value, label, minimum discount %)
+DISCOUNT_BANDS = [
+    ('10', '10% off or more', 10),
+    ('25', '25% off or more', 25),
+    ('50', '50% off or more', 50),
+]
+# The value is also the query parameter; ``featured`` is taken by the
+# products page's best-seller filter, hence ``is_featured``
+FLAGS = [
+    ('on_sale', 'On sale', Q(discount_percentage__gt=0)),
+    ('best_seller', 'Best sellers', Q(is_best_seller=True)),
+    ('is_featured', 'Featured', Q(is_featured=True)),
+]
+
+
+def _price_q(minimum, maximum):
+    q = Q()
+    if minimum is not None:
+        q &= Q(price__gte=minimum)
+    if maximum is not None:
+        q &= Q(price__lt=maximum)
+    return q
+
+
+class Facets:
+    """
+    The facet options of one listing and the current selection.
+
+    subcategories is a list of (category, ids of it and everything below it)
+    offered as the subcategory facet.
+    """
+
+    def __init__(self, params, subcategories=()):
+        self.params = params
+        self.groups = {
+            'sub': [
+                (str(category.pk), category.name, Q(category_id__in=ids))
+                for category, ids in subcategories
+            ],
+            'price': [(value, label, _price_q(low, high)) for value, label, low, high in PRICE_BANDS],
+            'discount': [
+                (value, label, Q(discount_percentage__gte=minimum)) for value, label, minimum in DISCOUNT_BANDS
+            ],
+        }
+        for value, label, q in FLAGS:
+            self.groups[value] = [('1', label, q)]
+
+        # Only known option values count as selected, so odd input can't reach the query
+        self.selected = {}
+        for group, options in self.groups.items():
+            value = params.get(group)
+            for option_value, _, q in options:
+                if value == option_value:
+                    self.selected[group] = (option_value, q)
+
+    def _filter(self, exclude=None):
+        q = Q()
+        for group, (_, group_q) in self.selected.items():
+            if group != exclude:
+                q &= group_q
+        return q
+
+    def apply(self, queryset):
+        """queryset narrowed by every selected option"""
+        q = self._filter()
+        return queryset.filter(q) if q else queryset
+
+    def _url(self, group, value):
+        params = self.params.copy()
+        params.pop('page', None)
+        if value is None:
+            params.pop(group, None)
+        else:
+            params[group] = value
+        return f'?{params.urlencode()}'
+
+    def counts(self, queryset, cache_key=''):
+        """{(group, value): count} plus 'total', from one aggregate over queryset"""
+        aggregates = {}
+        for group, options in self.groups.items():
+            others = self._filter(exclude=group)
+            for index, (_, _, q) in enumerate(options):
+                aggregates[f'{group}_{index}'] = Count('pk', filter=q & others if others else q)
+        total = self._filter()
+        aggregates['total'] = Count('pk', filter=total) if total else Count('pk')
+
+        selection = sorted((group, value) for group, (value, _) in self.selected.items())
+        key = f'store:facets:{catalog_version()}:' + hashlib.md5(repr((cache_key, selection)).encode()).hexdigest()
+        result = cache.get(key)
+        if result is None:
+            result = queryset.order_by().aggregate(**aggregates)
+            cache.set(key, result, timeout=getattr(settings, 'FACET_CACHE_SECONDS', 60))
+        return result
+
+    def build(self, queryset, cache_key=''):
+        """
+        Template data: (groups, total) where groups is a list of
+        {'name', 'options': [{'label', 'count', 'selected', 'url'}]}.
+        Options that would leave nothing are dropped unless selected.
+        """
+        result = self.counts(queryset, cache_key)
+        titles = {'sub': 'Category', 'price': 'Price', 'discount': 'Discount'}
+        groups = []
+        flags = {'name': 'Show only', 'options': []}
+        for group, options in self.groups.items():
+            entries = []
+            for index, (value, label, _) in enumerate(options):
+                count = result[f'{group}_{index}']
+                selected = self.selected.get(group, (None,))[0] == value
+                if count or selected:
+                    entries.append({
+                        'label': label,
+                        'count': count,
+                        'selected': selected,
+                        'url': self._url(group, None if selected else value),
+                    })
+            if group in titles:
+                if entries:
+                    groups.append({'name': titles[group], 'options': entries})
+            else:
+                flags['options'] += entries
+        if flags['options']:
+            groups.append(flags)
+        return groups, result['total']
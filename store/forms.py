@@ -1,6 +1,14 @@
 from django import forms
 from django.core.validators import RegexValidator
 from .models import DeliveryOption
+from .idempotency import new_key
+from .order_search import find_order
+from .phone import normalize_phone
+
+BD_MOBILE_VALIDATOR = RegexValidator(
+    regex=r'^(\+8801|01)[3-9]\d{8}$',
+    message='দয়া করে একটি সঠিক বাংলাদেশী ফোন নম্বর দিন (যেমন: 01712345678)'
+)
 
 class CheckoutForm(forms.Form):
     customer_name = forms.CharField(
@@ -18,12 +26,7 @@ class CheckoutForm(forms.Form):
     
     customer_phone = forms.CharField(
         max_length=15,
-        validators=[
-            RegexValidator(
-                regex=r'^(\+8801|01)[3-9]\d{8}$',
-                message='দয়া করে একটি সঠিক বাংলাদেশী ফোন নম্বর দিন (যেমন: 01712345678)'
-            )
-        ],
+        validators=[BD_MOBILE_VALIDATOR],
         widget=forms.TextInput(attrs={
             'class': 'form-control',
             'placeholder': 'আপনার মোবাইল নাম্বার',
@@ -79,8 +82,23 @@ class CheckoutForm(forms.Form):
         })
     )
     
+    coupon_code = forms.CharField(
+        required=False,
+        max_length=40,
+        widget=forms.TextInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'কুপন কোড (যদি থাকে)',
+            'autocomplete': 'off'
+        })
+    )
+    
+    # One-time key that makes repeated submissions of this form place one order (see store.idempotency)
+    idempotency_key = forms.CharField(required=False, max_length=32, widget=forms.HiddenInput())
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        if not self.is_bound:
+            self.fields['idempotency_key'].initial = new_key()
         # Set delivery option choices
         delivery_options = DeliveryOption.objects.filter(is_active=True)
         if delivery_options.exists():
@@ -93,4 +111,43 @@ class CheckoutForm(forms.Form):
                     widget_attrs = field.widget.attrs
                     css_classes = widget_attrs.get('class', '')
                     if 'is-invalid' not in css_classes:
-                        widget_attrs['class'] = f"{css_classes} is-invalid".strip()
\ No newline at end of file
+                        widget_attrs['class'] = f"{css_classes} is-invalid".strip()
+
+
+class OrderHistoryForm(forms.Form):
+    """Phone number plus one order ID from that phone, to prove whose history it is"""
+    customer_phone = forms.CharField(
+        max_length=15,
+        validators=[BD_MOBILE_VALIDATOR],
+        widget=forms.TextInput(attrs={
+            'class': 'form-control form-control-lg',
+            'placeholder': 'আপনার মোবাইল নাম্বার',
+            'type': 'tel',
+        }),
+        error_messages={
+            'required': 'দয়া করে আপনার ফোন নম্বর লিখুন।'
+        }
+    )
+    
+    order_number = forms.CharField(
+        max_length=20,
+        widget=forms.TextInput(attrs={
+            'class': 'form-control form-control-lg',
+            'placeholder': 'Any order ID from this number (e.g., ORD20240726123456)',
+        }),
+        error_messages={
+            'required': 'Please enter one of your order IDs.'
+        }
+    )
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        phone = normalize_phone(cleaned_data.get('customer_phone'))
+        number = cleaned_data.get('order_number')
+        if phone and number:
+            order = find_order(number)
+            # Same message either way so the form can't be used to probe order IDs
+            if order is None or order.phone_normalized != phone:
+                raise forms.ValidationError('We could not find an order with this ID for this phone number.')
+            cleaned_data['phone_normalized'] = phone
+        return cleaned_data
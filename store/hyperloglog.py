@@ -0,0 +1,67 @@
+"""
+A small HyperLogLog cardinality sketch.
+
+Counts distinct values in a fixed 2**precision bytes (4 KB by default,
+about 1.6% standard error) no matter how many values are added. Sketches
+of the same precision merge by taking the register-wise maximum, so daily
+sketches combine into weekly or monthly unique counts without the raw rows.
+"""
+import hashlib
+import math
+
+
+class HyperLogLog:
+    """Distinct-count estimator stored as a bytearray of registers"""
+
+    def __init__(self, precision=12, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision must be between 4 and 16')
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            registers = bytearray(self.size)
+        elif len(registers) != self.size:
+            raise ValueError('register count does not match precision')
+        self.registers = bytearray(registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Load a sketch saved with bytes(sketch); empty data gives an empty sketch"""
+        if not data:
+            return cls()
+        return cls(precision=len(data).bit_length() - 1, registers=data)
+
+    def __bytes__(self):
+        return bytes(self.registers)
+
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        rest = hashed & ((1 << remaining_bits) - 1)
+        # Position of the leftmost 1-bit in the remaining bits
+        rank = remaining_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Fold another sketch of the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches of different precision')
+        self.registers = bytearray(max(pair) for pair in zip(self.registers, other.registers))
+        return self
+
+    def count(self):
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Small range correction (linear counting)
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
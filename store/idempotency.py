@@ -0,0 +1,52 @@
+"""
+Idempotent checkout.
+
+Every checkout form carries a one-time key (a hidden field). The order
+placed with it stores the key in ``Order.idempotency_key`` (unique) and the
+cache maps the key to the order ID for ``CHECKOUT_IDEMPOTENCY_SECONDS``.
+A double tap or a retried POST with the same key is answered with the
+original confirmation redirect before anything is written: no second
+order, no second stock decrement. Two submissions racing each other are
+settled by the unique index; the loser's transaction rolls back and it
+redirects to the winner's order.
+"""
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Order
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def clean_key(value):
+    """The key if it looks like one of ours, else None (the submission is then not deduplicated)"""
+    value = (value or '').strip().lower()
+    return value if KEY_PATTERN.match(value) else None
+
+
+def _cache_key(key):
+    return f'store:checkout:{key}'
+
+
+def completed_order_id(key):
+    """Order ID already placed with this key, or None"""
+    if not key:
+        return None
+    order_id = cache.get(_cache_key(key))
+    if order_id is None:
+        order_id = Order.objects.filter(idempotency_key=key).values_list('order_id', flat=True).first()
+        if order_id is not None:
+            remember(key, order_id)
+    return order_id
+
+
+def remember(key, order_id):
+    if key:
+        cache.set(_cache_key(key), order_id, timeout=getattr(settings, 'CHECKOUT_IDEMPOTENCY_SECONDS', 24 * 60 * 60))
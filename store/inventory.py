@@ -0,0 +1,215 @@
+"""
+Stock bookkeeping for products.
+
+Normal products keep their stock in ``Product.stock_quantity`` and are
+decremented with a single conditional UPDATE, whose returned quantity tells
+when a sale sold the product out and its card needs refreshing. Products
+flagged with ``inventory_sharded`` keep their stock split across
+``InventoryShard`` rows: a sale takes a random shard that still has enough
+capacity, so concurrent checkouts of the same hot product lock different
+rows instead of queueing on one. ``Product.stock_quantity`` is then only a
+cached total, refreshed by ``rebalance()`` (see the ``rebalance_inventory``
+command), set to 0, with the listing card, as soon as a sale empties the
+last shard, and corrected by ``publish_shortage()`` once a sale it could
+not cover has rolled back. Stock checks use ``available_stock()``, which
+sums the shards.
+"""
+import random
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum
+
+from .models import Product, InventoryShard
+from .product_cards import refresh_cards
+
+
+class InsufficientStock(Exception):
+    """Raised when a product cannot cover the requested quantity"""
+
+    def __init__(self, product, requested, available=None):
+        self.product = product
+        self.requested = requested
+        self.available = available
+        super().__init__(f'Not enough stock available for {product.name}.')
+
+
+def get_shard_count():
+    """Default number of shards for newly sharded products"""
+    return getattr(settings, 'INVENTORY_SHARD_COUNT', 8)
+
+
+def split_quantity(quantity, shards):
+    """Spread quantity as evenly as possible over the given number of shards"""
+    base, extra = divmod(quantity, shards)
+    return [base + (1 if index < extra else 0) for index in range(shards)]
+
+
+def available_stock(product):
+    """Current stock of a product, summing shards when the product is sharded"""
+    if not product.inventory_sharded:
+        return product.stock_quantity
+    total = InventoryShard.objects.filter(product=product).aggregate(total=Sum('quantity'))['total']
+    return total or 0
+
+
+def decrement_stock(product, quantity):
+    """
+    Take quantity units of stock from a product.
+
+    Must be called inside a transaction so the row locks taken here are held
+    until the order that consumes the stock is committed. Raises
+    InsufficientStock if the product cannot cover the quantity.
+    """
+    if not product.inventory_sharded:
+        table = connection.ops.quote_name(Product._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET stock_quantity = stock_quantity - %s '
+                f'WHERE id = %s AND stock_quantity >= %s RETURNING stock_quantity',
+                [quantity, product.pk, quantity],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            raise InsufficientStock(product, quantity)
+        product.stock_quantity = row[0]
+        if not product.stock_quantity:
+            # This sale took the last unit; the card leaves the in-stock listings
+            product_id = product.pk
+            transaction.on_commit(lambda: refresh_cards([product_id]))
+        return
+
+    # Try shards that looked big enough in random order; the conditional
+    # UPDATE re-checks capacity so a stale read only costs a retry.
+    candidates = list(
+        InventoryShard.objects.filter(product=product, quantity__gte=quantity).values_list('pk', 'quantity')
+    )
+    random.shuffle(candidates)
+    for shard_pk, shard_quantity in candidates:
+        updated = InventoryShard.objects.filter(
+            pk=shard_pk, quantity__gte=quantity
+        ).update(quantity=F('quantity') - quantity)
+        if updated:
+            if shard_quantity == quantity:
+                # This shard is now empty; the product may be sold out
+                _publish_if_sold_out(product)
+            return
+
+    # No single shard can cover the sale: fall back to draining several
+    _drain_shards(product, quantity)
+
+
+def _drain_shards(product, quantity):
+    """Take quantity from several shards at once, locking them in a fixed order"""
+    shards = list(InventoryShard.objects.select_for_update().filter(product=product).order_by('shard'))
+    total = sum(shard.quantity for shard in shards)
+    if total < quantity:
+        # Anything written here is rolled back with the order; the caller
+        # publishes the real total afterwards (see publish_shortage)
+        raise InsufficientStock(product, quantity, available=total)
+
+    remaining = quantity
+    for shard in shards:
+        taken = min(shard.quantity, remaining)
+        shard.quantity -= taken
+        remaining -= taken
+        if not remaining:
+            break
+    InventoryShard.objects.bulk_update(shards, ['quantity'])
+    if total == quantity:
+        _publish_total(product, 0)
+
+
+def _publish_total(product, total):
+    """Write a sharded product's real total to the product row and its card"""
+    Product.objects.filter(pk=product.pk).update(stock_quantity=total)
+    product.stock_quantity = total
+    refresh_cards([product.pk])
+
+
+def publish_shortage(error):
+    """
+    After a sale failed with InsufficientStock and its transaction rolled
+    back, correct a sharded product's cached total so listings stop offering
+    stock it does not have.
+    """
+    product = error.product
+    if not product.inventory_sharded:
+        return
+    total = available_stock(product)
+    if total != product.stock_quantity:
+        _publish_total(product, total)
+
+
+def _publish_if_sold_out(product):
+    """Mark a sharded product out of stock once none of its shards has anything left"""
+    if not InventoryShard.objects.filter(product=product, quantity__gt=0).exists():
+        _publish_total(product, 0)
+
+
+def set_stock(product, quantity, shards=None):
+    """
+    Set the total stock of a product.
+
+    For sharded products the quantity is spread evenly over the shards
+    (creating or removing shard rows as needed); for normal products any
+    leftover shard rows are removed.
+    """
+    with transaction.atomic():
+        Product.objects.filter(pk=product.pk).update(stock_quantity=quantity)
+        product.stock_quantity = quantity
+        refresh_cards([product.pk])
+
+        existing = list(InventoryShard.objects.select_for_update().filter(product=product).order_by('shard'))
+        if not product.inventory_sharded:
+            if existing:
+                InventoryShard.objects.filter(product=product).delete()
+            return
+
+        shard_count = shards or len(existing) or get_shard_count()
+        _write_shards(product, existing, split_quantity(quantity, shard_count))
+
+
+def rebalance(product, shards=None):
+    """
+    Even out the shards of a sharded product and refresh its cached total.
+
+    Shards drain unevenly under random picking; rebalancing moves capacity
+    back so single-shard decrements keep succeeding. Returns the total stock.
+    """
+    if not product.inventory_sharded:
+        return product.stock_quantity
+
+    with transaction.atomic():
+        existing = list(InventoryShard.objects.select_for_update().filter(product=product).order_by('shard'))
+        if existing:
+            total = sum(shard.quantity for shard in existing)
+        else:
+            # First rebalance after flagging: seed shards from the product row
+            total = Product.objects.filter(pk=product.pk).values_list('stock_quantity', flat=True).first() or 0
+        shard_count = shards or len(existing) or get_shard_count()
+        _write_shards(product, existing, split_quantity(total, shard_count))
+        Product.objects.filter(pk=product.pk).update(stock_quantity=total)
+        product.stock_quantity = total
+        refresh_cards([product.pk])
+    return total
+
+
+def _write_shards(product, existing, quantities):
+    """Make the product's shard rows hold exactly the given quantities"""
+    by_index = {shard.shard: shard for shard in existing}
+    to_update, to_create = [], []
+    for index, shard_quantity in enumerate(quantities):
+        shard = by_index.pop(index, None)
+        if shard is None:
+            to_create.append(InventoryShard(product=product, shard=index, quantity=shard_quantity))
+        else:
+            shard.quantity = shard_quantity
+            to_update.append(shard)
+
+    if to_update:
+        InventoryShard.objects.bulk_update(to_update, ['quantity'])
+    if to_create:
+        InventoryShard.objects.bulk_create(to_create)
+    if by_index:
+        InventoryShard.objects.filter(pk__in=[shard.pk for shard in by_index.values()]).delete()
@@ -0,0 +1,95 @@
+"""
+Housekeeping for tables that only ever grow: abandoned carts, expired sessions,
+raw visit rows and daily view counters.
+
+Everything is deleted in bounded primary-key batches, each in its own short
+statement, so a cleanup never holds long locks on the cart or session tables.
+``collect_garbage()`` is used by the ``collect_garbage`` management command
+(for cron) and by ``maybe_collect_garbage()``, which the tracking middleware
+calls so small installs get cleaned up without a scheduler.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import CartItem
+
+GC_LOCK_KEY = 'store:gc:lock'
+
+# Process-local throttle so most requests don't even touch the cache
+_next_check = 0.0
+
+
+def delete_in_batches(queryset, batch_size=None, max_batches=None, pause=0):
+    """Delete the rows of queryset in primary-key batches and return how many went"""
+    batch_size = batch_size or getattr(settings, 'GC_BATCH_SIZE', 1000)
+    model = queryset.model
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted += model.objects.filter(pk__in=ids).delete()[0]
+        batches += 1
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def collect_garbage(batch_size=None, max_batches=None, pause=0, now=None):
+    """
+    Remove expired sessions and abandoned carts.
+
+    Returns a dict with the number of reclaimed rows per kind.
+    """
+    now = now or timezone.now()
+    retention = timedelta(days=getattr(settings, 'CART_RETENTION_DAYS', 30))
+    options = {'batch_size': batch_size, 'max_batches': max_batches, 'pause': pause}
+
+    reclaimed = {}
+    reclaimed['sessions'] = delete_in_batches(
+        Session.objects.filter(expire_date__lt=now), **options
+    )
+    # Carts nobody has touched within the retention window
+    reclaimed['abandoned_cart_items'] = delete_in_batches(
+        CartItem.objects.filter(updated_at__lt=now - retention), **options
+    )
+    # Carts whose session is gone can never be reached again
+    reclaimed['orphaned_cart_items'] = delete_in_batches(
+        CartItem.objects.filter(
+            ~Exists(Session.objects.filter(session_key=OuterRef('session_key')))
+        ), **options
+    )
+    # Raw visits past the retention window, once their day is rolled up
+    from .visit_rollups import prune_visits
+    reclaimed['visits'] = prune_visits(today=now.date(), **options)
+    from .popularity import prune_view_counts
+    reclaimed['view_counts'] = prune_view_counts(today=now.date(), **options)
+    return reclaimed
+
+
+def maybe_collect_garbage():
+    """
+    Run a small garbage collection pass at most once per GC_INTERVAL_SECONDS.
+
+    The cache lock makes sure only one worker in the cluster does the work;
+    the pass is limited to a few batches so the request that triggers it
+    stays fast. Returns the reclaimed counts, or None if nothing ran.
+    """
+    global _next_check
+    interval = getattr(settings, 'GC_INTERVAL_SECONDS', 3600)
+    if not interval or time.monotonic() < _next_check:
+        return None
+    _next_check = time.monotonic() + interval
+
+    if not cache.add(GC_LOCK_KEY, 1, timeout=interval):
+        return None
+    return collect_garbage(max_batches=getattr(settings, 'GC_REQUEST_MAX_BATCHES', 2))
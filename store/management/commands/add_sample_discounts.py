@@ -1,29 +1,27 @@
 from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, F, IntegerField
+from django.db.models.functions import Cast, Floor, Random, Round
 from store.models import Product
-from decimal import Decimal
-import random
+from store.product_cards import rebuild_all
 
 class Command(BaseCommand):
     help = 'Add sample original prices to products to demonstrate discount functionality'
 
     def handle(self, *args, **options):
-        products = Product.objects.all()
-        updated_count = 0
-        
-        for product in products:
-            # Generate a random original price 10-50% higher than current price
-            discount_percentage = random.randint(10, 50)
-            original_price = product.price * Decimal(100 + discount_percentage) / Decimal(100)
-            
-            # Round to 2 decimal places
-            product.original_price = original_price.quantize(Decimal('0.01'))
-            product.save()
-            updated_count += 1
-            
-            self.stdout.write(
-                f'Updated {product.name}: Original ৳{product.original_price} → Current ৳{product.price} ({product.discount_percentage}% OFF)'
-            )
-        
+        # One UPDATE: a random original price 10-50% higher than the current price,
+        # rounded to 2 decimal places. discount_percentage is recomputed by the database.
+        markup = Cast(Floor(Random() * 41), IntegerField()) + 110
+        updated_count = Product.objects.update(original_price=Round(F('price') * markup / 100, 2))
+
+        # A queryset update skips the signals that keep the listing cards in step
+        rebuild_all()
+
+        summary = Product.objects.filter(discount_percentage__gt=0).aggregate(
+            discounted=Count('pk'), average=Avg('discount_percentage')
+        )
+        self.stdout.write(
+            f'{summary["discounted"]} products on sale, {summary["average"] or 0:.0f}% OFF on average'
+        )
         self.stdout.write(
             self.style.SUCCESS(f'Successfully updated {updated_count} products with original prices!')
         )
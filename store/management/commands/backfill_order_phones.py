@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from store.models import Order
+from store.phone import normalize_phone
+
+
+class Command(BaseCommand):
+    help = 'Fill Order.phone_normalized for orders saved before the column existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Orders updated per statement'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute every order, not only the ones without a normalized phone'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches to leave room for live traffic'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        orders = Order.objects.order_by('pk')
+        if not options['all']:
+            orders = orders.filter(phone_normalized='')
+
+        # Walk the primary key so each batch is an index range, not an OFFSET
+        last_pk = 0
+        updated = unparseable = 0
+        while True:
+            batch = list(orders.filter(pk__gt=last_pk).values_list('pk', 'customer_phone')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            changes = []
+            for pk, phone in batch:
+                normalized = normalize_phone(phone)
+                if normalized:
+                    changes.append(Order(pk=pk, phone_normalized=normalized))
+                else:
+                    unparseable += 1
+            Order.objects.bulk_update(changes, ['phone_normalized'])
+            updated += len(changes)
+            self.stdout.write(f'{updated} orders updated', ending='\r')
+
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write('')
+        if unparseable:
+            self.stdout.write(self.style.WARNING(f'{unparseable} orders have a phone number that could not be normalized'))
+        self.stdout.write(self.style.SUCCESS(f'Successfully normalized {updated} phone numbers!'))
@@ -0,0 +1,372 @@
+import random
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.template import Context, Template
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from store.idempotency import new_key
+from store.inventory import decrement_stock, set_stock
+from store.maintenance import delete_in_batches
+from store.models import Category, DeliveryOption, Order, Product, ProductCard
+from store.order_search import plan_search, search_orders
+from store.phone import normalize_phone
+
+BENCHMARK_ORDER_NOTE = 'benchmark order'
+ADMISSION_ORDER_NOTE = 'benchmark admission order'
+
+# The fields a storefront product card shows; IMAGE and CATEGORY differ per source
+GRID_TEMPLATE = (
+    "{% for product in products %}<a href=\"{% url 'product_detail' product.slug %}\">"
+    "{% if product.IMAGE %}<img src=\"{{ product.IMAGE_URL }}\" alt=\"{{ product.name }}\">{% endif %}"
+    "{{ product.name }} {{ product.CATEGORY }}"
+    "{% if product.has_discount %}<s>{{ product.original_price }}</s> -{{ product.discount_percentage }}%{% endif %}"
+    "{{ product.price }}{% if product.is_in_stock %} in stock{% endif %}</a>{% endfor %}"
+)
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks against the configured database'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+        hot_sku = subparsers.add_parser(
+            'hot_sku',
+            help='Checkout throughput on a single hot product for several shard counts'
+        )
+        hot_sku.add_argument('--shards', default='1,4,16', help='Comma-separated shard counts (1 = unsharded)')
+        hot_sku.add_argument('--threads', type=int, default=16, help='Concurrent checkouts')
+        hot_sku.add_argument('--iterations', type=int, default=100, help='Checkouts per thread')
+        hot_sku.add_argument('--hold-ms', type=float, default=5.0, help='Time each checkout keeps its transaction open')
+
+        anonymous = subparsers.add_parser(
+            'anonymous_views',
+            help='Database writes caused by anonymous product page views'
+        )
+        anonymous.add_argument('--product', help='Slug of the product page to view (defaults to the newest product)')
+        anonymous.add_argument('--views', type=int, default=20, help='Page views per visitor type')
+
+        order_search = subparsers.add_parser(
+            'order_search',
+            help='Latency of each order search shape (order ID, phone, email, id, name)'
+        )
+        order_search.add_argument('--seed', type=int, default=0, help='Insert this many synthetic orders first (e.g. 2000000)')
+        order_search.add_argument('--repeat', type=int, default=50, help='Searches per shape')
+        order_search.add_argument('--explain', action='store_true', help='Print the query plan for each shape')
+        order_search.add_argument('--cleanup', action='store_true', help='Delete the synthetic orders afterwards')
+
+        listing = subparsers.add_parser(
+            'listing',
+            help='Query and render cost of a product grid page from Product rows vs ProductCard rows'
+        )
+        listing.add_argument('--per-page', type=int, default=12, help='Products per page')
+        listing.add_argument('--repeat', type=int, default=50, help='Pages fetched and rendered per source')
+
+        admission = subparsers.add_parser(
+            'admission',
+            help='Latency of the checkout view on a hot product with and without checkout admission control'
+        )
+        admission.add_argument('--threads', type=int, default=40, help='Shoppers checking out at once')
+        admission.add_argument('--iterations', type=int, default=25, help='Checkout attempts per shopper')
+        admission.add_argument('--poll-ms', type=float, default=100.0, help='Pause before a shopper sent to the waiting room tries again')
+        admission.add_argument('--rate', type=float, default=20.0, help='Admissions per second when gated')
+        admission.add_argument('--burst', type=int, default=4, help='Admission bucket size when gated')
+
+    def handle(self, *args, **options):
+        scenario = options['scenario']
+        getattr(self, f'bench_{scenario}')(**options)
+
+    def run_threads(self, worker, threads, iterations):
+        """Run worker(iteration) in parallel threads and return elapsed seconds"""
+        errors = []
+
+        def run():
+            try:
+                for iteration in range(iterations):
+                    worker(iteration)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        pool = [threading.Thread(target=run) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if errors:
+            raise CommandError(f'{len(errors)} worker(s) failed: {errors[0]}')
+        return elapsed
+
+    def count_writes(self, queries):
+        """Count INSERT/UPDATE/DELETE statements, and how many of them hit the session table"""
+        writes = [
+            query['sql'] for query in queries
+            if query['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+        session_writes = [sql for sql in writes if 'django_session' in sql]
+        return len(writes), len(session_writes)
+
+    def bench_anonymous_views(self, **options):
+        product = Product.objects.all()
+        if options['product']:
+            product = product.filter(slug=options['product'])
+        product = product.first()
+        if product is None:
+            raise CommandError('No product found to view.')
+        url = product.get_absolute_url()
+        views = options['views']
+
+        # A browser keeps its cookies between views; a crawler usually doesn't
+        browser = Client()
+        visitors = {
+            'browser': lambda: browser,
+            'crawler': lambda: Client(),
+        }
+
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for name, get_client in visitors.items():
+                total_writes = total_session_writes = 0
+                warm_writes = 0
+                for view in range(views):
+                    with CaptureQueriesContext(connection) as captured:
+                        response = get_client().get(url)
+                    if response.status_code != 200:
+                        raise CommandError(f'{url} returned {response.status_code}')
+                    writes, session_writes = self.count_writes(captured.captured_queries)
+                    total_writes += writes
+                    total_session_writes += session_writes
+                    if view:
+                        warm_writes += writes
+                self.stdout.write(
+                    f'{name:<8} {views} views: {total_writes} writes '
+                    f'({total_session_writes} to django_session), '
+                    f'{warm_writes / max(views - 1, 1):.2f} writes per repeat view'
+                )
+
+    def bench_hot_sku(self, **options):
+        try:
+            shard_counts = [int(value) for value in options['shards'].split(',')]
+        except ValueError:
+            raise CommandError('--shards must be a comma-separated list of integers')
+        threads = options['threads']
+        iterations = options['iterations']
+        hold = options['hold_ms'] / 1000
+
+        category = Category.objects.create(name='Benchmark Hot SKU')
+        product = Product.objects.create(
+            name='Benchmark Hot SKU', description='', price=1, category=category, image=''
+        )
+        try:
+            for shard_count in shard_counts:
+                product.inventory_sharded = shard_count > 1
+                Product.objects.filter(pk=product.pk).update(inventory_sharded=product.inventory_sharded)
+                set_stock(product, threads * iterations * 2, shards=shard_count)
+
+                def checkout(iteration):
+                    hot_product = Product.objects.get(pk=product.pk)
+                    with transaction.atomic():
+                        decrement_stock(hot_product, 1)
+                        # Stand-in for the order inserts done while the stock row is locked
+                        time.sleep(hold)
+
+                elapsed = self.run_threads(checkout, threads, iterations)
+                checkouts = threads * iterations
+                self.stdout.write(
+                    f'shards={shard_count:<3} {checkouts} checkouts in {elapsed:.2f}s '
+                    f'-> {checkouts / elapsed:.1f} checkouts/sec'
+                )
+        finally:
+            product.delete()
+            category.delete()
+
+    def seed_orders(self, count, batch_size=5000):
+        """Insert synthetic orders in batches (bulk_create skips Order.save, so fill every column)"""
+        first_names = ['Rahim', 'Karim', 'Fatema', 'Ayesha', 'Tanvir', 'Nusrat', 'Sakib', 'Mim', 'Arif', 'Sumaiya']
+        last_names = ['Ahmed', 'Hossain', 'Islam', 'Rahman', 'Khan', 'Chowdhury', 'Akter', 'Uddin', 'Sarker', 'Begum']
+        start = Order.objects.filter(notes=BENCHMARK_ORDER_NOTE).count()
+        for offset in range(0, count, batch_size):
+            orders = []
+            for n in range(start + offset, start + min(offset + batch_size, count)):
+                first = first_names[n % len(first_names)]
+                last = last_names[(n // len(first_names)) % len(last_names)]
+                phone = f'01{3 + n % 7}{n % 10 ** 8:08d}'
+                # ORD9... can't collide with older ORD<YYYYMMDDHHMMSS> ids before the year 9000,
+                # and is shorter than the 20-character ids of new orders
+                order_id = f'ORD9{n:013d}'
+                orders.append(Order(
+                    order_id=order_id,
+                    tracking_number=order_id,
+                    customer_name=f'{first} {last} {n}',
+                    customer_email=f'{first}.{last}{n}@example.com'.lower(),
+                    customer_phone=phone,
+                    phone_normalized=normalize_phone(phone),
+                    shipping_address='Benchmark Road, Dhaka',
+                    total_amount=100 + n % 5000,
+                    notes=BENCHMARK_ORDER_NOTE,
+                ))
+            Order.objects.bulk_create(orders)
+            self.stdout.write(f'seeded {start + offset + len(orders)} orders', ending='\r')
+        self.stdout.write('')
+
+    def sample_searches(self):
+        """Pick a random existing order and derive one query per search shape"""
+        bounds = Order.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            raise CommandError('No orders to search; run with --seed first.')
+        pivot = random.randint(bounds['low'], bounds['high'])
+        order = Order.objects.filter(pk__gte=pivot).order_by('pk').first()
+        return {
+            'order_id': order.order_id,
+            'phone': order.customer_phone,
+            'email': order.customer_email.upper() or 'nobody@example.com',
+            'pk': str(order.pk),
+            'name': order.customer_name.split()[0],
+        }
+
+    def bench_order_search(self, **options):
+        if options['seed']:
+            self.seed_orders(options['seed'])
+        self.stdout.write(f'{Order.objects.count()} orders')
+
+        timings = {}
+        for iteration in range(options['repeat']):
+            for shape, query in self.sample_searches().items():
+                if plan_search(query).shape != shape:
+                    # e.g. an order without email, or a name that looks like a number
+                    continue
+                queryset = search_orders(Order.objects.all(), query)[:20]
+                if options['explain'] and iteration == 0:
+                    self.stdout.write(f'--- {shape}: {query}')
+                    self.stdout.write(queryset.explain())
+                started = time.perf_counter()
+                list(queryset)
+                timings.setdefault(shape, []).append((time.perf_counter() - started) * 1000)
+
+        for shape, samples in timings.items():
+            samples.sort()
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            self.stdout.write(
+                f'{shape:<9} median {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms   '
+                f'max {samples[-1]:7.2f} ms'
+            )
+
+        if options['cleanup']:
+            deleted = delete_in_batches(Order.objects.filter(notes=BENCHMARK_ORDER_NOTE), batch_size=10000)
+            self.stdout.write(f'deleted {deleted} synthetic orders')
+
+    def bench_listing(self, **options):
+        per_page = options['per_page']
+        sources = {
+            # What the listing views loaded before the read model
+            'product': (
+                Product.objects.filter(stock_quantity__gt=0),
+                GRID_TEMPLATE.replace('IMAGE_URL', 'image.url').replace('IMAGE', 'image').replace('CATEGORY', 'category.name'),
+            ),
+            'card': (
+                ProductCard.objects.filter(in_stock=True),
+                GRID_TEMPLATE.replace('IMAGE_URL', 'image_url').replace('IMAGE', 'image_url').replace('CATEGORY', 'category_name'),
+            ),
+        }
+        total = ProductCard.objects.filter(in_stock=True).count()
+        if not total:
+            raise CommandError('No in-stock product cards; run rebuild_product_cards first.')
+        self.stdout.write(f'{total} in-stock products, {per_page} per page')
+
+        for name, (queryset, source) in sources.items():
+            template = Template(source)
+            query_times, render_times, query_counts = [], [], []
+            for _ in range(options['repeat']):
+                offset = random.randint(0, max(total - per_page, 0))
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    page = list(queryset[offset:offset + per_page])
+                    fetched = time.perf_counter()
+                    template.render(Context({'products': page}))
+                    rendered = time.perf_counter()
+                query_times.append((fetched - started) * 1000)
+                # Lazy category lookups during rendering are part of the render cost
+                render_times.append((rendered - fetched) * 1000000 / max(len(page), 1))
+                query_counts.append(len(captured.captured_queries))
+            self.stdout.write(
+                f'{name:<8} query median {statistics.median(query_times):7.2f} ms   '
+                f'render {statistics.median(render_times):8.1f} us/card   '
+                f'{statistics.median(query_counts):.0f} queries/page'
+            )
+
+    def bench_admission(self, **options):
+        threads = options['threads']
+        iterations = options['iterations']
+        poll = options['poll_ms'] / 1000
+
+        category = Category.objects.create(name='Benchmark Admission')
+        product = Product.objects.create(
+            name='Benchmark Admission', description='', price=1, category=category, image=''
+        )
+        delivery_option = DeliveryOption.objects.filter(is_active=True).first()
+        created_option = delivery_option is None
+        if created_option:
+            delivery_option = DeliveryOption.objects.create(name='Benchmark Delivery', description='', price=0)
+        add_to_cart_url = reverse('add_to_cart', args=[product.pk])
+        checkout_url = reverse('checkout')
+        waiting_room_url = reverse('waiting_room')
+        try:
+            for gated in (False, True):
+                set_stock(product, threads * iterations * 2)
+                latencies, turned_away = [], []
+
+                def checkout(iteration):
+                    # A new shopper each time: own cart cookie, no admission ticket
+                    shopper = Client()
+                    shopper.post(add_to_cart_url, {'quantity': 1})
+                    started = time.perf_counter()
+                    response = shopper.post(checkout_url, {
+                        'customer_name': 'Benchmark Shopper',
+                        'customer_phone': '01712345678',
+                        'shipping_address': 'Benchmark Road, Dhaka',
+                        'delivery_option': delivery_option.pk,
+                        'notes': ADMISSION_ORDER_NOTE,
+                        'idempotency_key': new_key(),
+                    })
+                    elapsed = (time.perf_counter() - started) * 1000
+                    if response.status_code == 302 and response.url.startswith(waiting_room_url):
+                        # Sent to the waiting room: costs the shopper a poll, not a transaction
+                        turned_away.append(1)
+                        time.sleep(poll)
+                        return
+                    if response.status_code != 302 or not response.url.startswith('/order-confirmation/'):
+                        raise CommandError(f'checkout returned {response.status_code} {response.get("Location", "")}')
+                    latencies.append(elapsed)
+
+                settings_override = {
+                    'ALLOWED_HOSTS': ['*'],
+                    'RATE_LIMITS': {},  # every shopper comes from the same address here
+                    'CHECKOUT_ADMISSION_RATE': options['rate'] if gated else 0,
+                    'CHECKOUT_ADMISSION_BURST': options['burst'],
+                }
+                with override_settings(**settings_override):
+                    elapsed = self.run_threads(checkout, threads, iterations)
+                if not latencies:
+                    raise CommandError('No checkout was admitted; raise --rate or --burst.')
+                latencies.sort()
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                self.stdout.write(
+                    f'{"gated" if gated else "open":<6} {len(latencies)} checkouts in {elapsed:.2f}s '
+                    f'({len(latencies) / elapsed:.1f}/sec), {len(turned_away)} sent to the waiting room   '
+                    f'p50 {statistics.median(latencies):7.1f} ms   p99 {p99:7.1f} ms'
+                )
+        finally:
+            Order.objects.filter(notes=ADMISSION_ORDER_NOTE).delete()
+            product.delete()
+            category.delete()
+            if created_option:
+                delivery_option.delete()
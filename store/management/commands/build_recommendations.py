@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from store.recommendations import build
+
+
+class Command(BaseCommand):
+    help = 'Build "customers also bought" recommendations from order baskets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recount every order instead of only those since the last run'
+        )
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=None,
+            help='Recommendations kept per product (defaults to RECOMMENDATION_TOP_K)'
+        )
+        parser.add_argument(
+            '--min-count',
+            type=int,
+            default=1,
+            help='Ignore product pairs bought together in fewer orders than this'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        try:
+            orders, products = build(
+                full=options['full'], top_k=options['top_k'], min_count=options['min_count']
+            )
+        except ImportError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(
+            f'{orders} orders processed, {products} products rescored in {time.monotonic() - started:.1f}s'
+        )
+        self.stdout.write(self.style.SUCCESS('Successfully built recommendations!'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from store.maintenance import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions, abandoned carts, old raw visits and old view counters in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Rows deleted per statement (defaults to GC_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            help='Stop each kind of cleanup after this many batches'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches to leave room for live traffic'
+        )
+
+    def handle(self, *args, **options):
+        reclaimed = collect_garbage(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            pause=options['pause'],
+        )
+
+        for kind, count in reclaimed.items():
+            self.stdout.write(f'{kind.replace("_", " ").capitalize()}: {count} rows deleted')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully reclaimed {sum(reclaimed.values())} rows!')
+        )
@@ -0,0 +1,82 @@
+import csv
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from store.catalog_import import ProductImporter
+
+
+class Command(BaseCommand):
+    help = 'Import or update products in bulk from a CSV or JSONL catalog file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help='File format (guessed from the extension by default)'
+        )
+        parser.add_argument(
+            '--key',
+            choices=['slug', 'sku'],
+            default='slug',
+            help='Column used to match existing products'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Products upserted per statement'
+        )
+        parser.add_argument(
+            '--images',
+            help='Directory holding the image files named in the "image" column'
+        )
+        parser.add_argument(
+            '--image-workers',
+            type=int,
+            default=8,
+            help='Threads used to copy images'
+        )
+        parser.add_argument(
+            '--no-create-categories',
+            action='store_true',
+            help='Reject rows whose category path does not exist instead of creating it'
+        )
+        parser.add_argument(
+            '--errors',
+            help='Write rejected rows to this CSV file'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'File not found: {path}')
+        if options['images'] and not os.path.isdir(options['images']):
+            raise CommandError(f'Image directory not found: {options["images"]}')
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+        importer = ProductImporter(
+            key=options['key'],
+            batch_size=options['batch_size'],
+            image_dir=options['images'],
+            image_workers=options['image_workers'],
+            create_categories=not options['no_create_categories'],
+        )
+        with open(path, encoding='utf-8-sig', newline='') as handle:
+            report = importer.run(handle, file_format)
+
+        for error in report.errors[:20]:
+            line = f"line {error['line']}: " if error['line'] else ''
+            self.stdout.write(self.style.WARNING(f"{line}{error['error']}"))
+        if len(report.errors) > 20:
+            self.stdout.write(self.style.WARNING(f'... and {len(report.errors) - 20} more errors'))
+
+        if options['errors'] and report.errors:
+            with open(options['errors'], 'w', newline='', encoding='utf-8') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(['line', 'error', 'row'])
+                for error in report.errors:
+                    writer.writerow([error['line'], error['error'], error['row']])
+            self.stdout.write(f'Rejected rows written to {options["errors"]}')
+
+        self.stdout.write(self.style.SUCCESS(report.summary()))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from store.inventory import rebalance
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Even out the stock shards of sharded products and refresh their cached totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product',
+            help='Slug of a single product to rebalance'
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            help='Change the number of shards while rebalancing'
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.filter(inventory_sharded=True)
+        if options['product']:
+            products = products.filter(slug=options['product'])
+
+        rebalanced = 0
+        for product in products.iterator():
+            total = rebalance(product, shards=options['shards'])
+            rebalanced += 1
+            self.stdout.write(f'Rebalanced {product.name}: {total} in stock')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebalanced {rebalanced} sharded products!')
+        )
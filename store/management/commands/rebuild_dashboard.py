@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from store.dashboard import merge_pending, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the admin dashboard snapshot from scratch (run from cron to correct drift)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pending',
+            action='store_true',
+            help='Only merge the queued order and stock changes into the current snapshot'
+        )
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            snapshot = merge_pending()
+            if snapshot is None:
+                self.stdout.write('No snapshot to merge into yet, or another merge is running')
+                return
+        else:
+            snapshot = rebuild()
+        self.stdout.write(
+            f'{snapshot.total_orders} orders, ৳{snapshot.total_revenue} revenue, '
+            f'{snapshot.total_products} products, {len(snapshot.low_stock_products)} low on stock'
+        )
+        if options['pending']:
+            self.stdout.write(self.style.SUCCESS('Successfully merged pending dashboard changes!'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Successfully rebuilt the dashboard snapshot!'))
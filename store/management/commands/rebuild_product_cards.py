@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from store.product_cards import rebuild_all
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized product cards used by storefront listings'
+
+    def handle(self, *args, **options):
+        written = rebuild_all()
+        self.stdout.write(f'{written} product cards written')
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt product cards!'))
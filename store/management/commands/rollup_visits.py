@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from store.visit_rollups import prune_visits, rollup_day
+
+
+class Command(BaseCommand):
+    help = 'Fold raw visits into daily rollups and optionally prune old raw rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=2,
+            help='Roll up this many days, ending today (default: today and yesterday)'
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='Also delete raw visits older than VISIT_RETENTION_DAYS'
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        for offset in range(options['days'] - 1, -1, -1):
+            rollup = rollup_day(today - timedelta(days=offset))
+            self.stdout.write(
+                f'{rollup.date}: {rollup.visits} visits, ~{rollup.unique_sessions} unique visitors, '
+                f'~{rollup.unique_ips} unique IPs'
+            )
+
+        if options['prune']:
+            deleted = prune_visits()
+            self.stdout.write(f'{deleted} raw visits deleted')
+
+        self.stdout.write(self.style.SUCCESS('Successfully rolled up visits!'))
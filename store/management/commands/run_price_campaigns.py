@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from store.pricing import run_due_campaigns
+
+
+class Command(BaseCommand):
+    help = 'Start and end price campaigns whose time window has opened or closed (run every minute from cron)'
+
+    def handle(self, *args, **options):
+        started, ended = run_due_campaigns()
+        self.stdout.write(f'{started} campaign(s) started, {ended} ended')
+        self.stdout.write(self.style.SUCCESS('Successfully ran price campaigns!'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from store.popularity import update_popularity
+
+
+class Command(BaseCommand):
+    help = 'Recompute product popularity scores from recent views and sales'
+
+    def handle(self, *args, **options):
+        scored = update_popularity()
+        self.stdout.write(f'{scored} products have a popularity score')
+        self.stdout.write(self.style.SUCCESS('Successfully updated popularity scores!'))
@@ -1,9 +1,37 @@
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
+import uuid
+from . import popularity
+from .maintenance import maybe_collect_garbage
+from .pricing import maybe_run_campaigns
+from .ratelimit import get_client_ip
 from .models import UserVisit, OnlineUser
 
+VISITOR_COOKIE_NAME = 'visitor_id'
+VISITOR_COOKIE_SALT = 'store.middleware.visitor'
+VISITOR_COOKIE_MAX_AGE = 60 * 60 * 24 * 365
+
+def read_visitor(request):
+    """The visitor from the signed visitor cookie, or None if it is missing or tampered with"""
+    value = request.get_signed_cookie(VISITOR_COOKIE_NAME, default=None, salt=VISITOR_COOKIE_SALT)
+    if value:
+        try:
+            visitor_id, visit_date, seen_at = value.split('|')
+            return {'id': visitor_id, 'visit_date': visit_date, 'seen_at': int(seen_at)}
+        except ValueError:
+            pass
+    return None
+
 class UserTrackingMiddleware:
-    """Middleware to track user visits and online users"""
+    """
+    Middleware to track user visits and online users.
+    
+    Visitors are identified by a signed ``visitor_id`` cookie rather than the
+    session, so anonymous browsing never creates a session row. The cookie
+    also remembers when the visitor was last recorded, which lets repeat page
+    views skip the database entirely.
+    """
     
     def __init__(self, get_response):
         self.get_response = get_response
@@ -14,18 +42,46 @@ class UserTrackingMiddleware:
             response = self.get_response(request)
             return response
         
+        visitor = self.get_visitor(request)
+        tracked = dict(visitor)
+        
         # Track visit and online users only for relevant requests
         try:
             # Track visit
-            self.track_visit(request)
+            self.track_visit(request, tracked)
             
             # Update online users
-            self.track_online_user(request)
+            self.track_online_user(request, tracked)
         except Exception:
             # If database operations fail, continue without blocking the request
             pass
         
         response = self.get_response(request)
+        
+        if tracked != visitor:
+            self.set_visitor_cookie(response, tracked)
+        
+        # Count page views in memory; they reach the database in periodic batches.
+        # A 304 is a view of a page the browser already had (see store.conditional)
+        if request.method == 'GET' and response.status_code in (200, 304):
+            popularity.count_page_view(request.path)
+        try:
+            popularity.maybe_flush()
+        except Exception:
+            pass
+        
+        # Periodically reclaim expired sessions and abandoned carts
+        try:
+            maybe_collect_garbage()
+        except Exception:
+            pass
+        
+        # Start and end price campaigns on time even without cron
+        try:
+            maybe_run_campaigns()
+        except Exception:
+            pass
+        
         return response
 
     def should_skip_tracking(self, request):
@@ -38,66 +94,86 @@ class UserTrackingMiddleware:
             if request.path.startswith(skip_path):
                 return True
         
+        # Crawlers and health checks are not visitors (see store.traffic)
+        if getattr(request, 'is_bot', False):
+            return True
+        
         # Skip AJAX requests to avoid excessive tracking
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return True
             
         return False
 
-    def track_visit(self, request):
-        """Track daily unique visits per session"""
-        if not request.session.session_key:
-            request.session.create()
+    def get_visitor(self, request):
+        """Read the signed visitor cookie, starting a new visitor if it is missing or tampered with"""
+        return read_visitor(request) or {'id': uuid.uuid4().hex, 'visit_date': '', 'seen_at': 0}
+
+    def set_visitor_cookie(self, response, visitor):
+        """Store the visitor id and last tracking times in a signed cookie"""
+        value = f"{visitor['id']}|{visitor['visit_date']}|{visitor['seen_at']}"
+        response.set_signed_cookie(
+            VISITOR_COOKIE_NAME,
+            value,
+            salt=VISITOR_COOKIE_SALT,
+            max_age=VISITOR_COOKIE_MAX_AGE,
+            httponly=True,
+            samesite='Lax',
+        )
+
+    def track_visit(self, request, visitor):
+        """Track daily unique visits per visitor"""
+        today = timezone.now().date()
+        if visitor['visit_date'] == today.isoformat():
+            # Already recorded today
+            return
         
-        session_key = request.session.session_key
         ip_address = self.get_client_ip(request)
         user_agent = request.META.get('HTTP_USER_AGENT', '')[:500]
         page_visited = request.path
         
-        # Create visit record (unique per session per day)
+        # Create visit record (unique per visitor per day)
         UserVisit.objects.get_or_create(
-            session_key=session_key,
-            date=timezone.now().date(),
+            session_key=visitor['id'],
+            date=today,
             defaults={
                 'ip_address': ip_address,
                 'user_agent': user_agent,
                 'page_visited': page_visited,
             }
         )
+        visitor['visit_date'] = today.isoformat()
 
-    def track_online_user(self, request):
+    def track_online_user(self, request, visitor):
         """Track currently online users"""
-        if not request.session.session_key:
-            request.session.create()
+        now = timezone.now()
+        refresh = getattr(settings, 'ONLINE_USER_REFRESH_SECONDS', 60)
+        if now.timestamp() - visitor['seen_at'] < refresh:
+            # Recently marked as online; the record is still fresh
+            return
         
-        session_key = request.session.session_key
         ip_address = self.get_client_ip(request)
         user_agent = request.META.get('HTTP_USER_AGENT', '')[:500]
         current_page = request.path
         
         # Update or create online user record
         OnlineUser.objects.update_or_create(
-            session_key=session_key,
+            session_key=visitor['id'],
             defaults={
                 'ip_address': ip_address,
                 'user_agent': user_agent,
                 'current_page': current_page,
-                'last_activity': timezone.now(),
+                'last_activity': now,
             }
         )
+        visitor['seen_at'] = int(now.timestamp())
         
         # Clean up old online users (inactive for more than 5 minutes)
         # Only do cleanup occasionally to reduce database load
         import random
         if random.randint(1, 20) == 1:  # 5% chance to run cleanup
-            cutoff_time = timezone.now() - timedelta(minutes=5)
+            cutoff_time = now - timedelta(minutes=5)
             OnlineUser.objects.filter(last_activity__lt=cutoff_time).delete()
 
     def get_client_ip(self, request):
         """Get the client's IP address"""
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip or '127.0.0.1'
+        return get_client_ip(request)
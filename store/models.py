@@ -1,8 +1,14 @@
-from django.db import models
-from django.core.validators import MinValueValidator
+import secrets
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Cast, Floor, Upper
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
 from django.utils.text import slugify
 
+from .phone import normalize_phone
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(max_length=110, unique=True, blank=True)
@@ -104,6 +110,7 @@ class Category(models.Model):
 class Product(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(max_length=220, unique=True, blank=True)
+    sku = models.CharField(max_length=64, unique=True, blank=True, null=True, help_text='Stock keeping unit, used to match products on catalog import')
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     original_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], blank=True, null=True, help_text='Original price before discount')
@@ -113,6 +120,24 @@ class Product(models.Model):
     stock_quantity = models.PositiveIntegerField(default=0)
     is_best_seller = models.BooleanField(default=False)
     is_featured = models.BooleanField(default=False)
+    inventory_sharded = models.BooleanField(default=False, help_text='Split stock across several counter rows to avoid lock contention on hot products')
+    popularity_score = models.FloatField(default=0, editable=False, help_text='Trending score from recent views and sales (see store.popularity)')
+    # Whole percent off original_price, computed by the database on every write (bulk updates included)
+    discount_percentage = models.GeneratedField(
+        expression=models.Case(
+            models.When(
+                original_price__gt=models.F('price'),
+                then=Cast(
+                    Floor((models.F('original_price') - models.F('price')) * 100 / models.F('original_price')),
+                    models.PositiveSmallIntegerField(),
+                ),
+            ),
+            default=models.Value(0),
+            output_field=models.PositiveSmallIntegerField(),
+        ),
+        output_field=models.PositiveSmallIntegerField(),
+        db_persist=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -131,6 +156,8 @@ class Product(models.Model):
             models.Index(fields=['category', 'stock_quantity'], name='product_cat_stock_idx'),
             models.Index(fields=['is_best_seller', 'stock_quantity'], name='product_best_stock_idx'),
             models.Index(fields=['is_featured', 'stock_quantity'], name='product_feat_stock_idx'),
+            models.Index(fields=['-popularity_score', 'stock_quantity'], name='product_popularity_idx'),
+            models.Index(fields=['-discount_percentage', 'stock_quantity'], name='product_discount_idx'),
         ]
     
     def save(self, *args, **kwargs):
@@ -190,13 +217,6 @@ class Product(models.Model):
         """Check if product has a discount (original price > current price)"""
         return self.original_price and self.original_price > self.price
     
-    @property
-    def discount_percentage(self):
-        """Calculate discount percentage"""
-        if not self.has_discount:
-            return 0
-        return int(((self.original_price - self.price) / self.original_price) * 100)
-    
     @property
     def savings_amount(self):
         """Calculate savings amount"""
@@ -204,6 +224,126 @@ class Product(models.Model):
             return 0
         return self.original_price - self.price
 
+
+class ProductCard(models.Model):
+    """What a product grid shows, one narrow row per product (see store.product_cards)"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    name = models.CharField(max_length=200)
+    slug = models.SlugField(max_length=220)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    original_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    discount_percentage = models.PositiveSmallIntegerField(default=0)
+    image_url = models.CharField(max_length=500, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='product_cards')
+    category_slug = models.SlugField(max_length=110)
+    category_name = models.CharField(max_length=100)
+    category_path = models.CharField(max_length=500)
+    in_stock = models.BooleanField(default=False)
+    is_best_seller = models.BooleanField(default=False)
+    is_featured = models.BooleanField(default=False)
+    popularity_score = models.FloatField(default=0)
+    created_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # One per listing filter + sort: home sections, /products/ and category pages
+            models.Index(fields=['in_stock', '-created_at'], name='card_stock_created_idx'),
+            models.Index(fields=['in_stock', '-popularity_score'], name='card_stock_popular_idx'),
+            models.Index(fields=['is_featured', 'in_stock', '-created_at'], name='card_featured_idx'),
+            models.Index(fields=['is_best_seller', 'in_stock', '-created_at'], name='card_bestseller_idx'),
+            models.Index(fields=['category', 'in_stock', 'name'], name='card_category_name_idx'),
+            models.Index(fields=['category', 'in_stock', 'price'], name='card_category_price_idx'),
+            models.Index(fields=['category', 'in_stock', '-created_at'], name='card_category_created_idx'),
+            models.Index(fields=['in_stock', '-discount_percentage'], name='card_stock_discount_idx'),
+            models.Index(fields=['category', 'in_stock', '-discount_percentage'], name='card_category_discount_idx'),
+        ]
+    
+    def __str__(self):
+        return self.name
+    
+    @property
+    def id(self):
+        # Templates and carts refer to products by id
+        return self.product_id
+    
+    def get_absolute_url(self):
+        from django.urls import reverse
+        return reverse('product_detail', kwargs={'product_slug': self.slug})
+    
+    @property
+    def is_in_stock(self):
+        return self.in_stock
+    
+    @property
+    def has_discount(self):
+        return self.original_price is not None and self.original_price > self.price
+
+
+class InventoryShard(models.Model):
+    """One slice of a sharded product's stock (see store.inventory)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventory_shards')
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['product', 'shard']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='unique_inventory_shard'),
+        ]
+    
+    def __str__(self):
+        return f'{self.product.name} - shard {self.shard} ({self.quantity})'
+
+
+class PriceCampaign(models.Model):
+    """A time-windowed price cut on a set of products and categories (see store.pricing)"""
+    STATUS_CHOICES = [
+        ('scheduled', 'Scheduled'),
+        ('active', 'Active'),
+        ('ended', 'Ended'),
+        ('cancelled', 'Cancelled'),
+    ]
+    
+    name = models.CharField(max_length=200)
+    percent_off = models.PositiveSmallIntegerField(validators=[MinValueValidator(1), MaxValueValidator(95)])
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    products = models.ManyToManyField(Product, blank=True, related_name='price_campaigns')
+    categories = models.ManyToManyField(Category, blank=True, related_name='price_campaigns', help_text='Includes every subcategory')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='scheduled', editable=False)
+    applied_at = models.DateTimeField(null=True, blank=True, editable=False)
+    reverted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-starts_at']
+        indexes = [
+            models.Index(fields=['status', 'starts_at'], name='campaign_status_start_idx'),
+            models.Index(fields=['status', 'ends_at'], name='campaign_status_end_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(ends_at__gt=models.F('starts_at')), name='pricecampaign_window_check'),
+        ]
+    
+    def __str__(self):
+        return f'{self.name} ({self.percent_off}% off)'
+
+
+class PriceOverride(models.Model):
+    """A product's campaign price and the prices it replaced, kept while the campaign runs"""
+    campaign = models.ForeignKey(PriceCampaign, on_delete=models.CASCADE, related_name='overrides')
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='price_override')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    previous_price = models.DecimalField(max_digits=10, decimal_places=2)
+    previous_original_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    
+    class Meta:
+        ordering = ['campaign', 'product']
+    
+    def __str__(self):
+        return f'{self.product_id}: {self.previous_price} -> {self.price}'
+
 class HeroBanner(models.Model):
     title = models.CharField(max_length=200)
     subtitle = models.CharField(max_length=300, blank=True)
@@ -240,6 +380,45 @@ class DeliveryOption(models.Model):
     def __str__(self):
         return f"{self.name} - ${self.price}"
 
+
+class Coupon(models.Model):
+    """A discount code redeemable at checkout (see store.coupons)"""
+    KIND_CHOICES = [
+        ('percent', 'Percentage off'),
+        ('fixed', 'Fixed amount off'),
+        ('free_delivery', 'Free delivery'),
+    ]
+    
+    code = models.CharField(max_length=40, unique=True, help_text='Stored in upper case; customers can type it in any case')
+    description = models.CharField(max_length=200, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='percent')
+    value = models.DecimalField(max_digits=10, decimal_places=2, default=0, validators=[MinValueValidator(0)], help_text='Percent or amount off; ignored for free delivery')
+    max_discount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, validators=[MinValueValidator(0)], help_text='Cap on a percentage discount')
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0, validators=[MinValueValidator(0)])
+    categories = models.ManyToManyField(Category, blank=True, related_name='coupons', help_text='Only products in these categories (and below) count; leave empty for all')
+    starts_at = models.DateTimeField(blank=True, null=True)
+    ends_at = models.DateTimeField(blank=True, null=True)
+    usage_limit = models.PositiveIntegerField(blank=True, null=True, help_text='Total redemptions allowed; empty for no limit')
+    per_phone_limit = models.PositiveIntegerField(blank=True, null=True, help_text='Redemptions allowed per phone number; empty for no limit')
+    times_used = models.PositiveIntegerField(default=0, editable=False)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_active', 'ends_at'], name='coupon_active_end_idx'),
+        ]
+    
+    def __str__(self):
+        return self.code
+    
+    def save(self, *args, **kwargs):
+        self.code = self.code.strip().upper()
+        super().save(*args, **kwargs)
+
+
 class CartItem(models.Model):
     session_key = models.CharField(max_length=40)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -252,7 +431,8 @@ class CartItem(models.Model):
         indexes = [
             models.Index(fields=['session_key'], name='cartitem_session_idx'),
             models.Index(fields=['product'], name='cartitem_product_idx'),
-            models.Index(fields=['created_at'], name='cartitem_created_idx'),
+            # Used by the abandoned cart cleanup (store.maintenance)
+            models.Index(fields=['updated_at'], name='cartitem_updated_idx'),
             # Composite index for cart operations
             models.Index(fields=['session_key', 'product'], name='cartitem_session_product_idx'),
         ]
@@ -264,6 +444,14 @@ class CartItem(models.Model):
     def total_price(self):
         return self.product.price * self.quantity
 
+ORDER_ID_ATTEMPTS = 5
+
+
+def generate_order_id():
+    """ORD, the UTC time to the second (YYMMDDHHMMSS) and 5 random digits: 20 characters"""
+    return f"ORD{timezone.now().strftime('%y%m%d%H%M%S')}{secrets.randbelow(10 ** 5):05d}"
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -280,14 +468,18 @@ class Order(models.Model):
     customer_name = models.CharField(max_length=100)
     customer_email = models.EmailField(blank=True)
     customer_phone = models.CharField(max_length=20)
+    phone_normalized = models.CharField(max_length=16, blank=True, editable=False)  # E.164, see store.phone
     shipping_address = models.TextField()
     delivery_option = models.ForeignKey(DeliveryOption, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
     delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    coupon = models.ForeignKey(Coupon, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     payment_method = models.CharField(max_length=20, default='cod')  # Cash on Delivery
     notes = models.TextField(blank=True)
+    idempotency_key = models.CharField(max_length=32, unique=True, blank=True, null=True, editable=False)  # See store.idempotency
     estimated_delivery = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -301,6 +493,12 @@ class Order(models.Model):
             models.Index(fields=['customer_name'], name='order_customer_idx'),
             models.Index(fields=['customer_email'], name='order_email_idx'),
             models.Index(fields=['customer_phone'], name='order_phone_idx'),
+            # Customer order history: one range scan per phone, newest first
+            models.Index(fields=['phone_normalized', 'created_at'], name='order_phone_created_idx'),
+            # Order search (store.order_search): case-insensitive email equality
+            # and substring name matches through pg_trgm
+            models.Index(Upper('customer_email'), name='order_email_upper_idx'),
+            GinIndex(OpClass(Upper('customer_name'), name='gin_trgm_ops'), name='order_name_trgm_idx'),
             # Composite indexes for common admin queries
             models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
         ]
@@ -309,13 +507,31 @@ class Order(models.Model):
         return f"Order {self.order_id} - {self.customer_name}"
     
     def save(self, *args, **kwargs):
-        if not self.order_id:
-            # Generate order ID
-            timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
-            self.order_id = f"ORD{timestamp}"
-        if not self.tracking_number:
-            self.tracking_number = self.order_id  # Use order_id as tracking number
-        super().save(*args, **kwargs)
+        self.phone_normalized = normalize_phone(self.customer_phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'customer_phone' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_normalized'}
+        if self.order_id:
+            if not self.tracking_number:
+                self.tracking_number = self.order_id  # Use order_id as tracking number
+            super().save(*args, **kwargs)
+            return
+        
+        # Orders placed in the same second differ by the random suffix; on the
+        # rare clash the insert is rolled back to a savepoint and retried
+        use_order_id = not self.tracking_number
+        for attempt in range(ORDER_ID_ATTEMPTS):
+            self.order_id = generate_order_id()
+            if use_order_id:
+                self.tracking_number = self.order_id
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                # Anything but an order ID clash (e.g. a reused idempotency key) is the caller's to handle
+                if attempt == ORDER_ID_ATTEMPTS - 1 or not Order.objects.filter(order_id=self.order_id).exists():
+                    raise
     
     def get_status_display_with_icon(self):
         """Get status with appropriate icon"""
@@ -366,6 +582,25 @@ class OrderItem(models.Model):
         return self.price * self.quantity
 
 
+class CouponRedemption(models.Model):
+    """One use of a coupon, by the order that used it"""
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='redemptions')
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='coupon_redemption')
+    phone_normalized = models.CharField(max_length=16)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Per-phone limit check
+            models.Index(fields=['coupon', 'phone_normalized'], name='redemption_coupon_phone_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.coupon.code} on {self.order.order_id}'
+
+
 class OrderStatusHistory(models.Model):
     """Track order status changes for detailed tracking"""
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_history')
@@ -446,6 +681,101 @@ class UserVisit(models.Model):
         return f'Visit on {self.date} - {self.ip_address}'
 
 
+class DailyVisitRollup(models.Model):
+    """UserVisit rows folded into one row per day (see store.visit_rollups)"""
+    date = models.DateField(unique=True)
+    visits = models.PositiveIntegerField(default=0)
+    unique_sessions = models.PositiveIntegerField(default=0)
+    unique_ips = models.PositiveIntegerField(default=0)
+    # HyperLogLog registers, merged to count uniques over several days
+    session_sketch = models.BinaryField(default=bytes)
+    ip_sketch = models.BinaryField(default=bytes)
+    top_pages = models.JSONField(default=dict, blank=True)  # {path: visits}
+    user_agent_families = models.JSONField(default=dict, blank=True)  # {family: visits}
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f'Visits on {self.date}: {self.visits}'
+
+
+class PageViewDaily(models.Model):
+    """Page views per path per day, flushed from in-memory counters (see store.popularity)"""
+    date = models.DateField()
+    path = models.CharField(max_length=255)
+    views = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-date', '-views']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'path'], name='pageviewdaily_date_path_uniq'),
+        ]
+    
+    def __str__(self):
+        return f'{self.path} on {self.date}: {self.views}'
+
+
+class ProductViewDaily(models.Model):
+    """Product detail views per product per day (see store.popularity)"""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_views')
+    views = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-date', '-views']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='productviewdaily_date_product_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'date'], name='productviewdaily_product_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.product_id} on {self.date}: {self.views}'
+
+
+class TrafficDaily(models.Model):
+    """Requests per traffic class per day (see store.traffic)"""
+    TRAFFIC_CLASS_CHOICES = [
+        ('human', 'Human'),
+        ('bot', 'Bot'),
+        ('health_check', 'Health check'),
+        ('rate_limited', 'Rate limited'),  # counted on top of the request's own class
+    ]
+    
+    date = models.DateField()
+    traffic_class = models.CharField(max_length=20, choices=TRAFFIC_CLASS_CHOICES)
+    requests = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-date', 'traffic_class']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'traffic_class'], name='trafficdaily_date_class_uniq'),
+        ]
+    
+    def __str__(self):
+        return f'{self.get_traffic_class_display()} on {self.date}: {self.requests}'
+
+
+class ProductRecommendation(models.Model):
+    """A product's top co-purchased products, rebuilt offline (see store.recommendations)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_for')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='productrecommendation_rank_uniq'),
+        ]
+    
+    def __str__(self):
+        return f'{self.product_id} -> {self.recommended_id} (#{self.rank})'
+
+
 class OnlineUser(models.Model):
     """Track currently online users"""
     session_key = models.CharField(max_length=40, unique=True)
@@ -485,3 +815,37 @@ class ProductImage(models.Model):
     
     def __str__(self):
         return f'{self.product.name} - Image {self.order}'
+
+
+class DashboardSnapshot(models.Model):
+    """Precomputed admin dashboard figures, kept in a single row (see store.dashboard)"""
+    total_products = models.PositiveIntegerField(default=0)
+    total_orders = models.PositiveIntegerField(default=0)
+    total_categories = models.PositiveIntegerField(default=0)
+    total_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    visits_date = models.DateField(null=True, blank=True)
+    today_visits = models.PositiveIntegerField(default=0)
+    current_online = models.PositiveIntegerField(default=0)
+    monthly_revenue = models.JSONField(default=dict, blank=True)  # {'2025-01': '1234.50'}
+    top_products = models.JSONField(default=list, blank=True)
+    low_stock_products = models.JSONField(default=list, blank=True)
+    rebuilt_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f'Dashboard snapshot - {self.updated_at}'
+
+
+class DashboardDelta(models.Model):
+    """A change waiting to be merged into DashboardSnapshot (see store.dashboard)"""
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    month = models.CharField(max_length=7, blank=True)  # '2025-01', the month the revenue belongs to
+    products = models.IntegerField(default=0)  # products added (or, negative, removed)
+    categories = models.IntegerField(default=0)  # categories added (or, negative, removed)
+    order_id = models.BigIntegerField(null=True, blank=True)  # a placed order, whose items count as sales
+    product_ids = models.JSONField(default=list, blank=True)  # products whose stock may have changed
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f'Dashboard delta {self.pk}'
@@ -0,0 +1,51 @@
+"""
+Cached storefront navigation fragments.
+
+The category sidebar (the desktop and mobile menu) and the home page
+category carousel are rendered once from a ``CategoryTree`` (one query,
+levels precomputed), and the HTML is cached under the current category-tree
+version. The ``{% category_menu %}`` and ``{% category_carousel %}`` tags
+in ``store.templatetags.navigation`` emit it verbatim.
+
+Saving or deleting a category bumps the version (see ``store.signals``), so
+the next render builds fresh fragments and the old ones simply expire. With
+a per-process cache, other workers pick up the change once their copy is
+``NAV_FRAGMENT_TIMEOUT`` seconds old. The fragments don't depend on the
+request; the current category is highlighted in the browser.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .category_tree import CategoryTree
+from .versions import bump_version, get_version
+
+TREE_VERSION_KEY = 'store:category_tree:version'
+FRAGMENT_TEMPLATES = {
+    'menu': 'partials/category_menu.html',
+    'carousel': 'partials/category_carousel.html',
+}
+
+
+def tree_version():
+    return get_version(TREE_VERSION_KEY)
+
+
+def bump_tree_version():
+    """Invalidate every cached navigation fragment"""
+    bump_version(TREE_VERSION_KEY)
+
+
+def render_fragment(name):
+    """The HTML of a navigation fragment, rendered on a cache miss"""
+    key = f'store:nav:{name}:{tree_version()}'
+    html = cache.get(key)
+    if html is None:
+        tree = CategoryTree.load()
+        html = render_to_string(FRAGMENT_TEMPLATES[name], {
+            'categories': tree.nested(),
+            'all_categories': list(tree.by_id.values()),
+        })
+        cache.set(key, html, timeout=getattr(settings, 'NAV_FRAGMENT_TIMEOUT', 300))
+    return html
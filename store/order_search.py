@@ -0,0 +1,82 @@
+"""
+Order search planner.
+
+A search box query is classified by its shape and turned into a lookup one
+specific index can answer, instead of OR-ing ``icontains`` over every
+column (which casts the primary key to text and scans the table):
+
+* ``ORD25010112300048213`` -> exact ``order_id`` / ``tracking_number`` (unique indexes)
+* ``017-1234-5678``       -> ``phone_normalized`` equality (E.164, see store.phone)
+* ``someone@mail.com``    -> ``UPPER(customer_email)`` equality (expression index)
+* ``42`` or ``#42``       -> primary key
+* anything else           -> ``customer_name`` substring via the pg_trgm GIN index
+"""
+import re
+from collections import namedtuple
+
+from .models import Order
+from .phone import normalize_phone
+
+ORDER_ID_PATTERN = re.compile(r'^ORD\d+$', re.IGNORECASE)
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+$')
+PK_PATTERN = re.compile(r'^#?(\d{1,9})$')
+
+SearchPlan = namedtuple('SearchPlan', ['shape', 'value'])
+
+
+def plan_search(query):
+    """Classify a search query and return the SearchPlan used to run it"""
+    query = (query or '').strip()
+    if not query:
+        return SearchPlan('empty', '')
+    if ORDER_ID_PATTERN.match(query):
+        return SearchPlan('order_id', query.upper())
+    if EMAIL_PATTERN.match(query):
+        return SearchPlan('email', query)
+    phone = normalize_phone(query)
+    if phone:
+        return SearchPlan('phone', phone)
+    match = PK_PATTERN.match(query)
+    if match:
+        return SearchPlan('pk', int(match.group(1)))
+    return SearchPlan('name', query)
+
+
+def find_order(number, queryset=None):
+    """
+    Return the order with this order ID or tracking number, or None.
+
+    Each column is tried with its own unique-index equality lookup rather
+    than an OR of both, which the planner can't always serve from one index.
+    """
+    queryset = Order.objects.all() if queryset is None else queryset
+    number = (number or '').strip().upper()
+    if not number:
+        return None
+    return queryset.filter(order_id=number).first() or queryset.filter(tracking_number=number).first()
+
+
+def search_orders(orders, query):
+    """Filter an order queryset by a search box query using the planned lookup"""
+    plan = plan_search(query)
+    if plan.shape == 'empty':
+        return orders
+    if plan.shape == 'order_id':
+        order = find_order(plan.value, orders)
+        return orders.filter(pk=order.pk) if order else orders.none()
+    if plan.shape == 'email':
+        return orders.filter(customer_email__iexact=plan.value)
+    if plan.shape == 'phone':
+        return orders.filter(phone_normalized=plan.value)
+    if plan.shape == 'pk':
+        return orders.filter(pk=plan.value)
+    # UPPER(customer_name) LIKE UPPER('%...%') matches order_name_trgm_idx
+    return orders.filter(customer_name__icontains=plan.value)
+
+
+def orders_for_phone(phone):
+    """A customer's orders, newest first, served by order_phone_created_idx"""
+    phone = normalize_phone(phone)
+    if not phone:
+        return Order.objects.none()
+    return Order.objects.filter(phone_normalized=phone).order_by('-created_at')
@@ -0,0 +1,26 @@
+"""
+Phone number normalization.
+
+Customers type Bangladeshi mobile numbers as ``01712345678``,
+``+8801712345678``, ``8801712345678`` or with spaces and dashes. Orders
+store the E.164 form (``+8801712345678``) next to the raw input so one
+number always maps to one indexed value.
+"""
+import re
+
+_SEPARATORS = re.compile(r'[\s\-().]')
+_BD_MOBILE = re.compile(r'^(?:\+?880|0)?(1[3-9]\d{8})$')
+_E164 = re.compile(r'^\+[1-9]\d{7,14}$')
+
+
+def normalize_phone(value):
+    """Return the E.164 form of a phone number, or '' if it isn't one"""
+    value = _SEPARATORS.sub('', value or '')
+    if value.startswith('00'):
+        value = '+' + value[2:]
+    match = _BD_MOBILE.match(value)
+    if match:
+        return '+880' + match.group(1)
+    if _E164.match(value):
+        return value
+    return ''
@@ -0,0 +1,200 @@
+"""
+Page, product and request counters and the trending score built from them.
+
+Views are counted in process memory - a dict increment per request, no
+database or cache round trip - and flushed every ``VIEW_COUNTER_FLUSH_SECONDS``
+into ``PageViewDaily``, ``ProductViewDaily`` and ``TrafficDaily`` (requests
+per traffic class, see store.traffic) with batched
+``INSERT ... ON CONFLICT DO UPDATE SET views = views + EXCLUDED.views``
+statements. Each worker flushes its own counts, so the upsert adds rather
+than overwrites. A worker that dies loses at most one interval of counts.
+
+``update_popularity()`` turns recent product views and units sold into
+``Product.popularity_score`` (exponentially decayed, so trending rather than
+all-time), which the storefront uses for best sellers and the "popular" sort.
+It scans weeks of counters, so it only runs from the ``update_popularity``
+command (run it from cron); the request path only ever flushes.
+"""
+import atexit
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from datetime import time as day_time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_version
+from .maintenance import delete_in_batches
+from .models import OrderItem, PageViewDaily, Product, ProductCard, ProductViewDaily, TrafficDaily
+
+UPSERT_BATCH_SIZE = 500
+SCORE_BATCH_SIZE = 1000
+# Distinct paths buffered per worker between flushes; stops URL scanners from growing the buffer
+MAX_BUFFERED_PAGES = 5000
+
+_lock = threading.Lock()
+_page_views = Counter()     # {(date, path): views}
+_product_views = Counter()  # {(date, product_id): views}
+_requests = Counter()       # {(date, traffic_class): requests}
+_next_flush = None
+
+
+def count_page_view(path):
+    """Count one view of a storefront page"""
+    key = (timezone.localdate(), path[:255])
+    with _lock:
+        if key in _page_views or len(_page_views) < MAX_BUFFERED_PAGES:
+            _page_views[key] += 1
+
+
+def count_product_view(product_id):
+    """Count one view of a product detail page"""
+    with _lock:
+        _product_views[(timezone.localdate(), product_id)] += 1
+
+
+def count_request(traffic_class):
+    """Count one request of a traffic class"""
+    with _lock:
+        _requests[(timezone.localdate(), traffic_class)] += 1
+
+
+def _upsert(model, key_columns, rows, counter='views'):
+    """Add (key..., count) rows to model's daily counters, a batch per statement"""
+    table = connection.ops.quote_name(model._meta.db_table)
+    counter = connection.ops.quote_name(counter)
+    columns = ', '.join(connection.ops.quote_name(column) for column in key_columns) + f', {counter}'
+    conflict = ', '.join(connection.ops.quote_name(column) for column in key_columns)
+    row_sql = '(' + ', '.join(['%s'] * (len(key_columns) + 1)) + ')'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES {", ".join([row_sql] * len(batch))} '
+                f'ON CONFLICT ({conflict}) DO UPDATE SET {counter} = {table}.{counter} + EXCLUDED.{counter}',
+                [value for row in batch for value in row],
+            )
+
+
+def flush():
+    """Write this worker's buffered counts to the database and return how many views went"""
+    global _page_views, _product_views, _requests
+    with _lock:
+        pages, _page_views = _page_views, Counter()
+        products, _product_views = _product_views, Counter()
+        requests, _requests = _requests, Counter()
+    if not pages and not products and not requests:
+        return 0
+
+    # Products deleted since they were viewed would violate the foreign key
+    existing = set(
+        Product.objects.filter(pk__in={product_id for _, product_id in products}).values_list('pk', flat=True)
+    )
+    product_rows = [
+        (day, product_id, views) for (day, product_id), views in products.items() if product_id in existing
+    ]
+    page_rows = [(day, path, views) for (day, path), views in pages.items()]
+    with transaction.atomic():
+        _upsert(PageViewDaily, ['date', 'path'], page_rows)
+        _upsert(ProductViewDaily, ['date', 'product_id'], product_rows)
+        _upsert(TrafficDaily, ['date', 'traffic_class'], [
+            (day, traffic_class, count) for (day, traffic_class), count in requests.items()
+        ], counter='requests')
+    return sum(pages.values()) + sum(views for _, _, views in product_rows)
+
+
+def maybe_flush():
+    """Flush at most once per VIEW_COUNTER_FLUSH_SECONDS, the first time one interval after the worker starts counting"""
+    global _next_flush
+    interval = getattr(settings, 'VIEW_COUNTER_FLUSH_SECONDS', 60)
+    now = time.monotonic()
+    if _next_flush is None:
+        _next_flush = now + interval
+    if now < _next_flush:
+        return
+    _next_flush = now + interval
+    flush()
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        # The database may already be unreachable while the worker shuts down
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def update_popularity(today=None):
+    """
+    Recompute Product.popularity_score and return the number of products scored.
+
+    Each day in the last POPULARITY_WINDOW_DAYS contributes its product views
+    plus POPULARITY_SALES_WEIGHT points per unit sold (cancelled orders
+    excluded), halved every POPULARITY_HALF_LIFE_DAYS days back.
+    """
+    today = today or timezone.localdate()
+    start = today - timedelta(days=getattr(settings, 'POPULARITY_WINDOW_DAYS', 30) - 1)
+    decay = 0.5 ** (1 / getattr(settings, 'POPULARITY_HALF_LIFE_DAYS', 7))
+    sales_weight = getattr(settings, 'POPULARITY_SALES_WEIGHT', 20)
+
+    scores = defaultdict(float)
+    views = ProductViewDaily.objects.filter(date__gte=start).values_list('product_id', 'date', 'views')
+    for product_id, day, count in views.iterator():
+        scores[product_id] += count * decay ** (today - day).days
+
+    sales = (
+        OrderItem.objects.filter(order__created_at__gte=timezone.make_aware(datetime.combine(start, day_time.min)))
+        .exclude(order__status='cancelled')
+        .annotate(day=TruncDate('order__created_at'))
+        .values_list('product_id', 'day')
+        .annotate(units=Sum('quantity'))
+        .order_by()
+    )
+    for product_id, day, units in sales:
+        scores[product_id] += sales_weight * units * decay ** max((today - day).days, 0)
+
+    items = list(scores.items())
+    with transaction.atomic():
+        # The listing cards carry a copy of the score (see store.product_cards)
+        for model in (Product, ProductCard):
+            # Products that dropped out of the window go back to zero
+            model.objects.filter(popularity_score__gt=0).exclude(pk__in=list(scores)).update(popularity_score=0)
+            for start_index in range(0, len(items), SCORE_BATCH_SIZE):
+                batch = dict(items[start_index:start_index + SCORE_BATCH_SIZE])
+                model.objects.filter(pk__in=list(batch)).update(popularity_score=Case(
+                    *[When(pk=pk, then=Value(round(score, 4))) for pk, score in batch.items()],
+                    default=F('popularity_score'),
+                    output_field=FloatField(),
+                ))
+    # Best sellers and the "popular" sort may have changed order
+    bump_catalog_version()
+    return len(scores)
+
+
+def by_popularity(queryset):
+    """
+    Order products by trending score.
+
+    Until views or sales are recorded every score is zero, so the
+    hand-picked best sellers still come first.
+    """
+    return queryset.order_by('-popularity_score', '-is_best_seller', '-created_at')
+
+
+def prune_view_counts(batch_size=None, max_batches=None, pause=0, today=None):
+    """Delete daily view counters older than VISIT_RETENTION_DAYS and return how many went"""
+    options = {'batch_size': batch_size, 'max_batches': max_batches, 'pause': pause}
+    today = today or timezone.localdate()
+    cutoff = today - timedelta(days=getattr(settings, 'VISIT_RETENTION_DAYS', 90))
+    return sum(
+        delete_in_batches(model.objects.filter(date__lt=cutoff), **options)
+        for model in (PageViewDaily, ProductViewDaily, TrafficDaily)
+    )
@@ -0,0 +1,182 @@
+"""
+Scheduled price campaigns.
+
+A ``PriceCampaign`` cuts prices by ``percent_off`` between ``starts_at`` and
+``ends_at`` for its products and every product in its categories (and their
+subcategories). The scheduler (``run_due_campaigns()``, from the
+``run_price_campaigns`` command or, at most once per
+``PRICE_CAMPAIGN_CHECK_SECONDS``, from a request) applies and reverts whole
+campaigns with a fixed number of set-based statements, no matter how many
+products they touch:
+
+* apply: one ``INSERT ... SELECT`` records each product's campaign price and
+  the prices it replaces in ``PriceOverride``, one ``UPDATE ... FROM``
+  writes the campaign prices (the old price becomes ``original_price``, so
+  the storefront shows the discount) and one more copies them to the
+  product cards;
+* revert: the same in reverse, then the overrides are deleted.
+
+A product is in at most one running campaign; overlapping campaigns skip
+products another one already holds. Prices edited by hand during a campaign
+are left alone on revert. Each campaign boundary commits in one transaction
+and bumps the catalog cache version (store.catalog_cache) exactly once.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_version
+from .category_tree import CategoryTree
+from .models import PriceCampaign, PriceOverride, Product, ProductCard
+
+CAMPAIGN_LOCK_KEY = 'store:pricing:lock'
+
+_next_check = 0.0
+
+
+def _tables():
+    quote = connection.ops.quote_name
+    return {
+        'product': quote(Product._meta.db_table),
+        'override': quote(PriceOverride._meta.db_table),
+        'card': quote(ProductCard._meta.db_table),
+    }
+
+
+def _sync_cards(cursor, campaign_id):
+    """Copy the current prices of the campaign's products to their cards"""
+    cursor.execute(
+        'UPDATE {card} AS c SET price = p.price, original_price = p.original_price, '
+        'discount_percentage = p.discount_percentage '
+        'FROM {product} AS p JOIN {override} AS o ON o.product_id = p.id '
+        'WHERE c.product_id = p.id AND o.campaign_id = %s'.format(**_tables()),
+        [campaign_id],
+    )
+
+
+def _category_ids(campaign):
+    tree = CategoryTree.load()
+    category_ids = set()
+    for pk in campaign.categories.values_list('pk', flat=True):
+        category_ids.add(pk)
+        category_ids.update(tree.descendant_ids(pk))
+    return sorted(category_ids)
+
+
+def _apply(campaign, now):
+    """Put a campaign's prices in place; returns the number of products repriced"""
+    tables = _tables()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {override} (campaign_id, product_id, price, previous_price, previous_original_price) '
+            'SELECT %s, id, ROUND(price * %s / 100, 2), price, original_price FROM {product} '
+            'WHERE category_id = ANY(%s) OR id = ANY(%s) '
+            'ON CONFLICT (product_id) DO NOTHING'.format(**tables),
+            [
+                campaign.pk, 100 - campaign.percent_off, _category_ids(campaign),
+                list(campaign.products.values_list('pk', flat=True)),
+            ],
+        )
+        # SET expressions see the old row, so GREATEST keeps a higher original price
+        cursor.execute(
+            'UPDATE {product} AS p SET price = o.price, '
+            'original_price = GREATEST(p.price, p.original_price), updated_at = %s '
+            'FROM {override} AS o WHERE o.product_id = p.id AND o.campaign_id = %s'.format(**tables),
+            [now, campaign.pk],
+        )
+        repriced = cursor.rowcount
+        _sync_cards(cursor, campaign.pk)
+    return repriced
+
+
+def _revert(campaign, now):
+    """Restore the prices a campaign replaced; returns the number of products restored"""
+    tables = _tables()
+    with connection.cursor() as cursor:
+        # A price changed by hand since the campaign started is kept
+        cursor.execute(
+            'UPDATE {product} AS p SET price = o.previous_price, '
+            'original_price = o.previous_original_price, updated_at = %s '
+            'FROM {override} AS o WHERE o.product_id = p.id AND o.campaign_id = %s '
+            'AND p.price = o.price'.format(**tables),
+            [now, campaign.pk],
+        )
+        restored = cursor.rowcount
+        _sync_cards(cursor, campaign.pk)
+    PriceOverride.objects.filter(campaign=campaign).delete()
+    return restored
+
+
+def _locked(pk, status):
+    """The campaign row, locked, if it still has status; None when another worker got there first"""
+    return PriceCampaign.objects.select_for_update(skip_locked=True).filter(pk=pk, status=status).first()
+
+
+def start_campaign(pk, now=None):
+    """Apply a scheduled campaign now; returns the number of products repriced"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        campaign = _locked(pk, 'scheduled')
+        if campaign is None:
+            return 0
+        repriced = _apply(campaign, now)
+        PriceCampaign.objects.filter(pk=pk).update(status='active', applied_at=now)
+        transaction.on_commit(bump_catalog_version)
+    return repriced
+
+
+def end_campaign(pk, now=None, status='ended'):
+    """Revert a running campaign (or close a scheduled one); returns the number of products restored"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        campaign = _locked(pk, 'active')
+        if campaign is None:
+            PriceCampaign.objects.filter(pk=pk, status='scheduled').update(status=status)
+            return 0
+        restored = _revert(campaign, now)
+        PriceCampaign.objects.filter(pk=pk).update(status=status, reverted_at=now)
+        transaction.on_commit(bump_catalog_version)
+    return restored
+
+
+def cancel_campaign(pk, now=None):
+    """Stop a campaign for good, restoring prices if it is running"""
+    return end_campaign(pk, now, status='cancelled')
+
+
+def run_due_campaigns(now=None):
+    """
+    End the campaigns whose window has closed, then start the ones whose
+    window is open. Returns (campaigns started, campaigns ended).
+    """
+    now = now or timezone.now()
+    # Ends first, so products can move straight into a campaign starting at the same moment
+    ended = 0
+    for pk in PriceCampaign.objects.filter(status='active', ends_at__lte=now).values_list('pk', flat=True):
+        end_campaign(pk, now)
+        ended += 1
+    # Campaigns whose whole window was missed are closed without touching prices
+    PriceCampaign.objects.filter(status='scheduled', ends_at__lte=now).update(status='ended')
+
+    started = 0
+    due = PriceCampaign.objects.filter(status='scheduled', starts_at__lte=now).order_by('starts_at', 'pk')
+    for pk in due.values_list('pk', flat=True):
+        start_campaign(pk, now)
+        started += 1
+    return started, ended
+
+
+def maybe_run_campaigns():
+    """Run the scheduler at most once per PRICE_CAMPAIGN_CHECK_SECONDS across all workers"""
+    global _next_check
+    interval = getattr(settings, 'PRICE_CAMPAIGN_CHECK_SECONDS', 60)
+    if not interval or time.monotonic() < _next_check:
+        return None
+    _next_check = time.monotonic() + interval
+
+    if not cache.add(CAMPAIGN_LOCK_KEY, 1, timeout=interval):
+        return None
+    return run_due_campaigns()
@@ -0,0 +1,120 @@
+"""
+Denormalized product cards for storefront listings.
+
+A product grid only needs a dozen narrow columns. Loading ``Product`` for it
+also pulls in the ``description`` TextField and resolves ``category`` per
+card. ``ProductCard`` keeps exactly what a card shows, one row per product
+under the same primary key, with the discount (copied from the generated
+``Product.discount_percentage`` column), thumbnail URL and category path
+precomputed, and an index for each listing's filter and sort.
+
+Cards are refreshed by ``store.signals`` when products, their images or
+categories are saved. Paths that skip signals (``store.bulk``,
+``store.inventory``, catalog import, popularity scores) call
+``refresh_cards()`` themselves; a sale only does so when it sells a product
+out. Only cards that differ from their product are written, and the catalog
+version is bumped only when one was; price campaigns (``store.pricing``)
+copy their prices to the cards in SQL. The ``rebuild_product_cards`` command
+rebuilds every card.
+"""
+from django.db import transaction
+
+from .catalog_cache import bump_catalog_version
+from .category_tree import CategoryTree
+from .models import Product, ProductCard, ProductImage
+
+BATCH_SIZE = 1000
+
+CARD_FIELDS = [
+    'name', 'slug', 'price', 'original_price', 'discount_percentage', 'image_url',
+    'category', 'category_slug', 'category_name', 'category_path',
+    'in_stock', 'is_best_seller', 'is_featured', 'popularity_score', 'created_at',
+]
+CARD_ATTNAMES = [ProductCard._meta.get_field(name).attname for name in CARD_FIELDS]
+
+
+def _fallback_images(product_ids):
+    """{product id: url} of the first additional image, for products without a main image"""
+    images = {}
+    for image in ProductImage.objects.filter(product_id__in=product_ids).order_by('-is_featured', 'order', 'created_at'):
+        if image.image and image.product_id not in images:
+            images[image.product_id] = image.image.url
+    return images
+
+
+def build_card(product, tree, fallback_image=''):
+    category = tree.get(product.category_id)
+    return ProductCard(
+        product_id=product.pk,
+        name=product.name,
+        slug=product.slug,
+        price=product.price,
+        original_price=product.original_price,
+        discount_percentage=product.discount_percentage,
+        image_url=product.image.url if product.image else fallback_image,
+        category_id=product.category_id,
+        category_slug=category.slug,
+        category_name=category.name,
+        category_path=category.path[:500],
+        in_stock=product.stock_quantity > 0,
+        is_best_seller=product.is_best_seller,
+        is_featured=product.is_featured,
+        popularity_score=product.popularity_score,
+        created_at=product.created_at,
+    )
+
+
+def _changed(card, current):
+    return current is None or any(getattr(card, name) != getattr(current, name) for name in CARD_ATTNAMES)
+
+
+def refresh_cards(product_ids, tree=None):
+    """
+    Rewrite the cards of these products that no longer match them, with one
+    upsert per batch; returns how many were written.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return 0
+    tree = tree or CategoryTree.load()
+    written = 0
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        batch = product_ids[start:start + BATCH_SIZE]
+        products = list(Product.objects.filter(pk__in=batch).defer('description').order_by())
+        missing_image = [product.pk for product in products if not product.image]
+        fallback = _fallback_images(missing_image) if missing_image else {}
+        current = ProductCard.objects.in_bulk(batch)
+        cards = [
+            card for card in (build_card(product, tree, fallback.get(product.pk, '')) for product in products)
+            if _changed(card, current.get(card.product_id))
+        ]
+        if not cards:
+            continue
+        with transaction.atomic():
+            ProductCard.objects.bulk_create(
+                cards,
+                update_conflicts=True,
+                unique_fields=['product'],
+                update_fields=CARD_FIELDS,
+            )
+        written += len(cards)
+    if written:
+        # Listing pages and facet counts are cached under the catalog version
+        transaction.on_commit(bump_catalog_version)
+    return written
+
+
+def refresh_categories(category_ids):
+    """Rewrite the cards of every product in these categories or below them (names and paths changed)"""
+    tree = CategoryTree.load()
+    affected = set()
+    for category_id in category_ids:
+        affected.add(category_id)
+        affected.update(tree.descendant_ids(category_id))
+    product_ids = Product.objects.filter(category_id__in=affected).values_list('pk', flat=True)
+    return refresh_cards(product_ids, tree)
+
+
+def rebuild_all():
+    """Rewrite every card (deleted products lose theirs by cascade); returns the number of cards"""
+    return refresh_cards(Product.objects.values_list('pk', flat=True))
@@ -0,0 +1,139 @@
+"""
+Request rate limiting backed by the Django cache.
+
+``is_limited()`` counts hits per key in a fixed time window. ``take_token()``
+is a token bucket: ``burst`` tokens, refilled at ``rate`` per second, so
+short bursts pass and the sustained rate is capped. Both keep their state
+in the shared cache, so limits hold across worker processes.
+
+``RateLimitMiddleware`` applies ``RATE_LIMITS``, token buckets per URL name,
+to each client IP and each visitor (the signed ``visitor_id`` cookie). It
+runs before the tracking middleware, so a refused request costs a URL
+resolve and a cache increment or two and is answered with 429 and
+``Retry-After``. Refusals are counted per day in
+``TrafficDaily`` for the analytics page.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+
+from . import popularity
+
+RATE_LIMITED = 'rate_limited'
+
+
+def get_client_ip(request):
+    """
+    Get the client's IP address.
+
+    X-Forwarded-For is only read behind TRUSTED_PROXY_COUNT proxies, each of
+    which appends the address it received the request from. The client is
+    then that many entries from the right; anything further left was sent by
+    the client and could be anything.
+    """
+    ip = request.META.get('REMOTE_ADDR')
+    proxies = getattr(settings, 'TRUSTED_PROXY_COUNT', 0)
+    if proxies:
+        hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        if len(hops) >= proxies:
+            ip = hops[-proxies]
+    return ip or '127.0.0.1'
+
+
+def is_limited(key, limit, window):
+    """Record a hit for key and return True once it exceeds limit hits per window seconds"""
+    cache_key = f'ratelimit:{key}'
+    # add() only sets the counter if it doesn't exist, starting a new window
+    cache.add(cache_key, 0, timeout=window)
+    try:
+        hits = cache.incr(cache_key)
+    except ValueError:
+        # Window expired between add() and incr()
+        cache.set(cache_key, 1, timeout=window)
+        hits = 1
+    return hits > limit
+
+
+def take_token(key, rate, burst, now=None):
+    """
+    Take one token from the bucket for key; returns (allowed, seconds until a token is free).
+
+    The bucket is a single counter of tokens taken, measured against the
+    tokens issued so far (now * rate), so a check is one atomic incr() with
+    no read-modify-write. A refused request gives its token back.
+    """
+    now = time.time() if now is None else now
+    issued = int(now * rate)
+    cache_key = f'tokenbucket:{key}'
+    # Idle buckets expire and come back full
+    timeout = math.ceil(burst / rate) + 60
+    cache.add(cache_key, issued - burst, timeout=timeout)
+    try:
+        taken = cache.incr(cache_key)
+    except ValueError:
+        cache.set(cache_key, issued - burst + 1, timeout=timeout)
+        taken = issued - burst + 1
+
+    if taken <= issued - burst:
+        # The bucket filled up while idle; tokens beyond burst are not saved up
+        cache.set(cache_key, issued - burst + 1, timeout=timeout)
+        return True, 0
+    if taken <= issued:
+        cache.touch(cache_key, timeout)
+        return True, 0
+    cache.decr(cache_key)
+    return False, (taken - issued) / rate
+
+
+class RateLimitMiddleware:
+    """Answer 429 once a client goes over the token bucket of the URL it asks for"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = getattr(settings, 'RATE_LIMITS', {})
+        self.ip_factor = getattr(settings, 'RATE_LIMIT_IP_FACTOR', 4)
+
+    def __call__(self, request):
+        response = self.check(request) if self.rules else None
+        return response or self.get_response(request)
+
+    def check(self, request):
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+        rule = self.rules.get(url_name)
+        if rule is None or (rule.get('param') and rule['param'] not in request.GET):
+            return None
+        if request.user.is_staff:
+            return None
+
+        rate, burst = rule['rate'], rule['burst']
+        # Several people can share an address (mobile carriers, offices), so the IP bucket is larger
+        buckets = [(f'{url_name}:ip:{get_client_ip(request)}', rate * self.ip_factor, burst * self.ip_factor)]
+        # Cookie carts mean most shoppers have no session; every browser has a visitor id
+        # (imported here because store.middleware imports this module)
+        from .middleware import read_visitor
+        visitor = read_visitor(request)
+        if visitor:
+            buckets.append((f'{url_name}:visitor:{visitor["id"]}', rate, burst))
+        for key, bucket_rate, bucket_burst in buckets:
+            allowed, wait = take_token(key, bucket_rate, bucket_burst)
+            if not allowed:
+                return self.limited(request, wait)
+        return None
+
+    def limited(self, request, wait):
+        popularity.count_request(RATE_LIMITED)
+        retry_after = str(max(1, math.ceil(wait)))
+        message = 'Too many requests. Please wait a moment and try again.'
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            response = JsonResponse({'success': False, 'message': message}, status=429)
+        else:
+            response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = retry_after
+        return response
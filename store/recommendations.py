@@ -0,0 +1,193 @@
+"""
+"Customers also bought" recommendations from co-purchase data.
+
+``build()`` runs offline (the ``build_recommendations`` command). It turns
+order baskets into a sparse orders x products matrix ``B`` and computes the
+co-occurrence counts ``C = B.T @ B`` with SciPy: ``C[i, j]`` is the number of
+orders containing both products, and the diagonal the orders containing each
+product. Product pairs are scored by cosine similarity,
+``C[i, j] / sqrt(C[i, i] * C[j, j])``, so best sellers don't turn up as
+everyone's neighbour. The top ``RECOMMENDATION_TOP_K`` per product are
+written to ``ProductRecommendation``.
+
+The count matrix and the last order processed are kept in
+``RECOMMENDATION_STATE_FILE``. Later runs only add the new baskets and
+rescore the products in them. Cancelled orders and score drift on untouched
+products are picked up by a periodic ``--full`` rebuild.
+
+``recommended_products()`` serves the detail page with one indexed query and
+tops up with same-category products when there aren't enough.
+"""
+import os
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OrderItem, Product, ProductCard, ProductRecommendation
+
+# Orders younger than this are left for the next run, so an order whose
+# transaction commits after a newer one is never skipped
+SETTLE_SECONDS = 300
+WRITE_BATCH_SIZE = 1000
+
+
+def _scientific_stack():
+    try:
+        import numpy
+        from scipy import sparse
+    except ImportError as exc:
+        raise ImportError(
+            'Building recommendations needs numpy and scipy (pip install numpy scipy)'
+        ) from exc
+    return numpy, sparse
+
+
+def _state_file():
+    return getattr(settings, 'RECOMMENDATION_STATE_FILE', os.path.join(settings.BASE_DIR, 'recommendations.npz'))
+
+
+def _load_state(np, sparse):
+    """The saved count matrix and last processed order id, or (None, 0)"""
+    path = _state_file()
+    if not os.path.exists(path):
+        return None, 0
+    with np.load(path) as state:
+        counts = sparse.csr_matrix(
+            (state['data'], state['indices'], state['indptr']), shape=tuple(state['shape'])
+        )
+        return counts, int(state['last_order_id'])
+
+
+def _save_state(np, counts, last_order_id):
+    path = _state_file()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = f'{path}.tmp.npz'
+    np.savez(
+        temporary,
+        data=counts.data, indices=counts.indices, indptr=counts.indptr,
+        shape=np.array(counts.shape), last_order_id=np.array(last_order_id),
+    )
+    os.replace(temporary, path)
+
+
+def _baskets(np, after_order_id, until):
+    """Parallel (order id, product id) arrays for non-cancelled orders in (after_order_id, until]"""
+    order_ids = array('q')
+    product_ids = array('q')
+    items = (
+        OrderItem.objects.filter(order_id__gt=after_order_id, order__created_at__lte=until)
+        .exclude(order__status='cancelled')
+        .values_list('order_id', 'product_id')
+        .order_by()
+    )
+    for order_id, product_id in items.iterator(chunk_size=20000):
+        order_ids.append(order_id)
+        product_ids.append(product_id)
+    return np.frombuffer(order_ids, dtype=np.int64), np.frombuffer(product_ids, dtype=np.int64)
+
+
+def _co_occurrence(np, sparse, order_ids, product_ids, size):
+    """C = B.T @ B for the basket matrix B (one row per order, a product counted once per order)"""
+    rows = np.unique(order_ids, return_inverse=True)[1]
+    baskets = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, product_ids)), shape=(rows.max() + 1, size)
+    )
+    baskets.data[:] = 1  # repeated lines of one product in one order were summed
+    return (baskets.T @ baskets).tocsr()
+
+
+def _top_neighbours(np, counts, product_ids, top_k, min_count):
+    """{product id: [(neighbour id, score), ...]} for product_ids, best first"""
+    orders_per_product = counts.diagonal().astype(np.float64)
+    rows = counts[product_ids]
+    lengths = np.diff(rows.indptr)
+    # Cosine scores for every stored pair at once
+    row_products = np.repeat(product_ids, lengths)
+    scores = rows.data / np.sqrt(orders_per_product[row_products] * orders_per_product[rows.indices])
+    usable = (rows.indices != row_products) & (rows.data >= min_count)
+
+    neighbours = {}
+    for position, product_id in enumerate(product_ids):
+        start, end = rows.indptr[position], rows.indptr[position + 1]
+        keep = usable[start:end]
+        columns, row_scores = rows.indices[start:end][keep], scores[start:end][keep]
+        if len(columns) > top_k:
+            best = np.argpartition(-row_scores, top_k)[:top_k]
+            columns, row_scores = columns[best], row_scores[best]
+        order = np.argsort(-row_scores, kind='stable')
+        neighbours[int(product_id)] = [(int(columns[i]), float(row_scores[i])) for i in order]
+    return neighbours
+
+
+def _write(neighbours):
+    """Replace the stored recommendations of every product in neighbours"""
+    existing = set(Product.objects.values_list('pk', flat=True))
+    product_ids = list(neighbours)
+    for start in range(0, len(product_ids), WRITE_BATCH_SIZE):
+        batch = product_ids[start:start + WRITE_BATCH_SIZE]
+        rows = []
+        for product_id in batch:
+            if product_id not in existing:
+                continue
+            recommended = [(pk, score) for pk, score in neighbours[product_id] if pk in existing]
+            rows += [
+                ProductRecommendation(product_id=product_id, recommended_id=pk, rank=rank, score=score)
+                for rank, (pk, score) in enumerate(recommended, 1)
+            ]
+        with transaction.atomic():
+            ProductRecommendation.objects.filter(product_id__in=batch).delete()
+            ProductRecommendation.objects.bulk_create(rows)
+
+
+def build(full=False, top_k=None, min_count=1):
+    """
+    Fold new baskets into the co-occurrence counts and rewrite the affected
+    recommendations. Returns (orders processed, products rescored).
+
+    Raises ImportError when numpy or scipy is not installed.
+    """
+    np, sparse = _scientific_stack()
+    top_k = top_k or getattr(settings, 'RECOMMENDATION_TOP_K', 12)
+    counts, last_order_id = (None, 0) if full else _load_state(np, sparse)
+
+    until = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+    order_ids, product_ids = _baskets(np, last_order_id, until)
+    if not len(order_ids):
+        return 0, 0
+
+    size = int(max(product_ids.max() + 1, counts.shape[0] if counts is not None else 0))
+    new_counts = _co_occurrence(np, sparse, order_ids, product_ids, size)
+    if counts is None:
+        counts = new_counts
+    else:
+        # Products created since the last run widen the matrix
+        counts.resize((size, size))
+        counts = (counts + new_counts).tocsr()
+
+    touched = np.unique(product_ids)
+    neighbours = _top_neighbours(np, counts, touched, top_k, min_count)
+    if full:
+        # Products that only appeared in orders cancelled since lose their list
+        ProductRecommendation.objects.exclude(product_id__in=neighbours).delete()
+    _write(neighbours)
+    _save_state(np, counts, int(order_ids.max()))
+    return len(np.unique(order_ids)), len(touched)
+
+
+def recommended_products(product, limit=4):
+    """
+    Cards of in-stock products to show next to product: its co-purchase
+    recommendations first, then others from the same category.
+    """
+    related = list(
+        ProductCard.objects.filter(product__recommended_for__product=product, in_stock=True)
+        .order_by('product__recommended_for__rank')[:limit]
+    )
+    if len(related) < limit:
+        related += ProductCard.objects.filter(
+            category_id=product.category_id, in_stock=True
+        ).exclude(pk__in=[product.pk] + [card.pk for card in related])[:limit - len(related)]
+    return related
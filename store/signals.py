@@ -1,8 +1,14 @@
 import os
-from django.db.models.signals import post_delete, pre_save
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_migrate, pre_save
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Product, Category, HeroBanner, SiteSettings
+from . import dashboard
+from .catalog_cache import bump_catalog_version
+from .coupons import bump_rules_version
+from .navigation import bump_tree_version
+from .product_cards import refresh_cards, refresh_categories
+from .models import Product, Category, HeroBanner, SiteSettings, Order, ProductImage, Coupon
 
 
 @receiver(post_delete, sender=Product)
@@ -109,3 +115,97 @@ def delete_old_site_settings_images(sender, instance, **kwargs):
     if old_settings.favicon and old_settings.favicon != instance.favicon:
         if os.path.isfile(old_settings.favicon.path):
             os.remove(old_settings.favicon.path)
+
+
+@receiver(pre_migrate)
+def create_trigram_extension(sender, using, **kwargs):
+    """Make sure pg_trgm exists before the order name trigram index is created."""
+    if sender.name != 'store':
+        return
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+# Dashboard snapshot (see store.dashboard)
+
+@receiver(post_save, sender=Order)
+def dashboard_order_saved(sender, instance, created, **kwargs):
+    """Queue a new order; its items are read when the delta is merged."""
+    if created:
+        dashboard.record_order(instance)
+
+
+@receiver(post_delete, sender=Order)
+def dashboard_order_deleted(sender, instance, **kwargs):
+    dashboard.forget_order(instance.total_amount, instance.created_at)
+
+
+@receiver(post_save, sender=Product)
+def dashboard_product_saved(sender, instance, created, **kwargs):
+    dashboard.record_stock_change([instance.pk], products=1 if created else 0)
+
+
+@receiver(post_delete, sender=Product)
+def dashboard_product_deleted(sender, instance, **kwargs):
+    dashboard.record_stock_change([instance.pk], products=-1)
+
+
+@receiver(post_save, sender=Category)
+def dashboard_category_saved(sender, instance, created, **kwargs):
+    if created:
+        dashboard.record_categories(1)
+
+
+@receiver(post_delete, sender=Category)
+def dashboard_category_deleted(sender, instance, **kwargs):
+    dashboard.record_categories(-1)
+
+
+# Cached navigation fragments (see store.navigation)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_tree_changed(sender, **kwargs):
+    bump_tree_version()
+
+
+# Product card read model (see store.product_cards)
+
+@receiver(post_save, sender=Product)
+def product_card_product_saved(sender, instance, **kwargs):
+    refresh_cards([instance.pk])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_card_image_changed(sender, instance, **kwargs):
+    # The first additional image is the thumbnail of products without a main image
+    refresh_cards([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+def product_card_category_saved(sender, instance, created, **kwargs):
+    if not created:
+        refresh_categories([instance.pk])
+
+
+# Compiled coupon rules (see store.coupons); bumped after commit so the
+# recompile sees the new rows
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+@receiver(m2m_changed, sender=Coupon.categories.through)
+def coupon_rules_changed(sender, **kwargs):
+    transaction.on_commit(bump_rules_version)
+
+
+# Banners and branding show on every page; cached page validators use the
+# catalog version (see store.conditional)
+
+@receiver(post_save, sender=HeroBanner)
+@receiver(post_delete, sender=HeroBanner)
+@receiver(post_save, sender=SiteSettings)
+def storefront_content_changed(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
@@ -0,0 +1,18 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from store.navigation import render_fragment
+
+register = template.Library()
+
+
+@register.simple_tag
+def category_menu():
+    """The cached category sidebar menu"""
+    return mark_safe(render_fragment('menu'))
+
+
+@register.simple_tag
+def category_carousel():
+    """The cached home page category carousel items"""
+    return mark_safe(render_fragment('carousel'))
@@ -1,3 +1,424 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .bulk import bulk_set_flag, bulk_set_stock
+from .cart import CART_BACKENDS
+from .catalog_cache import bump_catalog_version
+from .category_tree import CategoryTree
+from .conditional import DEFERRED_CSRF_TOKEN
+from .coupons import CouponError, CouponRule, redeem
+from .idempotency import new_key
+from .models import CartItem, Category, Coupon, CouponRedemption, DeliveryOption, Order, PriceCampaign, PriceOverride, Product, ProductCard, generate_order_id
+from .pricing import cancel_campaign, run_due_campaigns, start_campaign
+from .ratelimit import get_client_ip
+
+
+class BulkEditQueryCountTests(TestCase):
+    """The bulk helpers run a fixed number of statements however many rows they touch"""
+
+    # ids, UPDATE, then refresh_cards: category tree, products, fallback images,
+    # current cards, and the card upsert inside a savepoint
+    FLAG_QUERIES = 9
+    # savepoint, sharded lookup, UPDATE, dashboard delta, refresh_cards (7), release
+    STOCK_QUERIES = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Bulk')
+        cls.products = [
+            Product.objects.create(
+                name=f'Bulk product {n}', description='', price=10, category=category, image='', stock_quantity=5
+            )
+            for n in range(50)
+        ]
+
+    def test_bulk_set_flag(self):
+        for size in (5, 50):
+            with self.subTest(size=size):
+                ids = [product.pk for product in self.products[:size]]
+                with self.assertNumQueries(self.FLAG_QUERIES):
+                    updated = bulk_set_flag(Product.objects.filter(pk__in=ids), 'is_featured', True)
+                self.assertEqual(updated, size)
+                self.assertEqual(ProductCard.objects.filter(product_id__in=ids, is_featured=True).count(), size)
+
+    def test_bulk_set_stock(self):
+        for size in (5, 50):
+            with self.subTest(size=size):
+                quantities = dict.fromkeys((product.pk for product in self.products[:size]), 0)
+                with self.assertNumQueries(self.STOCK_QUERIES):
+                    updated = bulk_set_stock(quantities)
+                self.assertEqual(updated, size)
+                self.assertEqual(
+                    dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'stock_quantity')), quantities
+                )
+                # Sold-out products drop out of the in-stock listings
+                self.assertEqual(ProductCard.objects.filter(product_id__in=quantities, in_stock=False).count(), size)
+
+
+class CouponRedeemConcurrencyTests(TransactionTestCase):
+    """Parallel checkouts never push a coupon past its usage limit"""
+
+    USAGE_LIMIT = 5
+    CHECKOUTS = 12
+
+    def test_parallel_redemptions_stop_at_usage_limit(self):
+        coupon = Coupon.objects.create(code='flash', kind='fixed', value=10, usage_limit=self.USAGE_LIMIT)
+        rule = CouponRule(coupon, CategoryTree.load())
+        start = threading.Barrier(self.CHECKOUTS)
+        redeemed, refused, errors = [], [], []
+
+        def checkout(n):
+            try:
+                start.wait()
+                with transaction.atomic():
+                    order = Order.objects.create(
+                        customer_name=f'Shopper {n}',
+                        customer_phone=f'0171234{n:04d}',
+                        shipping_address='Dhaka',
+                        total_amount=90,
+                    )
+                    redeem(rule, order, 10)
+                redeemed.append(n)
+            except CouponError:
+                refused.append(n)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(n,)) for n in range(self.CHECKOUTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(redeemed), self.USAGE_LIMIT)
+        self.assertEqual(len(refused), self.CHECKOUTS - self.USAGE_LIMIT)
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.times_used, self.USAGE_LIMIT)
+        self.assertEqual(CouponRedemption.objects.filter(coupon=coupon).count(), self.USAGE_LIMIT)
+        # Refused checkouts rolled back their orders
+        self.assertEqual(Order.objects.count(), self.USAGE_LIMIT)
+
+
+BROWSER = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36'
+
+
+class CachePolicyTests(TestCase):
+    """Anonymous storefront pages may be kept by a shared cache once no cookie is being set"""
+
+    def setUp(self):
+        self.client = Client(HTTP_USER_AGENT=BROWSER)
+
+    def test_repeat_anonymous_get_is_public(self):
+        first = self.client.get('/about/')
+        self.assertEqual(first.status_code, 200)
+        # The first visit gets its visitor cookie, so it stays private
+        self.assertIn('private', first['Cache-Control'])
+
+        repeat = self.client.get('/about/')
+        self.assertEqual(repeat.status_code, 200)
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, repeat.cookies)
+        self.assertIn('public', repeat['Cache-Control'])
+        self.assertIn(f's-maxage={settings.PAGE_CACHE_SECONDS}', repeat['Cache-Control'])
+
+    def test_unchanged_page_revalidates_with_304(self):
+        first = self.client.get('/about/')
+        etag = first['ETag']
+
+        unchanged = self.client.get('/about/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertIn('public', unchanged['Cache-Control'])
+        self.assertIn('max-age=0', unchanged['Cache-Control'])
+
+        # Any catalog change moves every validator on
+        bump_catalog_version()
+        changed = self.client.get('/about/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_visitor_with_a_cart_gets_a_private_page(self):
+        product = Product.objects.create(
+            name='Cached product', description='', price=10, category=Category.objects.create(name='Cached'),
+            image='', stock_quantity=5,
+        )
+        self.client.post(reverse('add_to_cart', args=[product.pk]))
+        response = self.client.get('/about/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertNotIn('public', response.get('Cache-Control', ''))
+
+    def test_anonymous_page_defers_the_csrf_token(self):
+        response = self.client.get('/about/')
+        self.assertContains(response, f'content="{DEFERRED_CSRF_TOKEN}"')
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+        token = self.client.get(reverse('csrf_token'))
+        self.assertIn('no-cache', token['Cache-Control'])
+        self.assertIn(settings.CSRF_COOKIE_NAME, token.cookies)
+        self.assertNotEqual(token.json()['token'], DEFERRED_CSRF_TOKEN)
+
+
+class CheckoutIdempotencyTests(TestCase):
+    """A checkout form submitted twice places one order"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Checkout')
+        cls.product = Product.objects.create(
+            name='Checkout product', description='', price=100, category=category, image='', stock_quantity=5
+        )
+        cls.delivery_option = DeliveryOption.objects.create(name='Dhaka', description='Inside Dhaka', price=60)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client(HTTP_USER_AGENT=BROWSER)
+
+    def checkout(self, key):
+        return self.client.post(reverse('checkout'), {
+            'customer_name': 'Test Shopper',
+            'customer_phone': '01712345678',
+            'shipping_address': 'Road 1, Dhaka',
+            'delivery_option': self.delivery_option.pk,
+            'idempotency_key': key,
+        })
+
+    def test_replayed_submission_gets_the_first_order(self):
+        self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': 2})
+        key = new_key()
+        first = self.checkout(key)
+        order = Order.objects.get()
+        self.assertRedirects(first, reverse('order_confirmation', args=[order.order_id]), fetch_redirect_response=False)
+
+        # Answered from the cache, then (once the cache has forgotten) from the order's key
+        for forget in (False, True):
+            with self.subTest(cache_cleared=forget):
+                if forget:
+                    cache.clear()
+                replay = self.checkout(key)
+                self.assertRedirects(
+                    replay, reverse('order_confirmation', args=[order.order_id]), fetch_redirect_response=False
+                )
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 3)
+
+
+class OrderIdTests(TestCase):
+    """Order IDs that clash are drawn again; other integrity errors are not retried"""
+
+    def order(self, **kwargs):
+        return Order.objects.create(
+            customer_name='Test Shopper', customer_phone='01712345678', shipping_address='Dhaka', **kwargs
+        )
+
+    def test_clashing_order_id_is_retried(self):
+        taken = self.order()
+        fresh = 'ORD26101900000000001'
+        with mock.patch('store.models.generate_order_id', side_effect=[taken.order_id, fresh]) as generate:
+            order = self.order()
+        self.assertEqual(generate.call_count, 2)
+        self.assertEqual(order.order_id, fresh)
+        self.assertEqual(order.tracking_number, fresh)
+
+    def test_reused_idempotency_key_is_not_retried(self):
+        key = new_key()
+        self.order(idempotency_key=key)
+        with mock.patch('store.models.generate_order_id', wraps=generate_order_id) as generate:
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                self.order(idempotency_key=key)
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+@override_settings(RATE_LIMITS={'track_order': {'rate': 0.01, 'burst': 2}}, RATE_LIMIT_IP_FACTOR=1)
+class RateLimitTests(TestCase):
+    """Clients past a URL's token bucket are told to come back later"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_over_the_bucket_gets_429_with_retry_after(self):
+        client = Client(HTTP_USER_AGENT=BROWSER)
+        for _ in range(2):
+            self.assertEqual(client.get(reverse('track_order')).status_code, 200)
+        response = client.get(reverse('track_order'))
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+        xhr = client.get(reverse('track_order'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(xhr.status_code, 429)
+        self.assertFalse(xhr.json()['success'])
+
+    def test_other_urls_are_not_limited(self):
+        client = Client(HTTP_USER_AGENT=BROWSER)
+        for _ in range(4):
+            self.assertEqual(client.get('/about/').status_code, 200)
+
+
+class ClientIpTests(SimpleTestCase):
+    """X-Forwarded-For is only believed as far back as the trusted proxies"""
+
+    def ip(self, proxies, forwarded_for=None):
+        headers = {'REMOTE_ADDR': '10.0.0.1'}
+        if forwarded_for is not None:
+            headers['HTTP_X_FORWARDED_FOR'] = forwarded_for
+        with self.settings(TRUSTED_PROXY_COUNT=proxies):
+            return get_client_ip(RequestFactory().get('/', **headers))
+
+    def test_no_trusted_proxy_ignores_the_header(self):
+        self.assertEqual(self.ip(0, '203.0.113.9'), '10.0.0.1')
+
+    def test_client_is_counted_from_the_right(self):
+        # The client sent "1.2.3.4" itself; the two proxies appended the rest
+        self.assertEqual(self.ip(1, '1.2.3.4, 203.0.113.9'), '203.0.113.9')
+        self.assertEqual(self.ip(2, '1.2.3.4, 203.0.113.9, 10.0.0.2'), '203.0.113.9')
+
+    def test_short_header_falls_back_to_the_peer(self):
+        self.assertEqual(self.ip(2, '203.0.113.9'), '10.0.0.1')
+        self.assertEqual(self.ip(1), '10.0.0.1')
+
+
+class CartBackendTests(TestCase):
+    """Every cart backend keeps the same lines through add, update and remove"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Cart')
+        cls.products = [
+            Product.objects.create(
+                name=f'Cart product {n}', description='', price=10, category=category, image='', stock_quantity=10
+            )
+            for n in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def add(self, client, product, quantity):
+        client.post(reverse('add_to_cart', args=[product.pk]), {'quantity': quantity})
+
+    def lines(self, client):
+        response = client.get(reverse('cart'))
+        return {item.product_id: item.quantity for item in response.context['cart_items']}
+
+    def test_add_update_remove(self):
+        first, second = self.products[:2]
+        for backend in CART_BACKENDS:
+            with self.subTest(backend=backend), self.settings(CART_BACKEND=backend):
+                client = Client(HTTP_USER_AGENT=BROWSER)
+                self.add(client, first, 2)
+                self.add(client, second, 1)
+                self.add(client, first, 1)
+                self.assertEqual(self.lines(client), {first.pk: 3, second.pk: 1})
+
+                client.post(reverse('update_cart', args=[second.pk]), {'quantity': 4})
+                client.post(reverse('remove_from_cart', args=[first.pk]))
+                self.assertEqual(self.lines(client), {second.pk: 4})
+
+    @override_settings(CART_BACKEND='cookie')
+    def test_cookie_cart_reaches_the_database_at_checkout(self):
+        client = Client(HTTP_USER_AGENT=BROWSER)
+        self.add(client, self.products[0], 2)
+        self.assertFalse(CartItem.objects.exists())
+
+        client.get(reverse('checkout'))
+        self.assertEqual(
+            list(CartItem.objects.values_list('product_id', 'quantity')), [(self.products[0].pk, 2)]
+        )
+        self.assertEqual(self.lines(client), {self.products[0].pk: 2})
+
+    @override_settings(CART_BACKEND='cookie', CART_COOKIE_MAX_LINES=2)
+    def test_large_cookie_cart_moves_to_the_database(self):
+        client = Client(HTTP_USER_AGENT=BROWSER)
+        for product in self.products:
+            self.add(client, product, 1)
+        self.assertEqual(CartItem.objects.count(), 3)
+        self.assertEqual(self.lines(client), {product.pk: 1 for product in self.products})
+
+        for product in self.products:
+            client.post(reverse('remove_from_cart', args=[product.pk]))
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.lines(client), {})
+
+
+class PriceCampaignTests(TestCase):
+    """Campaigns reprice their products and cards on start and put them back on end"""
+
+    @classmethod
+    def setUpTestData(cls):
+        parent = Category.objects.create(name='Campaign')
+        child = Category.objects.create(name='Campaign child', parent=parent)
+        other = Category.objects.create(name='Campaign other')
+
+        def product(name, category, **kwargs):
+            return Product.objects.create(
+                name=name, description='', price=100, category=category, image='', stock_quantity=5, **kwargs
+            )
+
+        cls.in_parent = product('In parent', parent)
+        cls.in_child = product('In child', child)
+        cls.picked = product('Picked', other, original_price=150)
+        cls.outside = product('Outside', other)
+        cls.now = timezone.now()
+        cls.campaign = PriceCampaign.objects.create(
+            name='Flash', percent_off=20,
+            starts_at=cls.now - timedelta(hours=1), ends_at=cls.now + timedelta(hours=1),
+        )
+        cls.campaign.categories.add(parent)
+        cls.campaign.products.add(cls.picked)
+
+    def setUp(self):
+        cache.clear()
+
+    def prices(self, model=Product):
+        return {
+            pk: (price, original_price)
+            for pk, price, original_price in model.objects.filter(
+                pk__in=[self.in_parent.pk, self.in_child.pk, self.picked.pk, self.outside.pk]
+            ).values_list('pk', 'price', 'original_price')
+        }
+
+    def test_apply_and_revert(self):
+        before = self.prices()
+        self.assertEqual(run_due_campaigns(self.now), (1, 0))
+        self.assertEqual(self.prices(), {
+            self.in_parent.pk: (Decimal('80.00'), Decimal('100.00')),
+            self.in_child.pk: (Decimal('80.00'), Decimal('100.00')),
+            # A higher original price is kept
+            self.picked.pk: (Decimal('80.00'), Decimal('150.00')),
+            self.outside.pk: (Decimal('100.00'), None),
+        })
+        self.assertEqual(self.prices(ProductCard), self.prices())
+        self.assertEqual(ProductCard.objects.get(pk=self.in_parent.pk).discount_percentage, 20)
+
+        # Running again in the same window changes nothing
+        self.assertEqual(run_due_campaigns(self.now), (0, 0))
+
+        self.assertEqual(run_due_campaigns(self.now + timedelta(hours=2)), (0, 1))
+        self.assertEqual(self.prices(), before)
+        self.assertEqual(self.prices(ProductCard), before)
+        self.assertFalse(PriceOverride.objects.exists())
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'ended')
+
+    def test_price_edited_during_the_campaign_is_kept(self):
+        start_campaign(self.campaign.pk, self.now)
+        Product.objects.filter(pk=self.in_child.pk).update(price=70)
+
+        # Two of the three repriced products are restored
+        self.assertEqual(cancel_campaign(self.campaign.pk, self.now), 2)
+        self.assertEqual(Product.objects.get(pk=self.in_child.pk).price, Decimal('70.00'))
+        self.assertEqual(Product.objects.get(pk=self.in_parent.pk).price, Decimal('100.00'))
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'cancelled')
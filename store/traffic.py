@@ -0,0 +1,95 @@
+"""
+Request classification: people, crawlers and health checks.
+
+``TrafficClassificationMiddleware`` runs first and tags every request with
+``request.traffic_class`` and ``request.is_bot``, so later stages can skip
+work that only matters for people: visit and online tracking, page view
+counting and the cart half of the context processors. Health-check paths
+(``HEALTH_CHECK_PATHS``) are answered right there, before sessions,
+middleware or templates run.
+
+Classification is all in memory: an IP allow/deny list (``TRAFFIC_HUMAN_IPS``,
+``TRAFFIC_BOT_IPS``, addresses or CIDR networks) parsed once, then compiled
+user-agent patterns with the verdict per user-agent string memoized.
+Per-day counts per class go through the buffered counters in
+``store.popularity`` into ``TrafficDaily`` for the analytics page.
+"""
+import ipaddress
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from . import popularity
+from .ratelimit import get_client_ip
+
+HUMAN = 'human'
+BOT = 'bot'
+HEALTH_CHECK = 'health_check'
+
+BOT_PATTERN = re.compile(
+    r'bot|crawl|spider|slurp|facebookexternalhit|embedly|preview|scrapy|curl|wget|httpie|'
+    r'python-requests|python-urllib|aiohttp|go-http-client|java/|okhttp|libwww|headless|phantomjs|lighthouse',
+    re.IGNORECASE,
+)
+HEALTH_CHECK_PATTERN = re.compile(
+    r'kube-probe|ELB-HealthChecker|GoogleHC|UptimeRobot|Pingdom|StatusCake|Site24x7|Better ?Uptime|health-?check',
+    re.IGNORECASE,
+)
+
+
+@lru_cache(maxsize=4096)
+def classify_user_agent(user_agent):
+    """Traffic class for a User-Agent header; browsers always send one"""
+    if not user_agent:
+        return BOT
+    if HEALTH_CHECK_PATTERN.search(user_agent):
+        return HEALTH_CHECK
+    if BOT_PATTERN.search(user_agent):
+        return BOT
+    return HUMAN
+
+
+@lru_cache(maxsize=None)
+def _networks(setting):
+    return tuple(ipaddress.ip_network(value, strict=False) for value in getattr(settings, setting, ()))
+
+
+def _listed(ip, setting):
+    networks = _networks(setting)
+    if not networks:
+        return False
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def classify(request):
+    """HUMAN, BOT or HEALTH_CHECK for a request"""
+    ip = get_client_ip(request)
+    if _listed(ip, 'TRAFFIC_HUMAN_IPS'):
+        return HUMAN
+    if _listed(ip, 'TRAFFIC_BOT_IPS'):
+        return BOT
+    return classify_user_agent(request.META.get('HTTP_USER_AGENT', '')[:500])
+
+
+class TrafficClassificationMiddleware:
+    """Tag requests as human, bot or health check and answer health checks directly"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.health_check_paths = set(getattr(settings, 'HEALTH_CHECK_PATHS', ()))
+
+    def __call__(self, request):
+        if request.path in self.health_check_paths:
+            popularity.count_request(HEALTH_CHECK)
+            return HttpResponse('ok', content_type='text/plain')
+
+        request.traffic_class = classify(request)
+        request.is_bot = request.traffic_class != HUMAN
+        popularity.count_request(request.traffic_class)
+        return self.get_response(request)
@@ -5,16 +5,21 @@ from .analytics_views import analytics_dashboard, product_analytics, order_analy
 urlpatterns = [
     path('', views.home, name='home'),
     path('products/', views.products, name='products'),
+    path('sale/', views.products, {'on_sale': True}, name='on_sale'),
     path('category/<slug:category_slug>/', views.category_products, name='category_products'),
     path('product/<slug:product_slug>/', views.product_detail, name='product_detail'),
     path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('buy-now/<int:product_id>/', views.buy_now, name='buy_now'),
     path('cart/', views.cart, name='cart'),
-    path('update-cart/<int:item_id>/', views.update_cart, name='update_cart'),
-    path('remove-from-cart/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('update-cart/<int:product_id>/', views.update_cart, name='update_cart'),
+    path('remove-from-cart/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
+    path('checkout/waiting/', views.waiting_room, name='waiting_room'),
+    path('checkout/waiting/status/', views.waiting_room_status, name='waiting_room_status'),
+    path('csrf/', views.csrf_token, name='csrf_token'),
     path('order-confirmation/<str:order_id>/', views.order_confirmation, name='order_confirmation'),
     path('track-order/', views.track_order, name='track_order'),
+    path('my-orders/', views.my_orders, name='my_orders'),
     path('track/<str:tracking_number>/', views.order_tracking_details, name='order_tracking_details'),
     path('contact/', views.contact, name='contact'),
     
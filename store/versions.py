@@ -0,0 +1,29 @@
+"""
+Version counters kept in the cache.
+
+Cached data embeds the current version of what it was built from in its
+cache key (``store.catalog_cache``, ``store.navigation``, ``store.coupons``).
+Bumping the version invalidates all of it at once without deleting keys;
+the old entries simply expire. A version starts from the clock, so a lost
+key (eviction, cache restart) never brings back one that was used before.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def get_version(key):
+    """Current version under key, started from the clock if missing"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time()), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """Move the version under key on, invalidating everything cached under the old one"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time()), timeout=None)
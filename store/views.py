@@ -1,28 +1,44 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, Http404
 from django.contrib import messages
 from django.core.paginator import Paginator
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.db.models import Q
-from .models import Product, Category, HeroBanner, CartItem, Order, OrderItem, DeliveryOption, OrderStatusHistory, ProductImage
-from .forms import CheckoutForm
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import never_cache
+from .models import Product, ProductCard, Category, HeroBanner, Order, OrderItem, DeliveryOption, OrderStatusHistory, ProductImage
+from .admission import admission_required, admit, enabled as admission_enabled, grant_ticket, has_ticket, safe_next
+from .cart import get_cart
+from .coupons import CouponError, redeem as redeem_coupon, validate as validate_coupon
+from .category_tree import CategoryTree
+from .conditional import conditional_page
+from .facets import Facets
+from .forms import CheckoutForm, OrderHistoryForm
+from .idempotency import clean_key, completed_order_id, remember
+from .inventory import available_stock, decrement_stock, InsufficientStock, publish_shortage
+from .order_search import find_order, orders_for_phone
+from .popularity import by_popularity, count_product_view
+from .recommendations import recommended_products
+from .ratelimit import get_client_ip, is_limited
 import json
 
+@conditional_page()
 def home(request):
     """Home page with hero banners, categories, and featured products"""
     hero_banners = HeroBanner.objects.filter(is_active=True)
-    categories = Category.objects.all()  # Get all categories (including children) for carousel
-    best_sellers = Product.objects.filter(is_best_seller=True, stock_quantity__gt=0)[:8]
-    featured_products = Product.objects.filter(is_featured=True, stock_quantity__gt=0)[:4]  # Bring back featured products
-    all_products = Product.objects.filter(stock_quantity__gt=0)[:12]  # Keep all products section
-    
-    # Get cart product ids for current session
-    cart_product_ids = []
-    if request.session.session_key:
-        cart_items = CartItem.objects.filter(session_key=request.session.session_key)
-        cart_product_ids = list(cart_items.values_list('product_id', flat=True))
+    # Product grids read the narrow ProductCard rows (see store.product_cards)
+    in_stock = ProductCard.objects.filter(in_stock=True)
+    best_sellers = list(by_popularity(in_stock)[:8])  # Trending by views and sales; sliced again in the template
+    featured_products = in_stock.filter(is_featured=True)[:4]  # Bring back featured products
+    all_products = in_stock[:12]  # Keep all products section
+    
+    # Get cart product ids for current visitor
+    cart_product_ids = get_cart(request).product_ids()
     context = {
         'hero_banners': hero_banners,
-        'categories': categories,
         'best_sellers': best_sellers,
         'featured_products': featured_products,
         'all_products': all_products,
@@ -30,9 +46,20 @@ def home(request):
     }
     return render(request, 'store/home.html', context)
 
-def products(request):
-    """All products page with pagination and filtering"""
-    product_list = Product.objects.filter(stock_quantity__gt=0)
+# Orderings the products page offers, by ?sort= value
+PRODUCT_SORTS = {
+    'name': ('name',),
+    '-name': ('-name',),
+    'price': ('price',),
+    '-price': ('-price',),
+    '-created_at': ('-created_at',),
+    'discount': ('-discount_percentage', '-created_at'),
+}
+
+@conditional_page()
+def products(request, on_sale=False):
+    """All products page with pagination and filtering; on_sale lists discounted products only"""
+    product_list = ProductCard.objects.filter(in_stock=True)
     category_id = request.GET.get('category')
     search = request.GET.get('search')
     featured = request.GET.get('featured')
@@ -47,23 +74,38 @@ def products(request):
     
     if search:
         product_list = product_list.filter(
-            Q(name__icontains=search) | Q(description__icontains=search)
+            Q(name__icontains=search) | Q(product__description__icontains=search)
         )
     
     if featured:
         product_list = product_list.filter(is_best_seller=True)
     
+    if on_sale:
+        product_list = product_list.filter(discount_percentage__gt=0)
+    
+    # Facet counts for the listing above, then the selected facets narrow it.
+    # Without a category filter the top-level categories are offered as a facet.
+    tree = CategoryTree.load()
+    facets = Facets(request.GET, [] if current_category_obj else [
+        (root, [root.pk] + tree.descendant_ids(root.pk)) for root in tree.children_of(None)
+    ])
+    facet_groups, total_products = facets.build(
+        product_list, cache_key=('products', current_category_obj and current_category_obj.pk, search, bool(featured), on_sale)
+    )
+    product_list = facets.apply(product_list)
+    
+    sort_by = request.GET.get('sort', 'discount' if on_sale else '')
+    if sort_by in PRODUCT_SORTS:
+        product_list = product_list.order_by(*PRODUCT_SORTS[sort_by])
+    
     paginator = Paginator(product_list, 12)
     page_number = request.GET.get('page')
     products_page = paginator.get_page(page_number)
     
     categories = Category.objects.all()
     
-    # Get cart product ids for current session
-    cart_product_ids = []
-    if request.session.session_key:
-        cart_items = CartItem.objects.filter(session_key=request.session.session_key)
-        cart_product_ids = list(cart_items.values_list('product_id', flat=True))
+    # Get cart product ids for current visitor
+    cart_product_ids = get_cart(request).product_ids()
     context = {
         'products': products_page,
         'categories': categories,
@@ -71,10 +113,14 @@ def products(request):
         'current_category_obj': current_category_obj,
         'search_query': search,
         'featured': featured,
+        'on_sale': on_sale,
+        'facet_groups': facet_groups,
+        'total_products': total_products,
         'cart_product_ids': cart_product_ids,
     }
     return render(request, 'store/products.html', context)
 
+@conditional_page()
 def category_products(request, category_slug):
     """Products by category including subcategories"""
     category = get_object_or_404(Category, slug=category_slug)
@@ -82,16 +128,27 @@ def category_products(request, category_slug):
     # Get include_subcategories parameter from URL
     include_subcategories = request.GET.get('include_subcategories', 'true').lower() == 'true'
     
+    tree = CategoryTree.load()
     if include_subcategories:
         # Get products from this category and all its subcategories
-        category_ids = [category.id] + [child.id for child in category.get_all_children()]
-        product_list = Product.objects.filter(category_id__in=category_ids, stock_quantity__gt=0)
+        category_ids = [category.id] + tree.descendant_ids(category.id)
+        product_list = ProductCard.objects.filter(category_id__in=category_ids, in_stock=True)
         subcategory_count = len(category_ids) - 1
     else:
         # Get products only from this category
-        product_list = Product.objects.filter(category=category, stock_quantity__gt=0)
+        product_list = ProductCard.objects.filter(category=category, in_stock=True)
         subcategory_count = 0
     
+    # Facet counts come from one aggregate over the category's products
+    subcategories = tree.children_of(category.pk)
+    facets = Facets(request.GET, [
+        (child, [child.pk] + tree.descendant_ids(child.pk)) for child in subcategories
+    ] if include_subcategories else [])
+    facet_groups, total_products = facets.build(
+        product_list, cache_key=('category', category.pk, include_subcategories)
+    )
+    product_list = facets.apply(product_list)
+    
     # Apply sorting
     sort_by = request.GET.get('sort', 'name')
     if sort_by == 'price_low':
@@ -101,7 +158,9 @@ def category_products(request, category_slug):
     elif sort_by == 'newest':
         product_list = product_list.order_by('-created_at')
     elif sort_by == 'popular':
-        product_list = product_list.order_by('-is_best_seller', '-created_at')
+        product_list = by_popularity(product_list)
+    elif sort_by == 'discount':
+        product_list = product_list.order_by('-discount_percentage', '-created_at')
     else:
         product_list = product_list.order_by('name')
     
@@ -109,14 +168,8 @@ def category_products(request, category_slug):
     page_number = request.GET.get('page')
     products_page = paginator.get_page(page_number)
     
-    # Get cart product ids for current session
-    cart_product_ids = []
-    if request.session.session_key:
-        cart_items = CartItem.objects.filter(session_key=request.session.session_key)
-        cart_product_ids = list(cart_items.values_list('product_id', flat=True))
-    
-    # Get subcategories for filter
-    subcategories = category.children.all()
+    # Get cart product ids for current visitor
+    cart_product_ids = get_cart(request).product_ids()
     
     context = {
         'category': category,
@@ -126,26 +179,41 @@ def category_products(request, category_slug):
         'subcategory_count': subcategory_count,
         'subcategories': subcategories,
         'current_sort': sort_by,
-        'total_products': product_list.count(),
+        'facet_groups': facet_groups,
+        'total_products': total_products,
     }
     return render(request, 'store/category_products.html', context)
 
+def _product_version(request, product_slug):
+    """(pk, updated_at) of the product, looked up once per request for its validators"""
+    if not hasattr(request, '_product_version'):
+        request._product_version = Product.objects.filter(slug=product_slug).values_list('pk', 'updated_at').first()
+    return request._product_version
+
+def _product_etag(request, product_slug):
+    version = _product_version(request, product_slug)
+    return f'{version[0]}:{version[1].timestamp()}' if version else None
+
+def _product_last_modified(request, product_slug):
+    version = _product_version(request, product_slug)
+    return version[1] if version else None
+
+def _product_not_modified(request, product_slug):
+    # The view didn't run, but the visit still counts towards trending
+    count_product_view(_product_version(request, product_slug)[0])
+
+@conditional_page(_product_etag, _product_last_modified, _product_not_modified)
 def product_detail(request, product_slug):
     """Product detail page"""
     product = get_object_or_404(Product, slug=product_slug)
-    related_products = Product.objects.filter(
-        category=product.category, 
-        stock_quantity__gt=0
-    ).exclude(id=product.id)[:4]
+    count_product_view(product.pk)
+    related_products = recommended_products(product, 4)
     
     # Get additional images for this product
     additional_images = product.additional_images.all()
     
-    # Get cart product ids for current session
-    cart_product_ids = []
-    if request.session.session_key:
-        cart_items = CartItem.objects.filter(session_key=request.session.session_key)
-        cart_product_ids = list(cart_items.values_list('product_id', flat=True))
+    # Get cart product ids for current visitor
+    cart_product_ids = get_cart(request).product_ids()
     context = {
         'product': product,
         'related_products': related_products,
@@ -158,29 +226,15 @@ def add_to_cart(request, product_id):
     """Add product to cart"""
     if request.method == 'POST':
         product = get_object_or_404(Product, id=product_id)
-        
-        if not request.session.session_key:
-            request.session.create()
+        cart = get_cart(request)
         
         quantity = int(request.POST.get('quantity', 1))
         
-        if quantity > product.stock_quantity:
+        if cart.get_quantity(product.id) + quantity > available_stock(product):
             messages.error(request, 'Not enough stock available.')
-            return redirect('product_detail', product_id=product_id)
+            return redirect('product_detail', product_slug=product.slug)
         
-        cart_item, created = CartItem.objects.get_or_create(
-            session_key=request.session.session_key,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            new_quantity = cart_item.quantity + quantity
-            if new_quantity > product.stock_quantity:
-                messages.error(request, 'Not enough stock available.')
-                return redirect('product_detail', product_id=product_id)
-            cart_item.quantity = new_quantity
-            cart_item.save()
+        cart.add(product, quantity)
         
         messages.success(request, f'{product.name} added to cart!')
         
@@ -193,10 +247,7 @@ def add_to_cart(request, product_id):
 
 def cart(request):
     """Shopping cart page"""
-    if not request.session.session_key:
-        request.session.create()
-    
-    cart_items = CartItem.objects.filter(session_key=request.session.session_key)
+    cart_items = get_cart(request).items()
     total = sum(item.total_price for item in cart_items)
     total_quantity = sum(item.quantity for item in cart_items)
     
@@ -207,10 +258,13 @@ def cart(request):
     }
     return render(request, 'store/cart.html', context)
 
-def update_cart(request, item_id):
+def update_cart(request, product_id):
     """Update cart item quantity"""
     if request.method == 'POST':
-        cart_item = get_object_or_404(CartItem, id=item_id, session_key=request.session.session_key)
+        cart = get_cart(request)
+        if not cart.get_quantity(product_id):
+            raise Http404('Product is not in the cart')
+        product = get_object_or_404(Product, id=product_id)
         
         # Handle AJAX requests
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.content_type == 'application/json':
@@ -222,54 +276,55 @@ def update_cart(request, item_id):
         else:
             quantity = int(request.POST.get('quantity', 1))
         
-        if quantity > cart_item.product.stock_quantity:
+        if quantity > available_stock(product):
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return JsonResponse({'success': False, 'message': 'Not enough stock available.'})
             messages.error(request, 'Not enough stock available.')
         elif quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
+            cart.set_quantity(product.id, quantity)
             
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 # Calculate new totals
-                cart_items = CartItem.objects.filter(session_key=request.session.session_key)
+                cart_items = cart.items()
                 cart_total = sum(item.total_price for item in cart_items)
                 total_quantity = sum(item.quantity for item in cart_items)
                 
                 return JsonResponse({
                     'success': True, 
                     'message': 'Cart updated!',
-                    'item_total': float(cart_item.total_price),
+                    'item_total': float(product.price * quantity),
                     'cart_total': float(cart_total),
                     'total_quantity': total_quantity,
-                    'item_quantity': cart_item.quantity
+                    'item_quantity': quantity
                 })
             messages.success(request, 'Cart updated!')
         else:
-            cart_item.delete()
+            cart.remove(product.id)
             
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                cart_items = CartItem.objects.filter(session_key=request.session.session_key)
+                cart_items = cart.items()
                 cart_total = sum(item.total_price for item in cart_items)
                 
                 return JsonResponse({
                     'success': True, 
                     'message': 'Item removed from cart!',
                     'cart_total': float(cart_total),
-                    'cart_empty': not cart_items.exists()
+                    'cart_empty': not cart_items
                 })
             messages.success(request, 'Item removed from cart!')
     
     return redirect('cart')
 
-def remove_from_cart(request, item_id):
+def remove_from_cart(request, product_id):
     """Remove item from cart"""
-    cart_item = get_object_or_404(CartItem, id=item_id, session_key=request.session.session_key)
-    cart_item.delete()
+    cart = get_cart(request)
+    if not cart.get_quantity(product_id):
+        raise Http404('Product is not in the cart')
+    cart.remove(product_id)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         # Calculate new totals for AJAX response
-        cart_items = CartItem.objects.filter(session_key=request.session.session_key)
+        cart_items = cart.items()
         cart_total = sum(item.total_price for item in cart_items)
         total_quantity = sum(item.quantity for item in cart_items)
         
@@ -278,18 +333,23 @@ def remove_from_cart(request, item_id):
             'message': 'Item removed from cart!',
             'cart_total': float(cart_total),
             'total_quantity': total_quantity,
-            'cart_empty': not cart_items.exists()
+            'cart_empty': not cart_items
         })
     
     messages.success(request, 'Item removed from cart!')
     return redirect('cart')
 
+@admission_required
 def checkout(request):
     """Checkout page"""
-    if not request.session.session_key:
-        request.session.create()
-    
-    cart_items = CartItem.objects.filter(session_key=request.session.session_key)
+    # A repeated submission of a form that already placed its order gets the same confirmation
+    idempotency_key = clean_key(request.POST.get('idempotency_key')) if request.method == 'POST' else None
+    placed_order_id = completed_order_id(idempotency_key)
+    if placed_order_id:
+        return redirect('order_confirmation', order_id=placed_order_id)
+    
+    cart = get_cart(request)
+    cart_items = cart.items()
     delivery_options = DeliveryOption.objects.filter(is_active=True)
     
     if not cart_items:
@@ -304,49 +364,80 @@ def checkout(request):
             # Get validated data
             delivery_option = form.cleaned_data['delivery_option']
             delivery_fee = delivery_option.price if delivery_option else 0
-            total_amount = subtotal + delivery_fee
             
-            # Create order
-            order = Order.objects.create(
-                customer_name=form.cleaned_data['customer_name'],
-                customer_email=form.cleaned_data['customer_email'],
-                customer_phone=form.cleaned_data['customer_phone'],
-                shipping_address=form.cleaned_data['shipping_address'],
-                delivery_option=delivery_option,
-                delivery_fee=delivery_fee,
-                subtotal=subtotal,
-                total_amount=total_amount,
-                notes=form.cleaned_data['notes']
-            )
-            
-            # Create initial status history entry
-            OrderStatusHistory.objects.create(
-                order=order,
-                status='pending',
-                notes='Order placed successfully via website',
-                created_by='Customer'
-            )
-            
-            # Create order items and update stock
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.price
-                )
+            try:
+                coupon_rule, discount_amount = None, 0
+                if form.cleaned_data['coupon_code']:
+                    coupon_rule, discount_amount = validate_coupon(
+                        form.cleaned_data['coupon_code'], cart_items, delivery_fee
+                    )
+                total_amount = subtotal - discount_amount + delivery_fee
                 
-                # Update product stock
-                cart_item.product.stock_quantity -= cart_item.quantity
-                cart_item.product.save()
-            
-            # Clear cart
-            cart_items.delete()
-            
-            messages.success(request, f'Order {order.order_id} placed successfully! Your tracking number is: {order.tracking_number}')
-            return redirect('order_confirmation', order_id=order.order_id)
+                with transaction.atomic():
+                    # Create order
+                    order = Order.objects.create(
+                        customer_name=form.cleaned_data['customer_name'],
+                        customer_email=form.cleaned_data['customer_email'],
+                        customer_phone=form.cleaned_data['customer_phone'],
+                        shipping_address=form.cleaned_data['shipping_address'],
+                        delivery_option=delivery_option,
+                        delivery_fee=delivery_fee,
+                        subtotal=subtotal,
+                        coupon_id=coupon_rule.pk if coupon_rule else None,
+                        discount_amount=discount_amount,
+                        total_amount=total_amount,
+                        notes=form.cleaned_data['notes'],
+                        idempotency_key=idempotency_key,
+                    )
+                    
+                    # Create initial status history entry
+                    OrderStatusHistory.objects.create(
+                        order=order,
+                        status='pending',
+                        notes='Order placed successfully via website',
+                        created_by='Customer'
+                    )
+                    
+                    # Create order items and take the stock
+                    OrderItem.objects.bulk_create([
+                        OrderItem(
+                            order=order,
+                            product=cart_item.product,
+                            quantity=cart_item.quantity,
+                            price=cart_item.product.price
+                        )
+                        for cart_item in cart_items
+                    ])
+                    # Lock products in a stable order so concurrent checkouts can't deadlock
+                    for cart_item in sorted(cart_items, key=lambda item: item.product_id):
+                        decrement_stock(cart_item.product, cart_item.quantity)
+                    
+                    # Last, so the coupon row stays locked as briefly as possible
+                    if coupon_rule:
+                        redeem_coupon(coupon_rule, order, discount_amount)
+                    
+                    # Clear cart
+                    cart.clear()
+            except InsufficientStock as e:
+                publish_shortage(e)
+                messages.error(request, str(e))
+                return redirect('cart')
+            except CouponError as e:
+                form.add_error('coupon_code', str(e))
+            except IntegrityError:
+                # A concurrent submission with the same key won; nothing of ours was kept
+                placed_order_id = completed_order_id(idempotency_key)
+                if not placed_order_id:
+                    raise
+                return redirect('order_confirmation', order_id=placed_order_id)
+            else:
+                remember(idempotency_key, order.order_id)
+                messages.success(request, f'Order {order.order_id} placed successfully! Your tracking number is: {order.tracking_number}')
+                return redirect('order_confirmation', order_id=order.order_id)
     else:
         form = CheckoutForm()
+        # Customers reaching checkout get a durable copy of their cart
+        cart.persist()
     
     context = {
         'form': form,
@@ -356,6 +447,28 @@ def checkout(request):
     }
     return render(request, 'store/checkout.html', context)
 
+def waiting_room(request):
+    """Static holding page while checkout is full; rendered without context processors"""
+    html = render_to_string('store/waiting_room.html', {
+        'next': safe_next(request, request.GET.get('next')),
+        'status_url': reverse('waiting_room_status'),
+    })
+    return HttpResponse(html, status=503, headers={'Retry-After': '5', 'Cache-Control': 'no-store'})
+
+def waiting_room_status(request):
+    """Polled by the waiting room: admits the browser (ticket cookie) once a checkout slot is free"""
+    if not admission_enabled() or has_ticket(request):
+        return JsonResponse({'admitted': True})
+    admitted, wait = admit()
+    if admitted:
+        return grant_ticket(JsonResponse({'admitted': True}))
+    return JsonResponse({'admitted': False, 'retry_after': max(2, round(wait))})
+
+@never_cache
+def csrf_token(request):
+    """This browser's CSRF token, for pages rendered with a placeholder (see store.conditional)"""
+    return JsonResponse({'token': get_token(request)})
+
 def order_confirmation(request, order_id):
     """Order confirmation page"""
     order = get_object_or_404(Order, order_id=order_id)
@@ -370,11 +483,8 @@ def track_order(request):
     if request.method == 'POST':
         tracking_number = request.POST.get('tracking_number', '').strip()
         if tracking_number:
-            try:
-                order = Order.objects.get(
-                    Q(tracking_number=tracking_number) | Q(order_id=tracking_number)
-                )
-            except Order.DoesNotExist:
+            order = find_order(tracking_number)
+            if order is None:
                 error_message = "Order not found. Please check your tracking number and try again."
         else:
             error_message = "Please enter a tracking number."
@@ -385,11 +495,34 @@ def track_order(request):
     }
     return render(request, 'store/track_order.html', context)
 
+def my_orders(request):
+    """Order history for a phone number, unlocked with one order ID from that number"""
+    form = OrderHistoryForm(request.POST or None)
+    orders = None
+    status = 200
+    
+    if request.method == 'POST':
+        limit = getattr(settings, 'ORDER_HISTORY_RATE_LIMIT', 10)
+        window = getattr(settings, 'ORDER_HISTORY_RATE_WINDOW', 15 * 60)
+        if is_limited(f'my_orders:{get_client_ip(request)}', limit, window):
+            form.add_error(None, 'Too many attempts. Please try again in a few minutes.')
+            status = 429
+        elif form.is_valid():
+            orders = orders_for_phone(form.cleaned_data['phone_normalized']).only(
+                'order_id', 'tracking_number', 'created_at', 'status', 'total_amount'
+            )[:100]
+    
+    context = {
+        'form': form,
+        'orders': orders,
+    }
+    return render(request, 'store/my_orders.html', context, status=status)
+
 def order_tracking_details(request, tracking_number):
     """Detailed tracking page for a specific order"""
-    order = get_object_or_404(Order, 
-        Q(tracking_number=tracking_number) | Q(order_id=tracking_number)
-    )
+    order = find_order(tracking_number)
+    if order is None:
+        raise Http404('Order not found')
     
     # Get status history
     status_history = order.status_history.all()
@@ -442,26 +575,32 @@ def order_tracking_details(request, tracking_number):
     }
     return render(request, 'store/order_tracking_details.html', context)
 
+@conditional_page()
 def contact(request):
     """Contact page"""
     return render(request, 'store/contact.html')
 
+@conditional_page()
 def about(request):
     """About Us page"""
     return render(request, 'store/about.html')
 
+@conditional_page()
 def return_refund(request):
     """Return & Refund Policy page"""
     return render(request, 'store/return-refund.html')
 
+@conditional_page()
 def terms_conditions(request):
     """Terms & Conditions page"""
     return render(request, 'store/terms-conditions.html')
 
+@conditional_page()
 def cookie_policy(request):
     """Cookie Policy page"""
     return render(request, 'store/cookie-policy.html')
 
+@conditional_page()
 def privacy_policy(request):
     """Privacy Policy page"""
     return render(request, 'store/privacy-policy.html')
@@ -469,17 +608,8 @@ def privacy_policy(request):
 def buy_now(request, product_id):
     """Adds product to cart and redirects to checkout for direct purchase."""
     product = get_object_or_404(Product, id=product_id)
-    # Optionally clear cart for direct buy
-    if not request.session.session_key:
-        request.session.create()
-    cart_item, created = CartItem.objects.get_or_create(
-        session_key=request.session.session_key,
-        product=product,
-        defaults={'quantity': 1}
-    )
-    if not created:
-        cart_item.quantity = 1
-        cart_item.save()
-    # Optionally clear other cart items for true 'Buy Now' experience
-    CartItem.objects.filter(session_key=request.session.session_key).exclude(product=product).delete()
+    cart = get_cart(request)
+    # Clear other cart items for true 'Buy Now' experience
+    cart.clear()
+    cart.set_quantity(product.id, 1)
     return redirect('checkout')
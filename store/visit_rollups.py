@@ -0,0 +1,166 @@
+"""
+Daily visit rollups.
+
+Raw ``UserVisit`` rows (one per visitor per day) are folded into one
+``DailyVisitRollup`` per day: the visit count, HyperLogLog sketches of the
+visitor ids and IP addresses, the top landing pages and user-agent families.
+Every visit chart reads the rollups, and uniques over several days are
+estimated by merging the daily sketches.
+
+Raw rows are only needed until their day is rolled up for good; they are
+deleted after ``VISIT_RETENTION_DAYS`` by ``prune_visits()`` (called from
+``collect_garbage``), which rolls up any day it would otherwise lose first.
+"""
+import re
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .hyperloglog import HyperLogLog
+from .maintenance import delete_in_batches
+from .models import DailyVisitRollup, UserVisit
+from .traffic import BOT_PATTERN
+
+TOP_PAGES = 20
+
+# First match wins, so more specific browsers come before the ones they imitate
+USER_AGENT_FAMILIES = [
+    ('Bot', BOT_PATTERN),
+    ('Edge', re.compile(r'Edg(e|A|iOS)?/')),
+    ('Opera', re.compile(r'OPR/|Opera')),
+    ('Samsung Internet', re.compile(r'SamsungBrowser')),
+    ('Chrome', re.compile(r'Chrome/|CriOS/')),
+    ('Firefox', re.compile(r'Firefox/|FxiOS/')),
+    ('Safari', re.compile(r'Safari/')),
+]
+
+
+def user_agent_family(user_agent):
+    """Coarse browser family for a User-Agent header"""
+    if not user_agent:
+        return 'Unknown'
+    for family, pattern in USER_AGENT_FAMILIES:
+        if pattern.search(user_agent):
+            return family
+    return 'Other'
+
+
+def _day_end(day):
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def rollup_day(day):
+    """(Re)compute the rollup for one day from its raw visits and return it"""
+    sessions = HyperLogLog()
+    ips = HyperLogLog()
+    pages = Counter()
+    families = Counter()
+    visits = 0
+
+    rows = UserVisit.objects.filter(date=day).values_list('session_key', 'ip_address', 'page_visited', 'user_agent')
+    for session_key, ip_address, page, user_agent in rows.iterator(chunk_size=5000):
+        visits += 1
+        sessions.add(session_key)
+        ips.add(ip_address)
+        pages[page or '/'] += 1
+        families[user_agent_family(user_agent)] += 1
+
+    if not visits:
+        # Raw rows already pruned: keep the rollup made while they existed
+        existing = DailyVisitRollup.objects.filter(date=day).first()
+        if existing is not None:
+            return existing
+
+    rollup, _ = DailyVisitRollup.objects.update_or_create(
+        date=day,
+        defaults={
+            'visits': visits,
+            'unique_sessions': sessions.count(),
+            'unique_ips': ips.count(),
+            'session_sketch': bytes(sessions),
+            'ip_sketch': bytes(ips),
+            'top_pages': dict(pages.most_common(TOP_PAGES)),
+            'user_agent_families': dict(families),
+        }
+    )
+    return rollup
+
+
+def is_final(rollup):
+    """True once a rollup was computed after its day ended"""
+    return rollup.updated_at >= _day_end(rollup.date)
+
+
+def get_rollups(start, end):
+    """
+    Rollups for every day from start to end, keyed by date.
+
+    Missing days and days that were rolled up before they ended are
+    recomputed from the raw rows; today's rollup is refreshed once it is
+    older than VISIT_ROLLUP_MAX_AGE seconds. Days without visits are absent.
+    """
+    now = timezone.now()
+    max_age = timedelta(seconds=getattr(settings, 'VISIT_ROLLUP_MAX_AGE', 300))
+    rollups = {rollup.date: rollup for rollup in DailyVisitRollup.objects.filter(date__range=(start, end))}
+
+    stale = []
+    day = start
+    while day <= end:
+        rollup = rollups.get(day)
+        if rollup is None or (not is_final(rollup) and now - rollup.updated_at > max_age):
+            stale.append(day)
+        day += timedelta(days=1)
+
+    if stale:
+        # Only days that still have raw visits can be computed
+        with_visits = set(
+            UserVisit.objects.filter(date__in=stale).order_by().values_list('date', flat=True).distinct()
+        )
+        for day in stale:
+            if day in with_visits:
+                rollups[day] = rollup_day(day)
+    return rollups
+
+
+def summarize(rollups):
+    """Totals over several daily rollups, merging their sketches for the uniques"""
+    sessions = HyperLogLog()
+    ips = HyperLogLog()
+    pages = Counter()
+    families = Counter()
+    visits = 0
+    for rollup in rollups:
+        visits += rollup.visits
+        sessions.merge(HyperLogLog.from_bytes(bytes(rollup.session_sketch)))
+        ips.merge(HyperLogLog.from_bytes(bytes(rollup.ip_sketch)))
+        pages.update(rollup.top_pages)
+        families.update(rollup.user_agent_families)
+    return {
+        'visits': visits,
+        'unique_visitors': sessions.count() if visits else 0,
+        'unique_ips': ips.count() if visits else 0,
+        'top_pages': pages.most_common(10),
+        'user_agent_families': families.most_common(),
+    }
+
+
+def prune_visits(batch_size=None, max_batches=None, pause=0, today=None):
+    """
+    Delete raw visits older than VISIT_RETENTION_DAYS and return how many went.
+
+    Days that have no final rollup yet are rolled up before their rows go.
+    """
+    today = today or timezone.now().date()
+    cutoff = today - timedelta(days=getattr(settings, 'VISIT_RETENTION_DAYS', 90))
+    old_visits = UserVisit.objects.filter(date__lt=cutoff)
+
+    days = set(old_visits.order_by().values_list('date', flat=True).distinct())
+    final = {
+        rollup.date for rollup in DailyVisitRollup.objects.filter(date__in=days) if is_final(rollup)
+    }
+    for day in sorted(days - final):
+        rollup_day(day)
+
+    return delete_in_batches(old_visits, batch_size=batch_size, max_batches=max_batches, pause=pause)